@@ -0,0 +1,341 @@
+"""
+The Batch Allocation Engine --
+
+Takes as input a list of 'Allocation' objects (One per identity).
+Returns as output one 'AllocationResult' per allocation, in the same order.
+
+Every InstanceHistory of every allocation is flattened into a HistoryTable
+(NumPy columns of epoch microseconds, status codes and cpu/ram/disk) and
+clock time, rule-weighted runtime and burn rate are calculated for every
+history/time-period pair in one pass.
+
+The numbers match allocation.engine.calculate_allocation, with one
+exception: histories that used no time (and do not burn) in a period are
+left out of that period's InstanceResult.history_list.
+"""
+import numpy as np
+import pytz
+
+from django.utils.timezone import timedelta, datetime
+
+from threepio import logger
+
+from allocation.engine import get_allocation_window
+from allocation.models import AllocationResult, GlobalRule, InstanceRule,\
+    InstanceHistoryResult, InstanceResult, IgnoreStatusRule,\
+    IgnoreMachineRule, IgnoreProviderRule, MultiplyBurnTime,\
+    MultiplySizeCPU, MultiplySizeRAM, MultiplySizeDisk, CompiledRules
+
+EPOCH = datetime(1970, 1, 1).replace(tzinfo=pytz.utc)
+ONE_SECOND = 10 ** 6
+# Used in place of 'end_date=None' (The history is still running)
+OPEN_END = np.iinfo(np.int64).max
+# Rules that _apply_rule can apply to a column of histories
+VECTORIZED_RULES = (IgnoreStatusRule, IgnoreMachineRule, IgnoreProviderRule,
+                    MultiplyBurnTime, MultiplySizeCPU, MultiplySizeRAM,
+                    MultiplySizeDisk)
+
+
+def to_epoch_us(date):
+    """
+    Convert a timezone-aware datetime to microseconds since the epoch.
+    """
+    delta = date - EPOCH
+    return (delta.days * 86400 + delta.seconds) * ONE_SECOND\
+        + delta.microseconds
+
+
+def _as_list(value):
+    if not isinstance(value, list):
+        return [value]
+    return value
+
+
+class HistoryTable(object):
+
+    """
+    Column-oriented representation of every InstanceHistory in a list
+    of allocations. Row 'n' of every column describes the same history.
+    owner - Index of the allocation (identity) that owns the history
+    instance - Index into 'instances'
+    start, end - Epoch microseconds (end == OPEN_END for current history)
+    status - Index into 'status_names'
+    cpu, ram, disk - Size of the history
+    NOTE: Rows are expected to be ordered by owner.
+    """
+
+    def __init__(self, owner, instance, start, end, status, cpu, ram, disk,
+                 instances, status_names, histories=None):
+        self.owner = np.asarray(owner, dtype=np.int64)
+        self.instance = np.asarray(instance, dtype=np.int64)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.status = np.asarray(status, dtype=np.int64)
+        self.cpu = np.asarray(cpu, dtype=np.float64)
+        self.ram = np.asarray(ram, dtype=np.float64)
+        self.disk = np.asarray(disk, dtype=np.float64)
+        self.instances = instances
+        self.status_names = status_names
+        # Only required by rules that cannot be vectorized.
+        self.histories = histories
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_allocations(cls, allocations):
+        owner, instance, start, end, status = [], [], [], [], []
+        cpu, ram, disk = [], [], []
+        instances, histories = [], []
+        status_codes = {}
+        for owner_idx, allocation in enumerate(allocations):
+            for alloc_instance in allocation.instances:
+                instance_idx = len(instances)
+                instances.append(alloc_instance)
+                for history in alloc_instance.history:
+                    code = status_codes.setdefault(
+                        history.status, len(status_codes))
+                    owner.append(owner_idx)
+                    instance.append(instance_idx)
+                    start.append(to_epoch_us(history.start_date))
+                    end.append(to_epoch_us(history.end_date)
+                               if history.end_date else OPEN_END)
+                    status.append(code)
+                    cpu.append(history.size.cpu)
+                    ram.append(history.size.ram)
+                    disk.append(history.size.disk)
+                    histories.append(history)
+        status_names = sorted(status_codes, key=status_codes.get)
+        return cls(owner, instance, start, end, status, cpu, ram, disk,
+                   instances, status_names, histories)
+
+
+# Main ###
+def calculate_allocations(allocations, print_logs=False):
+    """
+    Batch version of allocation.engine.calculate_allocation
+    """
+    table = HistoryTable.from_allocations(allocations)
+    results, instance_rules = [], []
+    for allocation in allocations:
+        result, rules = _prepare_result(allocation)
+        results.append(result)
+        instance_rules.append(rules)
+
+    time_per_second = _running_time_per_second(table, instance_rules)
+    period_totals = _calculate_time_periods(
+        table, results, time_per_second, print_logs=print_logs)
+
+    for result, totals in zip(results, period_totals):
+        _apply_carry_forward(result, totals, print_logs=print_logs)
+    return results
+
+
+def _prepare_result(allocation):
+    """
+    Apply all global rules to a new AllocationResult,
+    and return the instance rules seperately.
+    """
+    (window_start_date, window_end_date) = get_allocation_window(allocation)
+    current_result = AllocationResult(
+        allocation, window_start_date, window_end_date,
+        force_interval_every=allocation.interval_delta)
+    instance_rules = []
+    for rule in allocation.rules:
+        if issubclass(rule.__class__, GlobalRule):
+            rule.apply_global_rule(allocation, current_result)
+        elif issubclass(rule.__class__, InstanceRule):
+            instance_rules.append(rule)
+        else:
+            raise Exception("Unknown Type of Rule: %s" % rule)
+    return current_result, instance_rules
+
+
+def _running_time_per_second(table, instance_rules):
+    """
+    Time used (In microseconds) for every second a history is running.
+    Rules are applied in order, one rule to all rows of an owner at a time.
+    Owners with rules that cannot be vectorized use CompiledRules instead.
+    """
+    time_per_second = np.full(len(table), ONE_SECOND, dtype=np.float64)
+    if not len(table):
+        return time_per_second.astype(np.int64)
+    # Rows are grouped by owner, in owner order.
+    bounds = np.searchsorted(table.owner,
+                             np.arange(len(instance_rules) + 1))
+    for owner_idx, rules in enumerate(instance_rules):
+        rows = slice(bounds[owner_idx], bounds[owner_idx + 1])
+        if not all(rule.__class__ in VECTORIZED_RULES for rule in rules):
+            time_per_second[rows] = _apply_compiled_rules(
+                CompiledRules(rules), table, rows)
+            continue
+        for rule in rules:
+            time_per_second[rows] = _apply_rule(
+                rule, table, rows, time_per_second[rows])
+    return time_per_second.astype(np.int64)
+
+
+def _apply_rule(rule, table, rows, running_time):
+    """
+    Vectorized InstanceRule.apply_rule
+    Running time is rounded to the microsecond after every rule,
+    just like the timedelta it replaces.
+    """
+    rule_class = rule.__class__
+    if rule_class == IgnoreStatusRule:
+        ignored = [code for code, name in enumerate(table.status_names)
+                   if name in _as_list(rule.value)]
+        return np.where(np.in1d(table.status[rows], ignored),
+                        0, running_time)
+    elif rule_class in (IgnoreMachineRule, IgnoreProviderRule):
+        attr = 'machine' if rule_class == IgnoreMachineRule else 'provider'
+        values = _as_list(rule.value)
+        ignored = [idx for idx in np.unique(table.instance[rows])
+                   if getattr(table.instances[idx], attr).identifier
+                   in values]
+        return np.where(np.in1d(table.instance[rows], ignored),
+                        0, running_time)
+    elif rule_class == MultiplyBurnTime:
+        return np.round(running_time * rule.multiplier)
+    elif rule_class == MultiplySizeCPU:
+        return np.round(running_time * (rule.multiplier * table.cpu[rows]))
+    elif rule_class == MultiplySizeRAM:
+        return np.round(running_time * (rule.multiplier * table.ram[rows]))
+    elif rule_class == MultiplySizeDisk:
+        return np.round(running_time * (rule.multiplier * table.disk[rows]))
+    raise ValueError("Rule %s cannot be vectorized." % rule)
+
+
+def _apply_compiled_rules(compiled_rules, table, rows):
+    """
+    Fallback for rules that cannot be vectorized:
+    Look up (or dynamically evaluate) the rules for every history.
+    """
+    if table.histories is None:
+        raise ValueError("Rules %s cannot be vectorized and the HistoryTable "
+                         "does not include the histories."
+                         % compiled_rules.dynamic_rules)
+    row_ids = np.arange(len(table))[rows]
+    new_time = np.empty(len(row_ids), dtype=np.float64)
+    for idx, row in enumerate(row_ids):
+        new_time[idx] = _timedelta_to_us(
+            compiled_rules.running_time_per_second(
+                table.instances[table.instance[row]], table.histories[row]))
+    return new_time
+
+
+def _timedelta_to_us(delta):
+    return (delta.days * 86400 + delta.seconds) * ONE_SECOND\
+        + delta.microseconds
+
+
+def _multiply_time(clock_time, time_per_second):
+    """
+    Vectorized engine._multiply_time_delta (In microseconds)
+    Whole-second rates are multiplied exactly.
+    """
+    whole_seconds = time_per_second % ONE_SECOND == 0
+    exact = clock_time * (time_per_second // ONE_SECOND)
+    rounded = np.round(
+        clock_time * (time_per_second / float(ONE_SECOND))).astype(np.int64)
+    return np.where(whole_seconds, exact, rounded)
+
+
+def _calculate_time_periods(table, results, time_per_second,
+                            print_logs=False):
+    """
+    Pair every history with every time period of its owner,
+    then fill in the instance_results of each TimePeriodResult.
+    Returns the total runtime (In microseconds) of every period, by owner.
+    """
+    periods = [period for result in results for period in result.time_periods]
+    period_count = np.array([len(result.time_periods) for result in results],
+                            dtype=np.int64)
+    period_offset = np.cumsum(period_count) - period_count
+    period_start = np.array(
+        [to_epoch_us(period.counting_from()) for period in periods],
+        dtype=np.int64)
+    period_stop = np.array(
+        [to_epoch_us(period.stop_counting_date) for period in periods],
+        dtype=np.int64)
+
+    # One row per (history, period of the history's owner)
+    pairs = period_count[table.owner]
+    row = np.repeat(np.arange(len(table)), pairs)
+    first_pair = np.repeat(np.cumsum(pairs) - pairs, pairs)
+    period = period_offset[table.owner[row]] + np.arange(len(row)) - first_pair
+
+    start, end = table.start[row], table.end[row]
+    start_date, stop_date = period_start[period], period_stop[period]
+    # NOTE: Same sanity checks as engine._get_clock_time
+    outside = (end < start_date) | (start > stop_date)
+    clock_time = np.where(
+        outside, 0,
+        np.minimum(end, stop_date) - np.maximum(start, start_date))
+    used = clock_time != 0
+    running_time = np.where(
+        used, _multiply_time(clock_time, time_per_second[row]), 0)
+    # NOTE: Same test as engine._get_burn_rate_test
+    burning = used & (start <= stop_date) & (end >= stop_date)
+    burn_rate = np.where(burning, time_per_second[row], 0)
+
+    period_runtime = np.zeros(len(periods), dtype=np.int64)
+    keep = np.flatnonzero(used | burning)
+    np.add.at(period_runtime, period[keep], running_time[keep])
+
+    # Group by period, then instance, then history order.
+    keep = keep[np.lexsort((row[keep], table.instance[row[keep]],
+                            period[keep]))]
+    _fill_instance_results(
+        table, periods, keep, row, period,
+        clock_time, running_time, burn_rate)
+    if print_logs:
+        logger.debug("Batch engine evaluated %s history/period pairs "
+                     "for %s allocations" % (len(row), len(results)))
+    return [period_runtime[offset:offset + count]
+            for offset, count in zip(period_offset, period_count)]
+
+
+def _fill_instance_results(table, periods, keep, row, period,
+                           clock_time, running_time, burn_rate):
+    for time_period in periods:
+        time_period.instance_results = []
+    current_key = None
+    history_list = None
+    for pair in keep:
+        history_row = row[pair]
+        instance_idx = table.instance[history_row]
+        key = (period[pair], instance_idx)
+        if key != current_key:
+            current_key = key
+            history_list = []
+            periods[period[pair]].instance_results.append(InstanceResult(
+                identifier=table.instances[instance_idx].identifier,
+                history_list=history_list))
+        history_list.append(InstanceHistoryResult(
+            status_name=table.status_names[table.status[history_row]],
+            clock_time=timedelta(microseconds=int(clock_time[pair])),
+            total_time=timedelta(microseconds=int(running_time[pair])),
+            burn_rate=timedelta(microseconds=int(burn_rate[pair]))))
+
+
+def _apply_carry_forward(current_result, period_runtime, print_logs=False):
+    """
+    Carry forward the difference between TimePeriods, in order.
+    """
+    if not current_result.carry_forward:
+        return
+    time_forward = timedelta(0)
+    for current_period, runtime in zip(current_result.time_periods,
+                                       period_runtime):
+        if time_forward:
+            current_period.increase_credit(time_forward, carry_forward=True)
+        runtime = timedelta(microseconds=int(runtime))
+        if current_period.checkpoint:
+            runtime += current_period.checkpoint.runtime
+        # NOTE: Same as 'carrying forward' allocation_difference()
+        time_forward = current_period.total_credit - runtime
+        if print_logs:
+            logger.debug("> > %s - %s = %s"
+                         % (current_period.total_credit, runtime,
+                            time_forward))
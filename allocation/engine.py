@@ -9,7 +9,12 @@ TODO: Refactor #1 - have one AllocationResult PER INSTANCE so that each can be
 
     #TODO: Do we have rules that 'use time' that are NOT
     # directed at instances? (Global?)
+
+NOTE: A TimePeriodResult only includes the InstanceResults (and histories)
+      that overlap the time period.
 """
+from itertools import groupby
+
 import pytz
 
 from django.utils.timezone import timedelta, datetime
@@ -17,7 +22,7 @@ from django.utils.timezone import timedelta, datetime
 from threepio import logger
 
 from allocation.models import AllocationResult, GlobalRule, InstanceResult,\
-    InstanceRule, InstanceHistoryResult
+    InstanceRule, InstanceHistoryResult, CompiledRules
 
 
 def _get_zero_date_utc():
@@ -48,6 +53,19 @@ def get_allocation_window(allocation,
     return window_start_date, window_end_date
 
 
+def get_counting_start(allocation):
+    """
+    Returns the earliest date that InstanceHistory will be counted from,
+    taking the allocation checkpoints into account.
+    """
+    (window_start_date, window_end_date) = get_allocation_window(allocation)
+    current_result = AllocationResult(
+        allocation, window_start_date, window_end_date,
+        force_interval_every=allocation.interval_delta)
+    return min(period.counting_from()
+               for period in current_result.time_periods)
+
+
 # Main ###
 def calculate_allocation(allocation, print_logs=False):
     (window_start_date, window_end_date) = get_allocation_window(allocation)
@@ -73,6 +91,10 @@ def calculate_allocation(allocation, print_logs=False):
             instance_rules.append(rule)
         else:
             raise Exception("Unknown Type of Rule: %s" % rule)
+    # Instance rules are evaluated once per (status, size, machine, provider)
+    compiled_rules = CompiledRules(instance_rules)
+    sweep = _sweep_histories(allocation.instances)
+    next(sweep)
     time_forward = timedelta(0)
     for current_period in current_result.time_periods:
         if current_result.carry_forward and time_forward:
@@ -80,24 +102,26 @@ def calculate_allocation(allocation, print_logs=False):
 
         if print_logs:
             logger.debug("> New TimePeriodResult: %s" % current_period)
+            if current_period.checkpoint:
+                logger.debug("> > Counting from %s"
+                             % current_period.checkpoint)
             if current_period.total_credit > timedelta(0):
                 logger.debug("> > Allocation Increased: %s"
                              % current_period.total_credit)
-        # Second loop - Go through all the instances and apply
-        #              the specific rules (This loop relates to time USED)
+        # Second loop - Go through the instances with history in this period
+        #              and apply the specific rules (This loop relates to
+        #              time USED)
         instance_results = []
 
-        for instance in allocation.instances:
+        for instance, histories in sweep.send(current_period):
             # "Chatty" Warning - Uncomment at your own risk
             # logger.debug("> > Calculating Instance history:%s"
             #             % instance.identifier)
             history_list = _calculate_instance_history_list(
-                instance, instance_rules,
-                current_period.start_counting_date,
+                instance, compiled_rules,
+                current_period.counting_from(),
                 current_period.stop_counting_date,
-                print_logs=print_logs)
-            if not history_list:
-                continue
+                print_logs=print_logs, histories=histories)
             instance_result = InstanceResult(
                 identifier=instance.identifier, history_list=history_list)
             instance_results.append(instance_result)
@@ -127,16 +151,63 @@ def _multiply_time_delta(timedelta1, timedelta2):
     return timedelta(seconds=time_seconds)
 
 
+def _sweep_histories(instances):
+    """
+    A coroutine that is sent every TimePeriodResult, in order.
+    The histories of all instances are sorted by start_date once, a cursor
+    moves forward as the periods are sent, and each history is only
+    visited by the periods it overlaps.
+    Yields [(instance, [history, ...]), ...] for the period sent,
+    in the same order as 'instances' and 'instance.history'.
+    """
+    histories = sorted(
+        (history.start_date, instance_idx, history_idx)
+        for instance_idx, instance in enumerate(instances)
+        for history_idx, history in enumerate(instance.history))
+    cursor = 0
+    # Histories that started before the last period ended
+    running = []
+    overlapping = []
+    while True:
+        time_period = yield overlapping
+        start_date = time_period.counting_from()
+        end_date = time_period.stop_counting_date
+        while cursor < len(histories) and histories[cursor][0] < end_date:
+            running.append(histories[cursor][1:])
+            cursor += 1
+        # Histories that ended are not in this period, or any that follow.
+        running = [(instance_idx, history_idx)
+                   for instance_idx, history_idx in running
+                   if not instances[instance_idx].history[history_idx]
+                   .end_date
+                   or instances[instance_idx].history[history_idx]
+                   .end_date > start_date]
+        overlapping = []
+        if start_date >= end_date:
+            continue
+        for instance_idx, group in groupby(sorted(running),
+                                           key=lambda key: key[0]):
+            instance = instances[instance_idx]
+            overlapping.append(
+                (instance, [instance.history[history_idx]
+                            for _, history_idx in group]))
+
+
 def _calculate_instance_history_list(instance, rules, start_date, end_date,
-                                     print_logs=False):
+                                     print_logs=False, histories=None):
     """
-    Given an instance and a set of 'InstanceRules'
+    Given an instance and a set of 'InstanceRules' (or 'CompiledRules')
     Calculate the time used for every history
+    (Or only 'histories', when given)
     """
+    if not isinstance(rules, CompiledRules):
+        rules = CompiledRules(rules)
+    if histories is None:
+        histories = instance.history
     # Calculate time used by applying rules to each history and keeping a
     # running total for each status
     history_list = []
-    for history in instance.history:
+    for history in histories:
         history_result = InstanceHistoryResult(status_name=history.status)
         if history.end_date and history.end_date < start_date:
             history_result.clock_time = timedelta(0)
@@ -155,7 +226,7 @@ def _calculate_instance_history_list(instance, rules, start_date, end_date,
         # NOTE: There are some limitations to an implementation like this
         #       Ex: A rule that starts 'halfway' between start and end date
         #          (Is that a thing?)
-        time_per_second = _running_time_per_second(history, instance, rules)
+        time_per_second = rules.running_time_per_second(instance, history)
         running_time = _multiply_time_delta(clock_time, time_per_second)
         history_result.clock_time += clock_time
         history_result.total_time += running_time
@@ -218,12 +289,3 @@ def _get_clock_time(instance_history, start_date, end_date, print_logs=True):
         logger.debug(">> Clock time: %s - %s = %s"
                      % (use_end, use_start, clock_time))
     return clock_time
-
-
-def _running_time_per_second(history, instance, rules):
-    running_time = timedelta(seconds=1)
-    for rule in rules:
-        # Each rule is given the previous running_time, and
-        # returns it as a result
-        running_time = rule.apply_rule(instance, history, running_time)
-    return running_time
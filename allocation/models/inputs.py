@@ -6,6 +6,7 @@ TODO: 'Duck-Type' to pull all required attributes from a
       To make initializing these models 100x easier!
 """
 import calendar
+from hashlib import md5
 
 import pytz
 
@@ -95,20 +96,38 @@ class Instance(object):
         self.history = history
 
     @classmethod
-    def from_core(cls, core_instance, start_date=None):
+    def from_core(cls, core_instance, start_date=None,
+                  history_list=None, sizes=None):
+        """
+        history_list - Pre-loaded InstanceStatusHistory (ordered by
+                       start_date) to use instead of querying the instance
+        sizes - dict of core Size id -> Size, shared between calls
+        """
         source = core_instance.source.current_source
         prov = Provider.from_core(source.provider)
         mach = Machine.from_core(source)
         instance_history = []
-        if not start_date:
+        if sizes is None:
+            sizes = {}
+        if history_list is not None:
+            history_list = [history for history in history_list
+                            if not start_date or not history.end_date
+                            or history.end_date > start_date]
+        elif not start_date:
             # Full list
-            history_list = core_instance.instancestatushistory_set.all()
+            history_list = core_instance.instancestatushistory_set\
+                .all().order_by('start_date')
         else:
             # Shorter list
             history_list = core_instance.instancestatushistory_set.filter(
-                Q(end_date=None) | Q(end_date__gt=start_date))
-        for history in history_list.order_by('start_date'):
-            alloc_history = InstanceHistory.from_core(history)
+                Q(end_date=None) | Q(end_date__gt=start_date))\
+                .order_by('start_date')
+        for history in history_list:
+            size = sizes.get(history.size_id)
+            if not size:
+                size = Size.from_core(history.size)
+                sizes[history.size_id] = size
+            alloc_history = InstanceHistory.from_core(history, size=size)
             instance_history.append(alloc_history)
 
         # Create the Allocation.Instance object.
@@ -137,7 +156,7 @@ class InstanceHistory(object):
         if not size:
             size = Size.from_core(core_history.size)
 
-        return cls(status=core_history.status.name, size=size,
+        return cls(status=core_history.status_name, size=size,
                    start_date=core_history.start_date,
                    end_date=core_history.end_date)
 
@@ -254,10 +273,35 @@ class AllocationRecharge(AllocationIncrease):
                 (self.get_credit(), self.recharge_date))
 
 
+class Checkpoint(object):
+
+    """
+    A Checkpoint represents the time already used in the TimePeriod starting
+    on 'start_date', counted up to the 'as_of' date.
+    When a matching Checkpoint is given, the engine only counts
+    InstanceHistory from 'as_of' onward.
+    """
+
+    def __init__(self, start_date, as_of, runtime, burn_rate=timedelta(0)):
+        validate_interval(start_date, as_of)
+        self.start_date = start_date
+        self.as_of = as_of
+        self.runtime = runtime
+        self.burn_rate = burn_rate
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return ("<Checkpoint: Period Starting:%s Runtime:%s As Of:%s>" %
+                (self.start_date, self.runtime, self.as_of))
+
+
 class Allocation(object):
 
     def __init__(self, credits, rules, instances,
-                 start_date, end_date, interval_delta=None):
+                 start_date, end_date, interval_delta=None,
+                 checkpoints=None):
         validate_interval(start_date, end_date)
         # TODO: Sort so that Recharges happen PRIOR to Increases on EQUAL dates
         self.credits = credits
@@ -266,6 +310,27 @@ class Allocation(object):
         self.start_date = start_date
         self.end_date = end_date
         self.interval_delta = interval_delta
+        if not checkpoints:
+            checkpoints = []
+        self.checkpoints = checkpoints
+
+    def signature(self):
+        """
+        A hash of every input (except instances and end_date) that changes
+        how time is counted. Checkpoints are only valid for an allocation
+        with the same signature: Changing the rules, the credits
+        (thresholds) or the strategy will invalidate them.
+        """
+        rules = [(rule.__class__.__name__, rule.name,
+                  getattr(rule, 'value', None),
+                  getattr(rule, 'multiplier', None))
+                 for rule in self.rules]
+        credits = [(credit.__class__.__name__, credit.unit, credit.amount,
+                    credit.increase_date)
+                   for credit in self.credits]
+        return md5(repr(
+            (rules, credits, self.start_date, self.interval_delta))
+        ).hexdigest()
 
     def __repr__(self):
         return self.__unicode__()
@@ -6,7 +6,8 @@ from django.utils.timezone import timedelta, datetime, now, utc
 
 from allocation import validate_interval
 from allocation.models.inputs import \
-    AllocationIncrease, AllocationRecharge, AllocationUnlimited, Allocation
+    AllocationIncrease, AllocationRecharge, AllocationUnlimited, Allocation,\
+    Checkpoint
 
 
 class InstanceHistoryResult(object):
@@ -76,6 +77,81 @@ class TimePeriodResult(object):
         self.start_counting_date = start_date
         self.stop_counting_date = end_date
 
+        # Time used PRIOR to the checkpoint is not counted again
+        self.checkpoint = None
+
+    def counting_from(self):
+        """
+        The date to start counting InstanceHistory from.
+        """
+        if self.checkpoint:
+            return self.checkpoint.as_of
+        return self.start_counting_date
+
+    def use_checkpoint(self, checkpoint):
+        """
+        Use the checkpoint if it was made for this TimePeriod.
+        """
+        if checkpoint.start_date != self.start_counting_date:
+            return False
+        if checkpoint.as_of > self.stop_counting_date:
+            return False
+        self.checkpoint = checkpoint
+        return True
+
+    def create_checkpoint(self, as_of=None):
+        """
+        Create a Checkpoint for the time used in this TimePeriod.
+        When 'as_of' is before the stop_counting_date, the time counted
+        after 'as_of' (at the burn rate of each history) is left out.
+        """
+        if not as_of or as_of >= self.stop_counting_date:
+            return Checkpoint(self.start_counting_date,
+                              self.stop_counting_date,
+                              self.total_instance_runtime(),
+                              self.get_burn_rate())
+        # NOTE: Same as the running time counted from 'as_of' by the engine
+        remaining = (self.stop_counting_date - as_of).total_seconds()
+        runtime = self.total_instance_runtime()
+        for instance_result in self.instance_results:
+            for history_result in instance_result.history_list:
+                runtime -= timedelta(
+                    seconds=remaining *
+                    history_result.burn_rate.total_seconds())
+        return Checkpoint(self.start_counting_date, as_of, runtime,
+                          self.get_burn_rate())
+
+    def all_instance_results(self, instances):
+        """
+        The instance_results of every instance (with any history) and every
+        history of 'instances', those outside of the TimePeriod counted as
+        no time. (The engine only lists the histories overlapping it)
+        """
+        start_date = self.counting_from()
+        end_date = self.stop_counting_date
+        counted = dict((instance_result.identifier,
+                        iter(instance_result.history_list))
+                       for instance_result in self.instance_results)
+        instance_results = []
+        for instance in instances:
+            if not instance.history:
+                continue
+            history_results = counted.get(instance.identifier, iter(()))
+            history_list = []
+            for history in instance.history:
+                # NOTE: Same as the overlap of allocation.engine
+                if start_date < end_date\
+                        and history.start_date < end_date\
+                        and (not history.end_date or
+                             history.end_date > start_date):
+                    history_list.append(next(history_results))
+                else:
+                    history_list.append(
+                        InstanceHistoryResult(status_name=history.status))
+            instance_results.append(
+                InstanceResult(instance.identifier, history_list))
+        return instance_results
+
     def time_to_zero(self):
         """
         Knowing the 'burn_rate', the total credit, and the stop_counting_date,
@@ -115,6 +191,10 @@ class TimePeriodResult(object):
         return ttz_datetime
 
     def get_burn_rate(self):
+        if self.checkpoint and\
+                self.checkpoint.as_of == self.stop_counting_date:
+            # Nothing was counted after the checkpoint.
+            return self.checkpoint.burn_rate
         burnrate = timedelta(0)
         for instance_result in self.instance_results:
             burnrate += instance_result.get_burn_rate()
@@ -156,6 +236,8 @@ class TimePeriodResult(object):
         Count the total_time from each status result, for each instance result.
         """
         total_runtime = timedelta(0)
+        if self.checkpoint:
+            total_runtime += self.checkpoint.runtime
         for instance_result in self.instance_results:
             for status_result in instance_result.history_list:
                 total_runtime += status_result.total_time
@@ -213,6 +295,41 @@ class AllocationResult():
                 force_interval_every)
         else:
             self.time_periods = self._time_periods_by_allocation()
+        self._use_checkpoints(allocation.checkpoints)
+
+    def _use_checkpoints(self, checkpoints):
+        for checkpoint in checkpoints:
+            for period in self.time_periods:
+                if period.use_checkpoint(checkpoint):
+                    break
+
+    def create_checkpoints(self, as_of=None):
+        """
+        Create a Checkpoint for every TimePeriod that started counting
+        by 'as_of' (Default: now). The period that is still open is counted
+        up to 'as_of', unless a history starts or ends after 'as_of' in that
+        period (The time it counted after 'as_of' is then unknown).
+        """
+        if not as_of:
+            as_of = now()
+        checkpoints = []
+        for period in self.time_periods:
+            if period.stop_counting_date <= as_of:
+                checkpoints.append(period.create_checkpoint())
+            elif period.counting_from() <= as_of and\
+                    not self._changes_after(as_of, period.stop_counting_date):
+                checkpoints.append(period.create_checkpoint(as_of))
+        return checkpoints
+
+    def _changes_after(self, as_of, end_date):
+        for instance in self.allocation.instances:
+            for history in instance.history:
+                if as_of < history.start_date < end_date:
+                    return True
+                if history.end_date and\
+                        as_of < history.end_date < end_date:
+                    return True
+        return False
 
     def total_runtime(self):
         runtime = timedelta(0)
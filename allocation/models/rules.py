@@ -12,10 +12,22 @@ TODO: We have 'Ignore*Rule', it might be nice to have a 'Match*Rule' class
 """
 from abc import ABCMeta
 
+from django.utils.timezone import timedelta
+
 from threepio import logger
 
 
 # Utils
+# The attributes an InstanceRule can be compiled on
+RULE_KEYS = {
+    'status': lambda instance, history: history.status,
+    'size': lambda instance, history: (history.size.cpu, history.size.ram,
+                                       history.size.disk),
+    'machine': lambda instance, history: instance.machine.identifier,
+    'provider': lambda instance, history: instance.provider.identifier,
+}
+
+
 def _needle_in_haystack(haystack, needle):
     for value in haystack:
         if value == needle:
@@ -44,7 +56,11 @@ class GlobalRule(Rule):
 class InstanceRule(Rule):
 
     """
+    compile_on - The attributes (See: RULE_KEYS) that apply_rule depends on,
+                 or None if the rule can only be evaluated dynamically.
+                 Only used if defined along apply_rule, by the same class.
     """
+    compile_on = None
 
     def apply_rule(self, instance, history, running_time, print_logs=False):
         raise NotImplementedError("Should be implemented by subclass.")
@@ -116,6 +132,8 @@ class InstanceMultiplierRule(InstanceCountingRule):
 # Types of 'FilterOutRule'
 class IgnoreStatusRule(FilterOutRule):
 
+    compile_on = ('status',)
+
     def __init__(self, name, value):
         super(IgnoreStatusRule, self).__init__(name, value)
         self.instance_attr = 'status'
@@ -146,6 +164,8 @@ class IgnoreStatusRule(FilterOutRule):
 
 class IgnoreMachineRule(FilterOutRule):
 
+    compile_on = ('machine',)
+
     def __init__(self, name, value):
         super(IgnoreMachineRule, self).__init__(name, value)
         self.instance_attr = 'machine'
@@ -175,6 +195,8 @@ class IgnoreMachineRule(FilterOutRule):
 
 class IgnoreProviderRule(FilterOutRule):
 
+    compile_on = ('provider',)
+
     def _validate_value(self, value):
         if not isinstance(value, str):
             raise Exception("Expects a provider UUID to be matched on "
@@ -206,6 +228,8 @@ class IgnoreProviderRule(FilterOutRule):
 # Types of 'InstanceCountingRule'
 class MultiplyBurnTime(InstanceMultiplierRule):
 
+    compile_on = ()
+
     def apply_rule(self, instance, history, running_time, print_logs=False):
         """
         Multiply the running_time by (multiplier) to adjust the overall burn
@@ -224,6 +248,8 @@ class MultiplyBurnTime(InstanceMultiplierRule):
 
 class MultiplySizeCPU(InstanceMultiplierRule):
 
+    compile_on = ('size',)
+
     def apply_rule(self, instance, history, running_time, print_logs=False):
         """
         Multiply the running_time by size of CPU * (multiplier)
@@ -246,6 +272,7 @@ class MultiplySizeDisk(InstanceMultiplierRule):
     """
     Units here are ALWAYS in GB
     """
+    compile_on = ('size',)
 
     def apply_rule(self, instance, history, running_time, print_logs=False):
         """
@@ -273,6 +300,7 @@ class MultiplySizeRAM(InstanceMultiplierRule):
     Instance 1 : 10 hours used * 8GB = 80 Hours
                  ( unit:(1/1024MB) * value:8*1024 MBs)
     """
+    compile_on = ('size',)
 
     def _gb_to_mb(gb_size):
         return gb_size * 1024
@@ -296,3 +324,63 @@ class MultiplySizeRAM(InstanceMultiplierRule):
 
     def __init__(self, name, multiplier):
         super(MultiplySizeRAM, self).__init__(name, multiplier)
+
+
+# Compiled 'InstanceRule's
+class CompiledRules(object):
+
+    """
+    A list of InstanceRules, compiled once per allocation.
+    The running time (per second) of the rules applied in order is cached
+    by the attributes (status, size, machine, provider) the rules depend on.
+    Rules after the first rule that cannot be compiled are applied
+    to every history, dynamically.
+    """
+
+    def __init__(self, rules):
+        self.compiled_rules = []
+        self.dynamic_rules = []
+        for rule in rules:
+            if self.dynamic_rules or _compile_on(rule) is None:
+                self.dynamic_rules.append(rule)
+            else:
+                self.compiled_rules.append(rule)
+        attrs = sorted(set(attr for rule in self.compiled_rules
+                           for attr in _compile_on(rule)))
+        self._key_functions = [RULE_KEYS[attr] for attr in attrs]
+        self._table = {}
+
+    def is_compiled(self):
+        return not self.dynamic_rules
+
+    def _key(self, instance, history):
+        return tuple(key_function(instance, history)
+                     for key_function in self._key_functions)
+
+    def running_time_per_second(self, instance, history):
+        key = self._key(instance, history)
+        if key not in self._table:
+            self._table[key] = _apply_rules(
+                self.compiled_rules, instance, history,
+                timedelta(seconds=1))
+        return _apply_rules(
+            self.dynamic_rules, instance, history, self._table[key])
+
+
+def _compile_on(rule):
+    """
+    The compile_on of the class defining the apply_rule of 'rule'.
+    (A subclass overriding apply_rule may depend on anything)
+    """
+    for cls in type(rule).__mro__:
+        if 'apply_rule' in cls.__dict__:
+            return cls.__dict__.get('compile_on')
+    return None
+
+
+def _apply_rules(rules, instance, history, running_time):
+    for rule in rules:
+        # Each rule is given the previous running_time, and
+        # returns it as a result
+        running_time = rule.apply_rule(instance, history, running_time)
+    return running_time
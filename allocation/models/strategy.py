@@ -7,7 +7,6 @@ from django.utils import timezone
 from allocation.models import \
     AllocationRecharge, IgnoreStatusRule, MultiplySizeCPU,\
     Allocation, TimeUnit
-from allocation.models import Instance as AllocInstance
 
 
 class PythonAllocationStrategy(object):
@@ -31,19 +30,22 @@ class PythonAllocationStrategy(object):
         self.rule_behaviors = rule_behaviors
 
     def get_instance_list(self, identity):
-        from service.monitoring import _core_instances_for
+        from service.monitoring import _load_core_instances,\
+            _allocation_instances_for
+        start_date = self.counting_behavior.start_date
         # Retrieve the core that could have an impact..
-        core_instances = _core_instances_for(
-            identity,
-            self.counting_behavior.start_date)
+        core_instances = _load_core_instances(
+            [identity], start_date).get(identity.id, [])
         # Convert Core Models --> Allocation/core Models
-        alloc_instances = [AllocInstance.from_core(
-            inst, self.counting_behavior.start_date)
-            for inst in core_instances]
-        return alloc_instances
+        return _allocation_instances_for(core_instances, start_date)
 
-    def apply(self, identity, core_allocation):
-        instances = self.get_instance_list(identity)
+    def apply(self, identity, core_allocation, instances=None):
+        """
+        instances - The allocation Instance list, if it was already loaded
+                    (See service.monitoring._load_core_instances)
+        """
+        if instances is None:
+            instances = self.get_instance_list(identity)
 
         credits = []
         for behavior in self.recharge_behaviors:
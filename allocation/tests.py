@@ -21,12 +21,12 @@ from django.test import TestCase
 from django.utils import unittest
 from django.utils.timezone import datetime, timedelta
 
-from allocation import engine, validate_interval
+from allocation import batch, engine, validate_interval
 from allocation.models import Provider, Machine, Size, Instance,\
     InstanceHistory
 from allocation.models import Allocation, MultiplySizeCPU, MultiplySizeRAM,\
     MultiplySizeDisk, MultiplyBurnTime, AllocationIncrease, TimeUnit,\
-    IgnoreStatusRule, CarryForwardTime, Rule
+    IgnoreStatusRule, CarryForwardTime, Rule, InstanceRule, CompiledRules
 from allocation.models import \
     FixedStartSlidingWindow, FixedEndSlidingWindow, FixedWindow,\
     PythonAllocationStrategy, RecurringRefresh, OneTimeRefresh
@@ -521,6 +521,328 @@ class TestAllocationEngine(AllocationTestCase):
         self.assertTotalRuntimeEquals(allocation, timedelta(days=45))
 
 
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.start_window = datetime(2014, 7, 1, tzinfo=pytz.utc)
+        self.stop_window = datetime(2014, 8, 1, tzinfo=pytz.utc)
+
+    def _create_allocation(self, instance_count, interval_delta=None,
+                           size="test.small"):
+        allocation_helper = AllocationHelper(
+            self.start_window, self.stop_window, self.start_window,
+            credit_hours=24 * 10, interval_delta=interval_delta)
+        history_start = self.start_window - timedelta(days=2)
+        for number in xrange(instance_count):
+            instance_helper = InstanceHelper()
+            start = history_start + timedelta(hours=7 * number)
+            for status in ["build", "active", "suspended", "active"]:
+                end = start + timedelta(days=2, minutes=13 * number)
+                instance_helper.add_history_entry(
+                    start, end, size=size, status=status)
+                start = end
+            # The current history has not been end-dated
+            instance_helper.add_history_entry(start, None, size=size)
+            allocation_helper.add_instance(
+                instance_helper.to_instance("Test instance %s" % number))
+        return allocation_helper.to_allocation()
+
+
+class CountedRule(MultiplyBurnTime):
+
+    compile_on = ()
+
+    def __init__(self, name, multiplier):
+        super(CountedRule, self).__init__(name, multiplier)
+        self.calls = 0
+
+    def apply_rule(self, instance, history, running_time, print_logs=False):
+        self.calls += 1
+        return super(CountedRule, self).apply_rule(
+            instance, history, running_time, print_logs=print_logs)
+
+
+class IgnoreShortHistory(InstanceRule):
+
+    def apply_rule(self, instance, history, running_time, print_logs=False):
+        if history.end_date and\
+                history.end_date - history.start_date < \
+                timedelta(days=2, minutes=20):
+            return running_time * 0
+        return running_time
+
+
+class IgnoreShortSizeCPU(MultiplySizeCPU):
+    """
+    Inherits compile_on of MultiplySizeCPU, but depends on the history dates
+    """
+
+    def apply_rule(self, instance, history, running_time, print_logs=False):
+        if history.end_date and\
+                history.end_date - history.start_date < \
+                timedelta(days=2, minutes=20):
+            return running_time * 0
+        return super(IgnoreShortSizeCPU, self).apply_rule(
+            instance, history, running_time, print_logs=print_logs)
+
+
+class TestBatchEngine(HistoryTestCase):
+
+    def assertResultsMatch(self, allocations):
+        batch_results = batch.calculate_allocations(allocations)
+        self.assertEqual(len(batch_results), len(allocations))
+        for allocation, batch_result in zip(allocations, batch_results):
+            result = engine.calculate_allocation(allocation)
+            self.assertEqual(len(batch_result.time_periods),
+                             len(result.time_periods))
+            for period, batch_period in zip(result.time_periods,
+                                            batch_result.time_periods):
+                self.assertEqual(batch_period.total_credit,
+                                 period.total_credit)
+                self.assertEqual(batch_period.total_instance_runtime(),
+                                 period.total_instance_runtime())
+                self.assertEqual(batch_period.get_burn_rate(),
+                                 period.get_burn_rate())
+                self.assertEqual(batch_period.time_to_zero(),
+                                 period.time_to_zero())
+            self.assertEqual(batch_result.total_difference(),
+                             result.total_difference())
+            self.assertEqual(batch_result.over_allocation(),
+                             result.over_allocation())
+
+    def test_results_match_engine(self):
+        """
+        Batch results match calculate_allocation for every identity
+        """
+        allocations = [
+            self._create_allocation(1),
+            self._create_allocation(3, size="test.large"),
+            self._create_allocation(0),
+            self._create_allocation(5, size="test.medium"),
+        ]
+        self.assertResultsMatch(allocations)
+
+    def test_results_match_engine_by_interval(self):
+        """
+        Batch results match calculate_allocation across many time periods
+        """
+        allocations = [
+            self._create_allocation(2, interval_delta=relativedelta(days=1)),
+            self._create_allocation(4, interval_delta=relativedelta(hours=5)),
+        ]
+        self.assertResultsMatch(allocations)
+
+    def test_results_match_engine_without_carry_forward(self):
+        allocation = self._create_allocation(
+            3, interval_delta=relativedelta(days=3))
+        allocation.rules.remove(carry_forward)
+        self.assertResultsMatch([allocation])
+
+    def test_rules_without_vectorization(self):
+        """
+        Rules the batch engine does not know are applied to every history
+        """
+        allocation = self._create_allocation(3)
+        allocation.rules.append(IgnoreShortHistory("Ignore short history"))
+        self.assertResultsMatch([allocation])
+
+
+class TestHistorySweep(HistoryTestCase):
+
+    def assertSweepMatches(self, allocation):
+        """
+        Every period matches the time used by every history of every instance
+        """
+        result = engine.calculate_allocation(allocation)
+        rules = [rule for rule in allocation.rules
+                 if isinstance(rule, InstanceRule)]
+        for period in result.time_periods:
+            total_time, burn_rate = timedelta(0), timedelta(0)
+            for instance in allocation.instances:
+                for history_result in engine._calculate_instance_history_list(
+                        instance, rules, period.counting_from(),
+                        period.stop_counting_date):
+                    total_time += history_result.total_time
+                    burn_rate += history_result.burn_rate
+            self.assertEqual(period.total_instance_runtime(), total_time)
+            self.assertEqual(period.get_burn_rate(), burn_rate)
+        return result
+
+    def test_sweep_matches_every_history(self):
+        allocation = self._create_allocation(
+            5, interval_delta=relativedelta(hours=5))
+        self.assertSweepMatches(allocation)
+
+    def test_sweep_without_carry_forward(self):
+        allocation = self._create_allocation(
+            3, interval_delta=relativedelta(days=1))
+        allocation.rules.remove(carry_forward)
+        self.assertSweepMatches(allocation)
+
+    def test_periods_only_include_overlapping_history(self):
+        allocation = self._create_allocation(
+            2, interval_delta=relativedelta(days=1))
+        result = self.assertSweepMatches(allocation)
+        for period in result.time_periods:
+            for instance_result in period.instance_results:
+                for history_result in instance_result.history_list:
+                    self.assertTrue(history_result.clock_time)
+
+    def test_all_instance_results_list_every_history(self):
+        """
+        As every instance was listed in every period, before the sweep
+        (See api.v1.serializers.allocation_serializer)
+        """
+        allocation = self._create_allocation(
+            3, interval_delta=relativedelta(days=1))
+        result = engine.calculate_allocation(allocation)
+        rules = [rule for rule in allocation.rules
+                 if isinstance(rule, InstanceRule)]
+        for period in result.time_periods:
+            listed = [
+                (instance_result.identifier,
+                 [(history_result.status_name, history_result.clock_time,
+                   history_result.total_time, history_result.burn_rate)
+                  for history_result in instance_result.history_list])
+                for instance_result in period.all_instance_results(
+                    allocation.instances)]
+            expected = [
+                (instance.identifier,
+                 [(history_result.status_name, history_result.clock_time,
+                   history_result.total_time, history_result.burn_rate)
+                  for history_result in
+                  engine._calculate_instance_history_list(
+                      instance, rules, period.counting_from(),
+                      period.stop_counting_date)])
+                for instance in allocation.instances if instance.history]
+            self.assertEqual(listed, expected)
+
+
+class TestCompiledRules(HistoryTestCase):
+
+    def assertRulesMatch(self, allocation):
+        rules = [rule for rule in allocation.rules
+                 if isinstance(rule, InstanceRule)]
+        compiled_rules = CompiledRules(rules)
+        for instance in allocation.instances:
+            for history in instance.history:
+                running_time = timedelta(seconds=1)
+                for rule in rules:
+                    running_time = rule.apply_rule(
+                        instance, history, running_time)
+                self.assertEqual(
+                    compiled_rules.running_time_per_second(instance, history),
+                    running_time)
+        return compiled_rules
+
+    def test_compiled_rules_match_rules(self):
+        allocation = self._create_allocation(3, size="test.medium")
+        allocation.rules.extend([multiply_by_disk, multiply_by_cpu])
+        compiled_rules = self.assertRulesMatch(allocation)
+        self.assertTrue(compiled_rules.is_compiled())
+
+    def test_dynamic_rules_match_rules(self):
+        """
+        Rules after a rule that cannot be compiled are applied dynamically
+        """
+        allocation = self._create_allocation(3)
+        allocation.rules.extend([
+            IgnoreShortHistory("Ignore short history"), multiply_by_disk])
+        compiled_rules = self.assertRulesMatch(allocation)
+        self.assertFalse(compiled_rules.is_compiled())
+        self.assertEqual(compiled_rules.dynamic_rules,
+                         allocation.rules[-2:])
+
+    def test_inherited_compile_on_is_ignored(self):
+        """
+        Overriding apply_rule without compile_on makes a rule dynamic
+        """
+        allocation = self._create_allocation(3)
+        allocation.rules.append(IgnoreShortSizeCPU("Ignore short CPU", 1))
+        compiled_rules = self.assertRulesMatch(allocation)
+        self.assertFalse(compiled_rules.is_compiled())
+
+    def test_rules_are_applied_once_per_key(self):
+        allocation = self._create_allocation(
+            4, interval_delta=relativedelta(days=1))
+        counted_rule = CountedRule("Count rule calls", 1)
+        allocation.rules.append(counted_rule)
+        engine.calculate_allocation(allocation)
+        # One call for each status, all instances are the same size
+        statuses = set(history.status for instance in allocation.instances
+                       for history in instance.history)
+        self.assertEqual(counted_rule.calls, len(statuses))
+
+
+class TestAllocationCheckpoints(HistoryTestCase):
+
+    def _checkpoints_as_of(self, allocation, as_of):
+        return engine.calculate_allocation(allocation).create_checkpoints(
+            as_of=as_of)
+
+    def assertCheckpointsMatch(self, calculate, as_of, **kwargs):
+        allocation = self._create_allocation(3, **kwargs)
+        result = calculate(allocation)
+        checkpoints = self._checkpoints_as_of(allocation, as_of)
+        self.assertTrue(checkpoints)
+        allocation = self._create_allocation(3, **kwargs)
+        allocation.checkpoints = checkpoints
+        checkpoint_result = calculate(allocation)
+        for period, checkpoint_period in zip(result.time_periods,
+                                             checkpoint_result.time_periods):
+            self.assertEqual(checkpoint_period.total_instance_runtime(),
+                             period.total_instance_runtime())
+            self.assertEqual(checkpoint_period.get_burn_rate(),
+                             period.get_burn_rate())
+            self.assertEqual(checkpoint_period.total_credit,
+                             period.total_credit)
+        self.assertEqual(checkpoint_result.total_difference(),
+                         result.total_difference())
+
+    def test_checkpoints_match_engine(self):
+        """
+        Counting from checkpoints matches counting every history
+        """
+        as_of = self.start_window + timedelta(days=16)
+        self.assertCheckpointsMatch(
+            engine.calculate_allocation, as_of,
+            interval_delta=relativedelta(days=3))
+
+    def test_checkpoints_match_batch_engine(self):
+        as_of = self.start_window + timedelta(days=16)
+        self.assertCheckpointsMatch(
+            lambda allocation: batch.calculate_allocations([allocation])[0],
+            as_of, interval_delta=relativedelta(days=3))
+
+    def test_open_period_is_checkpointed_as_of(self):
+        allocation = self._create_allocation(
+            1, interval_delta=relativedelta(days=3))
+        as_of = self.start_window + timedelta(days=16)
+        checkpoints = self._checkpoints_as_of(allocation, as_of)
+        for checkpoint in checkpoints:
+            self.assertTrue(checkpoint.as_of <= as_of)
+        self.assertEqual(checkpoints[-1].as_of, as_of)
+
+    def test_open_period_with_later_history_is_not_checkpointed(self):
+        """
+        History starts in the open period after 'as_of'
+        """
+        allocation = self._create_allocation(
+            2, interval_delta=relativedelta(days=3))
+        as_of = self.start_window + timedelta(days=4)
+        checkpoints = self._checkpoints_as_of(allocation, as_of)
+        self.assertTrue(checkpoints)
+        self.assertNotIn(as_of, [checkpoint.as_of
+                                 for checkpoint in checkpoints])
+
+    def test_signature_changes_with_rules(self):
+        allocation = self._create_allocation(1)
+        signature = allocation.signature()
+        self.assertEqual(signature, self._create_allocation(2).signature())
+        allocation.rules.remove(carry_forward)
+        self.assertNotEqual(signature, allocation.signature())
+
+
 # From the REPL
 def repl_profile_test_1():
     """
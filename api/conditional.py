@@ -0,0 +1,96 @@
+"""
+Conditional GET (ETag / If-None-Match) support
+"""
+from hashlib import md5
+
+from django.db.models import Count, Max
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.models import Instance
+from service.cache import get_change_counters
+
+
+class NotModified(Exception):
+    pass
+
+
+def change_validators(*scopes):
+    """
+    The change counters of 'scopes' (See service.cache.bump_change_counters)
+    or None when they are unavailable.
+    """
+    counters = get_change_counters(*scopes)
+    if counters is None:
+        return None
+    return tuple(counters)
+
+
+def queryset_validators(queryset, *date_fields):
+    """
+    Cheap values that change when rows are added to (or removed from)
+    'queryset', or when one of 'date_fields' changes. (One query)
+    """
+    aggregates = dict(("max_%s" % field, Max(field)) for field in date_fields)
+    aggregates["count"] = Count('pk')
+    values = queryset.order_by().aggregate(**aggregates)
+    return tuple(sorted(values.items()))
+
+
+def project_validators(user, projects):
+    """
+    Validators of the projects of 'user' and of the instances
+    (and volumes) they list.
+    """
+    changes = change_validators("group.%s" % user.username,
+                                "user.%s" % user.id)
+    if changes is None:
+        return None
+    return changes +\
+        queryset_validators(projects, 'start_date', 'end_date') +\
+        queryset_validators(Instance.objects.filter(created_by=user),
+                            'end_date', 'last_history')
+
+
+class ConditionalGetMixin(object):
+
+    """
+    Answers GET (and HEAD) with '304 Not Modified' when the client already
+    has the current representation, before anything is serialized.
+
+    Views implement get_validators, returning cheap values that change
+    whenever the response would (or None to always respond in full).
+    """
+    etag = None
+
+    def get_validators(self, request, *args, **kwargs):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        self.etag = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return
+        self.etag = md5(repr((
+            request.user.pk, request.get_full_path(),
+            request.accepted_media_type, validators))).hexdigest()
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if self.etag in etags or '*' in etags:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+        if self.etag and response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = quote_etag(self.etag)
+        return response
@@ -1,7 +1,17 @@
 """
 custom pagination support
 """
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.templatetags.rest_framework import replace_query_param
 
 # NOTE: this value is set here for v1 api support
 DEFAULT_PAGINATION_SIZE = 20
@@ -49,3 +59,140 @@ class OptionalPagination(PageNumberPagination):
             return _is_positive(request.query_params[self.page_query_param])
         except (KeyError, ValueError):
             return False
+
+
+class KeysetPagination(BasePagination):
+
+    """
+    Keyset (cursor) pagination, ordered on ('start_date', 'id').
+    A page starts after the (start_date, id) of the previous page instead of
+    an offset, and no COUNT is run, so every page costs the same.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or DEFAULT_PAGINATION_SIZE
+    max_page_size = 1000
+    # Newest first. Both fields must be ordered in the same direction.
+    ordering = ('-start_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0]
+        fields = [field.lstrip('-') for field in self.ordering]
+        descending = self.ordering[0].startswith('-')
+        if descending != reverse:
+            queryset = queryset.order_by(*['-' + f for f in fields])
+        else:
+            queryset = queryset.order_by(*fields)
+        if cursor is not None:
+            queryset = queryset.filter(
+                self._after(fields, cursor[1], descending != reverse))
+        self.page = list(queryset[:self.page_size + 1])
+        has_more = len(self.page) > self.page_size
+        del self.page[self.page_size:]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.page[0])
+
+    def _after(self, fields, position, descending):
+        """
+        Query for the rows that come after 'position' (start_date, id)
+        """
+        lookup = '__lt' if descending else '__gt'
+        date_field, id_field = fields
+        return Q(**{date_field + lookup: position[0]}) |\
+            Q(**{date_field: position[0], id_field + lookup: position[1]})
+
+    def encode_cursor(self, reverse, obj):
+        date_field, id_field = [field.lstrip('-') for field in self.ordering]
+        obj_id = getattr(obj, id_field)
+        if not isinstance(obj_id, (int, long)):
+            obj_id = str(obj_id)
+        cursor = json.dumps(
+            [reverse, getattr(obj, date_field).isoformat(), obj_id])
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   urlsafe_b64encode(cursor))
+
+    def decode_cursor(self, request):
+        """
+        Returns (reverse, (start_date, id)), or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, start_date, obj_id = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')))
+            start_date = parse_datetime(start_date)
+        except (TypeError, ValueError):
+            start_date = None
+        if not start_date:
+            raise NotFound("Invalid cursor")
+        return bool(reverse), (start_date, obj_id)
+
+
+class OptionalKeysetPagination(PageNumberPagination):
+
+    """
+    Page numbers by default, KeysetPagination when a cursor is given.
+    (An empty '?cursor=' starts at the first page)
+    Views list the query parameters that order the results another way
+    in 'keyset_conflicting_params', a cursor is rejected along with them.
+    """
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        cursor_param = self.keyset_class.cursor_query_param
+        if cursor_param in request.query_params:
+            conflicting = [
+                param for param in
+                getattr(view, 'keyset_conflicting_params', ())
+                if request.query_params.get(param)]
+            if conflicting:
+                raise ValidationError({cursor_param: [
+                    "Cursor pages are ordered by %s, they can not be "
+                    "combined with: %s"
+                    % (", ".join(self.keyset_class.ordering),
+                       ", ".join(conflicting))]})
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view=view)
+        return super(OptionalKeysetPagination, self).paginate_queryset(
+            queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super(OptionalKeysetPagination, self).get_paginated_response(
+            data)
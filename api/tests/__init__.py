@@ -4,7 +4,7 @@ Common functions used by all API test cases
 from urlparse import urljoin
 from datetime import datetime
 from rest_framework import status
-from time import sleep
+from time import sleep, time
 
 
 def verify_expected_output(test_client, api_out, expected_out):
@@ -113,3 +113,164 @@ def remove_all_instances(test_client, instance_url):
     for instance in list_instance_resp.data:
         remove_instance(test_client, instance_url, instance['alias'])
     return True
+
+
+class FakeRedis(object):
+    """
+    In-memory stand-in for the redis connection of service.cache, covering
+    the commands the API uses. Patch it in with:
+        mock.patch('service.cache.connection', FakeRedis())
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def _expire(self, key):
+        if key in self.expires and self.expires[key] <= time():
+            self.values.pop(key, None)
+            del self.expires[key]
+
+    def get(self, key):
+        self._expire(key)
+        return self.values.get(key)
+
+    def mget(self, *keys):
+        if len(keys) == 1 and isinstance(keys[0], (list, tuple)):
+            keys = keys[0]
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.values[key] = str(value)
+        self.expires.pop(key, None)
+        if ex:
+            self.expires[key] = time() + ex
+        return True
+
+    def setex(self, key, timeout, value):
+        return self.set(key, value, ex=timeout)
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.values[key] = str(value)
+        return value
+
+    def delete(self, *keys):
+        count = 0
+        for key in keys:
+            self._expire(key)
+            if self.values.pop(key, None) is not None:
+                count += 1
+            self.expires.pop(key, None)
+        return count
+
+    def ttl(self, key):
+        if self.get(key) is None:
+            return -2
+        if key not in self.expires:
+            return -1
+        return int(self.expires[key] - time())
+
+    def sadd(self, key, *members):
+        self._expire(key)
+        members = set(str(member) for member in members)
+        existing = self.values.setdefault(key, set())
+        added = len(members - existing)
+        existing.update(members)
+        return added
+
+    def smembers(self, key):
+        self._expire(key)
+        return set(self.values.get(key, ()))
+
+    def zadd(self, key, *scores_members):
+        self._expire(key)
+        scores = self.values.setdefault(key, {})
+        added = 0
+        for score, member in zip(scores_members[::2], scores_members[1::2]):
+            added += str(member) not in scores
+            scores[str(member)] = float(score)
+        return added
+
+    def zrem(self, key, *members):
+        self._expire(key)
+        scores = self.values.get(key, {})
+        return len([scores.pop(str(member)) for member in members
+                    if str(member) in scores])
+
+    def zrangebyscore(self, key, min_score, max_score):
+        self._expire(key)
+        return sorted(
+            (member for member, score in self.values.get(key, {}).items()
+             if float(min_score) <= score <= float(max_score)),
+            key=self.values.get(key, {}).get)
+
+    def zremrangebyscore(self, key, min_score, max_score):
+        return self.zrem(key, *self.zrangebyscore(key, min_score, max_score))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        from service.cache import STORE_IF_NEWER, UNLOCK_IF_OWNER
+        return FakeScript(self, {
+            STORE_IF_NEWER: "_store_if_newer",
+            UNLOCK_IF_OWNER: "_unlock_if_owner",
+        }[script])
+
+    def _store_if_newer(self, keys, args):
+        key, version_key = keys
+        data, version, timeout = args
+        current = self.get(version_key)
+        if current and float(current) > float(version):
+            return 0
+        self.setex(key, timeout, data)
+        self.setex(version_key, timeout, version)
+        return 1
+
+    def _unlock_if_owner(self, keys, args):
+        if self.get(keys[0]) == args[0]:
+            return self.delete(keys[0])
+        return 0
+
+
+class FakePipeline(object):
+    """
+    Queues commands until execute(), as a redis pipeline does.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class FakeScript(object):
+    """
+    A lua script of service.cache, run by its python twin in FakeRedis.
+    """
+
+    def __init__(self, client, method_name):
+        self.client = client
+        self.method_name = method_name
+
+    def __call__(self, keys=[], args=[], client=None):
+        client = client or self.client
+        if isinstance(client, FakePipeline):
+            client.commands.append(
+                (getattr(client.client, self.method_name), (keys, args), {}))
+            return client
+        return getattr(client, self.method_name)(keys, args)
@@ -11,3 +11,8 @@ from .quota_factory import QuotaFactory
 from .allocation_factory import AllocationFactory
 from .provider_type_factory import ProviderTypeFactory
 from .platform_type_factory import PlatformTypeFactory
+from .image_version_factory import ImageVersionFactory
+from .provider_machine_factory import InstanceSourceFactory,\
+    ProviderMachineFactory
+from .size_factory import SizeFactory
+from .instance_factory import InstanceFactory
@@ -0,0 +1,10 @@
+import factory
+from core.models import ApplicationVersion as ImageVersion
+
+
+class ImageVersionFactory(factory.DjangoModelFactory):
+
+    class Meta:
+        model = ImageVersion
+
+    name = factory.Sequence(lambda n: 'version %d' % n)
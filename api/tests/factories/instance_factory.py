@@ -0,0 +1,13 @@
+import factory
+from django.utils import timezone
+from core.models import Instance
+
+
+class InstanceFactory(factory.DjangoModelFactory):
+
+    class Meta:
+        model = Instance
+
+    name = 'instance name'
+    provider_alias = factory.Sequence(lambda n: 'instance-%d' % n)
+    start_date = factory.LazyAttribute(lambda obj: timezone.now())
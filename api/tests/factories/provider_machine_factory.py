@@ -0,0 +1,18 @@
+import factory
+from core.models import InstanceSource, ProviderMachine
+
+
+class InstanceSourceFactory(factory.DjangoModelFactory):
+
+    class Meta:
+        model = InstanceSource
+
+    identifier = factory.Sequence(lambda n: 'machine-%d' % n)
+
+
+class ProviderMachineFactory(factory.DjangoModelFactory):
+
+    class Meta:
+        model = ProviderMachine
+
+    instance_source = factory.SubFactory(InstanceSourceFactory)
@@ -0,0 +1,15 @@
+import factory
+from core.models import Size
+
+
+class SizeFactory(factory.DjangoModelFactory):
+
+    class Meta:
+        model = Size
+
+    alias = factory.Sequence(lambda n: 'size-%d' % n)
+    name = 'size name'
+    cpu = 1
+    disk = 10
+    root = 10
+    mem = 1024
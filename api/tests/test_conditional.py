@@ -0,0 +1,138 @@
+"""
+tests for conditional GET (ETag / If-None-Match) and the change counters
+it is validated with
+"""
+import mock
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.filters import DjangoFilterBackend
+from rest_framework.test import APITestCase, APIRequestFactory,\
+    force_authenticate
+
+from api.tests import FakeRedis
+from api.tests.factories import UserFactory, GroupFactory, ProjectFactory,\
+    ProviderFactory, IdentityFactory, ImageFactory, ImageVersionFactory,\
+    ProviderMachineFactory, InstanceFactory, InstanceSourceFactory,\
+    SizeFactory
+from api.v2.views import ImageViewSet
+from core.models import InstanceStatusHistory
+from core.models.application import visible_apps
+from service import search
+from service.cache import get_change_counters
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        search.image_index[0] = (0, None, [], [])
+        self.view = ImageViewSet.as_view({'get': 'list'})
+        self.user = UserFactory.create()
+        self.image = ImageFactory.create(created_by=self.user)
+        self.url = reverse('api:v2:application-list')
+
+    def list_images(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get(self.url, **headers)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_response_has_etag(self):
+        response = self.list_images()
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('ETag', response)
+
+    def test_current_etag_is_not_modified(self):
+        etag = self.list_images()['ETag']
+        response = self.list_images(etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+        self.assertIsNone(response.data)
+
+    def test_changed_images_are_modified(self):
+        etag = self.list_images()['ETag']
+        self.image.name = "Renamed"
+        self.image.save()
+        response = self.list_images(etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+    def test_no_etag_without_change_counters(self):
+        with mock.patch('api.conditional.get_change_counters',
+                        return_value=None):
+            response = self.list_images()
+        self.assertEquals(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_visibility_is_materialized_once(self):
+        with mock.patch('core.models.application.visible_apps',
+                        wraps=visible_apps) as materialize:
+            self.list_images()
+        self.assertEquals(materialize.call_count, 1)
+
+    def test_images_are_filtered_once(self):
+        with mock.patch.object(
+                DjangoFilterBackend, 'filter_queryset', autospec=True,
+                side_effect=DjangoFilterBackend.filter_queryset) as filtered:
+            response = self.list_images()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(filtered.call_count, 1)
+
+
+class ChangeCounterTests(TestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        self.provider = ProviderFactory.create()
+        self.user = UserFactory.create()
+        self.identity = IdentityFactory.create(
+            created_by=self.user, provider=self.provider)
+        self.instance = InstanceFactory.create(
+            created_by=self.user, created_by_identity=self.identity,
+            source=InstanceSourceFactory.create(provider=self.provider))
+
+    def assertBumps(self, scope, method, *args, **kwargs):
+        before = get_change_counters(scope)
+        method(*args, **kwargs)
+        self.assertNotEquals(get_change_counters(scope), before)
+
+    def test_saved_instance_bumps_its_user(self):
+        self.instance.name = "Renamed"
+        self.assertBumps("user.%s" % self.user.id, self.instance.save)
+
+    def test_new_last_history_bumps_its_user(self):
+        # set_last_history writes with update(), which sends no signal
+        history = InstanceStatusHistory.create_history(
+            'active', self.instance,
+            SizeFactory.create(provider=self.provider),
+            self.instance.start_date)
+        history.save()
+        self.assertBumps("user.%s" % self.user.id,
+                         self.instance.set_last_history, history)
+
+    def test_project_instances_bump_the_group_and_user(self):
+        group = GroupFactory.create(name=self.user.username)
+        project = ProjectFactory.create(owner=group)
+        self.assertBumps("group.%s" % group.name,
+                         project.instances.add, self.instance)
+        self.assertBumps("user.%s" % self.user.id,
+                         project.instances.remove, self.instance)
+
+    def test_saved_image_bumps_images(self):
+        self.assertBumps("images", ImageFactory.create,
+                         created_by=self.user)
+
+    def test_end_dated_machine_bumps_images(self):
+        version = ImageVersionFactory.create(
+            application=ImageFactory.create(created_by=self.user),
+            created_by=self.user)
+        machine = ProviderMachineFactory.create(
+            instance_source__provider=self.provider,
+            application_version=version)
+        machine.instance_source.end_date = timezone.now()
+        self.assertBumps("images", machine.instance_source.save)
@@ -1,8 +1,21 @@
+from calendar import timegm
+from datetime import timedelta
+
+import mock
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIRequestFactory,\
     force_authenticate
+from api.tests import FakeRedis
 from api.v2.views import ImageViewSet as ViewSet
-from api.tests.factories import UserFactory, AnonymousUserFactory, ImageFactory
+from api.tests.factories import UserFactory, AnonymousUserFactory,\
+    ImageFactory, GroupFactory, ProviderFactory, ImageVersionFactory,\
+    ProviderMachineFactory, LeadershipFactory
+from core.models import ApplicationVersionMembership
+from service import search
+from service.cache import IMAGES_LOCK_VISIBLE
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from unittest import skip
 
@@ -99,6 +112,180 @@ class GetDetailTests(APITestCase):
         self.assertIn('end_date', data)
 
 
+class ImageListTestCase(APITestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        redis_patcher = mock.patch('service.cache.connection', self.redis)
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        search.image_index[0] = (0, None, [], [])
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        LeadershipFactory.create(user=self.user, group=self.group)
+        self.other_user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.url = reverse('api:v2:application-list')
+
+    def create_image(self, change_log=None, **kwargs):
+        image = ImageFactory.create(created_by=self.other_user, **kwargs)
+        version = ImageVersionFactory.create(
+            application=image,
+            change_log=change_log,
+            created_by=self.other_user)
+        ProviderMachineFactory.create(
+            instance_source__provider=self.provider,
+            application_version=version)
+        return image
+
+    def list_images(self, user, query=None):
+        request = APIRequestFactory().get(self.url, query)
+        force_authenticate(request, user=user)
+        return self.view(request).data['results']
+
+    def list_image_ids(self, user):
+        return set(data['id'] for data in self.list_images(user))
+
+
+class VisibilityTests(ImageListTestCase):
+
+    def setUp(self):
+        super(VisibilityTests, self).setUp()
+        self.public_image = self.create_image()
+        self.private_image = self.create_image(private=True)
+
+    def test_public_images_are_visible(self):
+        self.assertEquals(self.list_image_ids(AnonymousUserFactory()),
+                          set([self.public_image.id]))
+        self.assertEquals(self.list_image_ids(self.user),
+                          set([self.public_image.id]))
+
+    def test_own_images_are_visible(self):
+        image = ImageFactory.create(created_by=self.user, private=True)
+        self.assertIn(image.id, self.list_image_ids(self.user))
+
+    def test_visibility_follows_changes(self):
+        self.assertNotIn(self.private_image.id,
+                         self.list_image_ids(self.user))
+        membership = ApplicationVersionMembership.objects.create(
+            application_version=self.private_image.versions.get(),
+            group=self.group)
+        self.assertIn(self.private_image.id, self.list_image_ids(self.user))
+
+        membership.delete()
+        self.assertNotIn(self.private_image.id,
+                         self.list_image_ids(self.user))
+
+        self.provider.active = False
+        self.provider.save()
+        self.assertNotIn(self.public_image.id,
+                         self.list_image_ids(self.user))
+
+    def test_end_dated_machines_are_hidden(self):
+        self.assertIn(self.public_image.id, self.list_image_ids(self.user))
+        machine = self.public_image.versions.get().machines.get()
+        machine.instance_source.end_date = timezone.now()
+        machine.instance_source.save()
+        self.assertNotIn(self.public_image.id,
+                         self.list_image_ids(self.user))
+
+    def test_machines_are_hidden_once_their_end_date_passes(self):
+        machine = self.public_image.versions.get().machines.get()
+        machine.instance_source.end_date = timezone.now() + timedelta(hours=1)
+        machine.instance_source.save()
+        self.assertIn(self.public_image.id, self.list_image_ids(self.user))
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later),\
+                mock.patch('service.cache.time.time',
+                           return_value=timegm(later.utctimetuple())):
+            self.assertNotIn(self.public_image.id,
+                             self.list_image_ids(self.user))
+
+    def test_scope_being_rebuilt_serves_its_old_rows(self):
+        self.list_image_ids(AnonymousUserFactory())
+        self.redis.set(IMAGES_LOCK_VISIBLE.format("public"), "another")
+        self.create_image()
+        self.assertEquals(self.list_image_ids(AnonymousUserFactory()),
+                          set([self.public_image.id]))
+
+    def test_scope_never_built_is_queried_while_locked(self):
+        self.redis.set(IMAGES_LOCK_VISIBLE.format("public"), "another")
+        self.assertEquals(self.list_image_ids(AnonymousUserFactory()),
+                          set([self.public_image.id]))
+        self.assertEquals(self.redis.get(IMAGES_LOCK_VISIBLE.format(
+            "public")), "another")
+
+
+class SearchTests(ImageListTestCase):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        self.ubuntu = self.create_image(name="Ubuntu CUDA")
+        self.centos = self.create_image(
+            name="CentOS", change_log="Installed the ubuntu fonts")
+        search.rebuild_image_index()
+        search.image_index[0] = (0, None, [], [])
+
+    def search(self, query):
+        return self.list_images(self.user, {'search': query})
+
+    def test_best_ranked_first(self):
+        results = self.search('ubuntu')
+        self.assertEquals([data['id'] for data in results],
+                          [self.ubuntu.id, self.centos.id])
+
+    def test_prefix_matches(self):
+        results = self.search('cent')
+        self.assertEquals([data['id'] for data in results], [self.centos.id])
+
+    def test_substring_matches(self):
+        results = self.search('buntu')
+        self.assertEquals([data['id'] for data in results],
+                          [self.ubuntu.id, self.centos.id])
+        self.assertEquals(results[0]['search_highlights'],
+                          {'name': '<em>Ubuntu</em> CUDA'})
+
+    def test_only_visible_images_are_limited(self):
+        # Ranked above the visible images
+        for _ in range(2):
+            self.create_image(name="Ubuntu", private=True)
+        search.rebuild_image_index()
+        search.image_index[0] = (0, None, [], [])
+        with mock.patch('service.search.SEARCH_RESULT_LIMIT', 2):
+            results = self.search('ubuntu')
+        self.assertEquals([data['id'] for data in results],
+                          [self.ubuntu.id, self.centos.id])
+
+    def test_every_word_matches(self):
+        results = self.search('ubuntu fonts')
+        self.assertEquals([data['id'] for data in results], [self.centos.id])
+        self.assertEquals(self.search('ubuntu missing'), [])
+
+    def test_matches_are_highlighted(self):
+        results = self.search('ubu')
+        self.assertEquals(results[0]['search_highlights'],
+                          {'name': '<em>Ubuntu</em> CUDA'})
+        self.assertEquals(
+            results[1]['search_highlights'],
+            {'change_log': 'Installed the <em>ubuntu</em> fonts'})
+
+    def test_highlights_do_not_query_per_image(self):
+        self.search('ubuntu')
+        with CaptureQueriesContext(connection) as one_result:
+            self.assertEquals(len(self.search('cent')), 1)
+        with CaptureQueriesContext(connection) as two_results:
+            self.assertEquals(len(self.search('ubuntu')), 2)
+        self.assertEquals(len(one_result), len(two_results))
+
+    def test_cursor_is_rejected(self):
+        request = APIRequestFactory().get(
+            self.url, {'search': 'ubuntu', 'cursor': ''})
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        self.assertEquals(response.status_code, 400)
+
+
 class CreateTests(APITestCase):
 
     def test_endpoint_does_not_exist(self):
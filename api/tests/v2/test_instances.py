@@ -0,0 +1,130 @@
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase, APIRequestFactory,\
+    force_authenticate
+from api.v2.views import InstanceViewSet as ViewSet
+from api.tests.factories import UserFactory, AnonymousUserFactory,\
+    GroupFactory, ProjectFactory, ProviderFactory, IdentityFactory,\
+    ImageFactory, ImageVersionFactory, ProviderMachineFactory, SizeFactory,\
+    InstanceFactory, InstanceSourceFactory
+from core.models import InstanceStatus
+
+
+class InstanceListTestCase(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.anonymous_user = AnonymousUserFactory()
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        self.project = ProjectFactory.create(owner=self.group)
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider,
+            created_by=self.user)
+        self.image = ImageFactory.create(created_by=self.user)
+        self.version = ImageVersionFactory.create(
+            application=self.image,
+            created_by=self.user)
+        self.size = SizeFactory.create(provider=self.provider)
+        self.status = InstanceStatus.objects.create(name='active')
+        self.instance = self.create_instance()
+
+        factory = APIRequestFactory()
+        self.url = reverse('api:v2:instance-list')
+        self.request = factory.get(self.url)
+
+    def create_instance(self):
+        machine = ProviderMachineFactory.create(
+            instance_source__provider=self.provider,
+            application_version=self.version)
+        instance = InstanceFactory.create(
+            source=machine.instance_source,
+            created_by=self.user,
+            created_by_identity=self.identity,
+            last_status=self.status,
+            last_size=self.size)
+        self.project.instances.add(instance)
+        return instance
+
+
+class GetListTests(InstanceListTestCase):
+
+    def list_instances(self):
+        force_authenticate(self.request, user=self.user)
+        return self.view(self.request)
+
+    def test_is_not_public(self):
+        force_authenticate(self.request, user=self.anonymous_user)
+        response = self.view(self.request)
+        self.assertEquals(response.status_code, 403)
+
+    def test_response_contains_expected_fields(self):
+        response = self.list_instances()
+        data = response.data.get('results')[0]
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(data['uuid'], self.instance.provider_alias)
+        self.assertEquals(data['status'], 'active')
+        self.assertEquals(data['size']['id'], self.size.id)
+        self.assertEquals(data['image']['id'], self.image.id)
+        self.assertEquals(data['version']['id'], str(self.version.id))
+        self.assertEquals(data['projects'], [self.project.id])
+
+    def test_instance_without_machine_has_no_image(self):
+        self.instance.source = InstanceSourceFactory.create(
+            provider=self.provider)
+        self.instance.save()
+        data = self.list_instances().data.get('results')[0]
+
+        self.assertIsNone(data['image'])
+        self.assertIsNone(data['version'])
+
+    def test_query_count_does_not_grow_with_page(self):
+        # Load the status registry, and anything else cached on first use
+        self.list_instances()
+        with CaptureQueriesContext(connection) as single_page:
+            self.list_instances()
+        for _ in range(5):
+            self.create_instance()
+        with CaptureQueriesContext(connection) as full_page:
+            response = self.list_instances()
+
+        self.assertEquals(len(response.data.get('results')), 6)
+        self.assertEquals(len(single_page), len(full_page))
+
+
+class GetCursorListTests(InstanceListTestCase):
+
+    def get(self, query):
+        request = APIRequestFactory().get(self.url, query)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_response_is_not_counted(self):
+        response = self.get({'cursor': ''})
+        self.assertNotIn('count', response.data)
+        self.assertIn('next', response.data)
+        self.assertIn('previous', response.data)
+
+    def test_pages_follow_cursor(self):
+        instances = [self.instance] + [self.create_instance()
+                                       for _ in range(4)]
+        # Newest first
+        expected = [instance.provider_alias for instance in
+                    sorted(instances, key=lambda i: (i.start_date, i.id),
+                           reverse=True)]
+        response = self.get({'cursor': '', 'page_size': 2})
+        self.assertIsNone(response.data['previous'])
+        seen = [data['uuid'] for data in response.data['results']]
+        while response.data['next']:
+            request = APIRequestFactory().get(response.data['next'])
+            force_authenticate(request, user=self.user)
+            response = self.view(request)
+            seen.extend(data['uuid'] for data in response.data['results'])
+        self.assertEquals(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.get({'cursor': 'not-a-cursor'})
+        self.assertEquals(response.status_code, 404)
@@ -66,9 +66,28 @@ class TimePeriodSerializer(serializers.Serializer):
     total_credit = serializers.CharField()
 
 
+class TimePeriodResultSerializer(TimePeriodSerializer):
+    """
+    Lists every instance and history of the allocation in each time period
+    (See TimePeriodResult.all_instance_results)
+    """
+    instance_results = serializers.SerializerMethodField()
+
+    def get_instance_results(self, time_period):
+        return InstanceResultSerializer(
+            time_period.all_instance_results(self.context['instances']),
+            many=True).data
+
+
 class AllocationResultSerializer(serializers.Serializer):
     allocation = AllocationInputSerializer()
     carry_forward = serializers.BooleanField()
     start_date = serializers.CharField(source="window_start")
     end_date = serializers.CharField(source="window_end")
-    time_periods = TimePeriodSerializer(many=True)
+    time_periods = serializers.SerializerMethodField()
+
+    def get_time_periods(self, allocation_result):
+        return TimePeriodResultSerializer(
+            allocation_result.time_periods, many=True,
+            context={'instances': allocation_result.allocation.instances})\
+            .data
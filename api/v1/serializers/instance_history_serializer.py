@@ -35,4 +35,5 @@ class InstanceHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Instance
         exclude = ('id', 'source', 'provider_alias',
-                   'shell', 'vnc', 'created_by_identity')
+                   'shell', 'vnc', 'created_by_identity', 'last_history',
+                   'last_status', 'last_size', 'last_task')
@@ -52,7 +52,8 @@ class InstanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Instance
         exclude = ('source', 'provider_alias',
-                   'shell', 'vnc', 'password', 'created_by_identity')
+                   'shell', 'vnc', 'password', 'created_by_identity',
+                   'last_history', 'last_status', 'last_size', 'last_task')
 
 
 class InstanceActionSerializer(serializers.ModelSerializer):
@@ -12,7 +12,7 @@ from threepio import logger
 
 from core.models import AtmosphereUser as User
 from core.models.identity import Identity
-from core.models.instance import convert_esh_instance
+from core.models.instance import convert_esh_instance, convert_esh_instances
 from core.models.instance import Instance as CoreInstance
 from core.models.boot_script import _save_scripts_to_instance
 from core.models.tag import Tag as CoreTag
@@ -21,7 +21,7 @@ from core.models.provider import Provider
 
 from service import task
 from service.cache import get_cached_instances,\
-    invalidate_cached_instances
+    write_cached_instance, remove_cached_instance, get_cached_list_version
 from service.driver import prepare_driver
 from service.instance import redeploy_init, reboot_instance,\
     launch_instance, resize_instance, confirm_resize,\
@@ -36,6 +36,7 @@ from service.exceptions import OverAllocationError, OverQuotaError,\
 from api import failure_response, invalid_creds,\
     connection_failure, malformed_response,\
     emulate_user
+from api.conditional import ConditionalGetMixin, change_validators
 from api.pagination import OptionalPagination
 from api.v1.serializers import InstanceStatusHistorySerializer,\
     InstanceSerializer, InstanceHistorySerializer, VolumeSerializer,\
@@ -85,7 +86,7 @@ def get_esh_instance(request, provider_uuid, identity_uuid, instance_id):
     return esh_instance
 
 
-class InstanceList(AuthAPIView):
+class InstanceList(ConditionalGetMixin, AuthAPIView):
 
     """
     Instances are the objects created when you launch a machine. They are
@@ -93,6 +94,21 @@ class InstanceList(AuthAPIView):
     attributes of an Instance are:
     Name, Status (building, active, suspended), Size, Machine"""
 
+    def get_validators(self, request, provider_uuid, identity_uuid):
+        """
+        The version of the (fresh) cached instance list,
+        and the changes to the user's instances.
+        """
+        identity = Identity.objects.filter(uuid=identity_uuid)\
+            .select_related('created_by').first()
+        if not identity:
+            return None
+        version = get_cached_list_version("instances", identity=identity)
+        changes = change_validators("user.%s" % request.user.id)
+        if version is None or changes is None:
+            return None
+        return (version, changes)
+
     def get(self, request, provider_uuid, identity_uuid):
         """
         Returns a list of all instances
@@ -110,12 +126,11 @@ class InstanceList(AuthAPIView):
             return connection_failure(provider_uuid, identity_uuid)
         except InvalidCredsError:
             return invalid_creds(provider_uuid, identity_uuid)
-        core_instance_list = [convert_esh_instance(esh_driver,
-                                                   inst,
+        core_instance_list = convert_esh_instances(esh_driver,
+                                                   esh_instance_list,
                                                    provider_uuid,
                                                    identity_uuid,
                                                    user)
-                              for inst in esh_instance_list]
         # TODO: Core/Auth checks for shared instances
         serialized_data = InstanceSerializer(core_instance_list,
                                              context={"request": request},
@@ -692,7 +707,6 @@ class Instance(AuthAPIView):
             boot_scripts = data.pop('boot_scripts', [])
             if boot_scripts:
                 _save_scripts_to_instance(instance, boot_scripts)
-            invalidate_cached_instances(identity=identity)
             response = Response(serializer.data)
             logger.info('data = %s' % serializer.data)
             response['Cache-Control'] = 'no-cache'
@@ -745,7 +759,6 @@ class Instance(AuthAPIView):
                 serializer = InstanceSerializer(
                     new_instance,
                     context={"request": request})
-            invalidate_cached_instances(identity=identitty)
             response = Response(serializer.data)
             logger.info('data = %s' % serializer.data)
             response['Cache-Control'] = 'no-cache'
@@ -779,9 +792,7 @@ class Instance(AuthAPIView):
 
             task.destroy_instance_task(esh_instance, identity_uuid)
 
-            invalidate_cached_instances(
-                identity=Identity.objects.get(uuid=identity_uuid))
-
+            identity = Identity.objects.get(uuid=identity_uuid)
             existing_instance = esh_driver.get_instance(instance_id)
             if existing_instance:
                 # Instance will be deleted soon...
@@ -789,6 +800,9 @@ class Instance(AuthAPIView):
                 if esh_instance.extra\
                    and 'task' not in esh_instance.extra:
                     esh_instance.extra['task'] = 'queueing delete'
+                write_cached_instance(esh_instance, identity=identity)
+            else:
+                remove_cached_instance(instance_id, identity=identity)
         except VolumeAttachConflict as exc:
             message = exc.message
             return failure_response(status.HTTP_409_CONFLICT, message)
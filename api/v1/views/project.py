@@ -19,6 +19,7 @@ from api.permissions import InMaintenance, ApiAuthRequired,\
     ProjectOwnerRequired
 from api.v1.serializers import NoProjectSerializer,\
     InstanceSerializer, ProjectSerializer, VolumeSerializer
+from api.conditional import ConditionalGetMixin, project_validators
 from api.v1.views.base import AuthAPIView
 
 
@@ -210,7 +211,12 @@ class NoProjectInstanceList(AuthAPIView):
         return response
 
 
-class ProjectList(AuthAPIView):
+class ProjectList(ConditionalGetMixin, AuthAPIView):
+
+    def get_validators(self, request):
+        user = request.user
+        return project_validators(user, Project.objects.filter(
+            only_current(), owner__name=user.username))
 
     def post(self, request):
         user = request.user
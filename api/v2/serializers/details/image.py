@@ -2,6 +2,7 @@ from core.models import Application as Image, BootScript
 from rest_framework import serializers
 
 from api.v2.serializers.summaries import UserSummarySerializer
+from service.search import highlight
 from api.v2.serializers.fields import (
         ImageVersionRelatedField, TagRelatedField)
 
@@ -43,3 +44,36 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
             'tags',
             'versions'
         )
+
+    def to_representation(self, image):
+        data = super(ImageSerializer, self).to_representation(image)
+        request = self.context.get('request')
+        query = request.query_params.get('search') if request else None
+        if query:
+            data['search_highlights'] = self.get_highlights(image, query)
+        return data
+
+    def get_highlights(self, image, query):
+        """
+        The first match of 'query' in each field searched (See
+        service.search.build_image_index)
+        NOTE: Reads the related objects loaded by ImageSearchFilter, filtering
+        them here would query once per image.
+        """
+        tags = list(image.tags.all())
+        fields = [
+            ("name", [image.name]),
+            ("tags", [tag.name for tag in tags]),
+            ("tag_descriptions", [tag.description for tag in tags]),
+            ("created_by", [image.created_by.username]),
+            ("change_log",
+             [version.change_log for version in image.versions.all()]),
+        ]
+        highlights = {}
+        for field, values in fields:
+            for value in values:
+                snippet = highlight(value, query)
+                if snippet:
+                    highlights[field] = snippet
+                    break
+        return highlights
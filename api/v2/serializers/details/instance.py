@@ -1,4 +1,4 @@
-from core.models import BootScript, Instance, Application as Image
+from core.models import BootScript, Instance
 from rest_framework import serializers
 from api.v2.serializers.fields import ModelRelatedField
 from api.v2.serializers.summaries import (
@@ -34,12 +34,15 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
         return serializer.data
 
     def get_image(self, obj):
-        image_uuid = obj.application_uuid()
-        image = Image.objects.get(uuid=image_uuid)
+        if not obj.source.is_machine():
+            return None
+        image = obj.source.providermachine.application_version.application
         serializer = ImageSummarySerializer(image, context=self.context)
         return serializer.data
 
     def get_version(self, obj):
+        if not obj.source.is_machine():
+            return None
         version = obj.source.providermachine.application_version
         serializer = ImageVersionSummarySerializer(
             version,
@@ -28,7 +28,7 @@ class InstanceStatusHistorySerializer(serializers.HyperlinkedModelSerializer):
         source='instance.provider_machine.provider')
     image = ImageSummarySerializer(
         source='instance.provider_machine.application_version.application')
-    status = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    status = serializers.CharField(source='status_name', read_only=True)
 
     class Meta:
         model = InstanceStatusHistory
@@ -36,7 +36,13 @@ class ModelRelatedField(serializers.RelatedField):
             % self.___class__.__name__
         )
         queryset = self.get_queryset()
-        obj = queryset.get(pk=value.pk)
+        if isinstance(value, queryset.model) and not queryset.query.where:
+            # Already loaded (or prefetched) by the parent queryset, and
+            # the queryset of the field would not exclude it.
+            # (Input is always looked up in the queryset, to_internal_value)
+            obj = value
+        else:
+            obj = queryset.get(pk=value.pk)
         serializer = self.serializer_class(obj, context=self.context)
         return serializer.data
 
@@ -1,4 +1,4 @@
-from core.models import Instance, Application as Image
+from core.models import Instance
 from rest_framework import serializers
 from .identity import IdentitySummarySerializer
 from .size import SizeSummarySerializer
@@ -24,8 +24,9 @@ class InstanceSummarySerializer(serializers.HyperlinkedModelSerializer):
         return serializer.data
 
     def get_image(self, obj):
-        image_uuid = obj.application_uuid()
-        image = Image.objects.get(uuid=image_uuid)
+        if not obj.source.is_machine():
+            return None
+        image = obj.source.providermachine.application_version.application
         serializer = ImageSummarySerializer(image, context=self.context)
         return serializer.data
 
@@ -1,16 +1,40 @@
 from django.contrib.auth.models import AnonymousUser
+from rest_framework.filters import DjangoFilterBackend, SearchFilter
 
 from core.models import Application as Image
 from core.models import AtmosphereUser, AccountProvider
 from core.query import only_current, only_current_apps
 
 from api import permissions
+from api.conditional import ConditionalGetMixin, change_validators,\
+    queryset_validators
+from api.pagination import OptionalKeysetPagination
 from api.v2.serializers.details import ImageSerializer
 from api.v2.views.base import AuthOptionalViewSet
 from api.v2.views.mixins import MultipleFieldLookup
+from service.search import search_images, order_by_rank
 
 
-class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
+class ImageSearchFilter(SearchFilter):
+
+    """
+    Search the image index (See service.search) for every word of the
+    'search' parameter, best ranked images first.
+    Results are highlighted from their tags, versions and creator, which
+    are loaded along (See ImageSerializer.get_highlights).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return order_by_rank(queryset, search_images(query))\
+            .select_related('created_by')\
+            .prefetch_related('tags', 'versions')
+
+
+class ImageViewSet(ConditionalGetMixin, MultipleFieldLookup,
+                   AuthOptionalViewSet):
 
     """
     API endpoint that allows images to be viewed or edited.
@@ -19,6 +43,8 @@ class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
 
     http_method_names = ['get', 'put', 'patch', 'head', 'options', 'trace']
 
+    filter_backends = (DjangoFilterBackend, ImageSearchFilter)
+
     filter_fields = ('created_by__username', 'tags__name')
 
     permission_classes = (permissions.InMaintenance,
@@ -28,9 +54,43 @@ class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
 
     serializer_class = ImageSerializer
 
-    search_fields = ('id', 'name', 'versions__change_log', 'tags__name',
-                     'tags__description', 'created_by__username')
+    pagination_class = OptionalKeysetPagination
+    # Search results are ordered by rank (See ImageSearchFilter)
+    keyset_conflicting_params = ('search',)
+
+    # Visibility is materialized (and filtered) once per request,
+    # for get_validators and the listing alike
+    visible_images = None
+    filtered_images = None
 
     def get_queryset(self):
-        request_user = self.request.user
-        return Image.current_apps(request_user)
+        if self.visible_images is None:
+            self.visible_images = Image.current_apps(self.request.user)
+        return self.visible_images.all()
+
+    def filter_images(self):
+        """
+        The visible images filtered by the query parameters
+        (The search is left to ImageSearchFilter)
+        """
+        if self.filtered_images is None:
+            self.filtered_images = DjangoFilterBackend().filter_queryset(
+                self.request, self.get_queryset(), self)
+        return self.filtered_images.all()
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return super(ImageViewSet, self).filter_queryset(queryset)
+        return ImageSearchFilter().filter_queryset(
+            self.request, self.filter_images(), self)
+
+    def get_validators(self, request, *args, **kwargs):
+        if self.action != 'list':
+            return None
+        changes = change_validators("images")
+        if changes is None:
+            return None
+        # Search results are ranked (and cut) from the visible images,
+        # the index only changes with the "images" change counter
+        return changes + queryset_validators(
+            self.filter_images(), 'start_date', 'end_date')
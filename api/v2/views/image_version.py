@@ -2,6 +2,7 @@ from rest_framework import filters
 import django_filters
 
 from core.models import ApplicationVersion as ImageVersion
+from api.pagination import OptionalKeysetPagination
 from api.v2.views.base import AuthOptionalViewSet
 from api.v2.serializers.details import ImageVersionSerializer
 
@@ -22,6 +23,7 @@ class ImageVersionViewSet(AuthOptionalViewSet):
     """
     queryset = ImageVersion.objects.all()
     serializer_class = ImageVersionSerializer
+    pagination_class = OptionalKeysetPagination
     search_fields = ('application__id', 'application__created_by__username')
     ordering_fields = ('start_date',)
     ordering = ('start_date',)
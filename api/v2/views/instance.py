@@ -3,12 +3,15 @@ from api.v2.serializers.details import InstanceSerializer
 from core.query import only_current
 
 from api.v1.views.instance import Instance as V1Instance
+from api.conditional import ConditionalGetMixin, change_validators,\
+    queryset_validators
+from api.pagination import OptionalKeysetPagination
 
 from api.v2.serializers.details import InstanceSerializer
 from api.v2.views.base import AuthViewSet
 
 
-class InstanceViewSet(AuthViewSet):
+class InstanceViewSet(ConditionalGetMixin, AuthViewSet):
 
     """
     API endpoint that allows providers to be viewed or edited.
@@ -16,6 +19,7 @@ class InstanceViewSet(AuthViewSet):
 
     queryset = Instance.objects.all()
     serializer_class = InstanceSerializer
+    pagination_class = OptionalKeysetPagination
     filter_fields = ('created_by__id', 'projects')
     http_method_names = ['get', 'put', 'patch', 'head', 'options', 'trace']
 
@@ -24,9 +28,28 @@ class InstanceViewSet(AuthViewSet):
         Filter projects by current user.
         """
         user = self.request.user
-        if 'archived' in self.request.QUERY_PARAMS:
-            return Instance.objects.filter(created_by=user)
-        return Instance.objects.filter(only_current(), created_by=user)
+        queryset = Instance.objects.filter(created_by=user)
+        if 'archived' not in self.request.QUERY_PARAMS:
+            queryset = queryset.filter(only_current())
+        # Everything read by InstanceSerializer, so that a page of
+        # instances costs the same number of queries as a single instance
+        return queryset.select_related(
+            'created_by',
+            'created_by_identity__provider',
+            'last_size',
+            'source__providermachine__application_version__application'
+        ).prefetch_related('projects', 'scripts__script_type')
+
+    def get_validators(self, request, *args, **kwargs):
+        if self.action != 'list':
+            return None
+        changes = change_validators("user.%s" % request.user.id)
+        if changes is None:
+            return None
+        # Status and size changes move Instance.last_history
+        return changes + queryset_validators(
+            self.filter_queryset(self.get_queryset()),
+            'start_date', 'end_date', 'last_history')
 
     def perform_destroy(self, instance):
         return V1Instance().delete(self.request,
@@ -5,6 +5,7 @@ import django_filters
 
 from core.models import InstanceStatusHistory
 
+from api.pagination import OptionalKeysetPagination
 from api.v2.serializers.details import InstanceStatusHistorySerializer
 from api.v2.views.base import AuthReadOnlyViewSet
 
@@ -37,6 +38,8 @@ class InstanceStatusHistoryViewSet(AuthReadOnlyViewSet):
     serializer_class = InstanceStatusHistorySerializer
     ordering = ('-start_date', 'instance__id')
     ordering_fields = ('start_date', 'instance__id')
+    pagination_class = OptionalKeysetPagination
+    keyset_conflicting_params = ('ordering',)
     filter_class = InstanceStatusHistoryFilter
     filter_backends = (filters.OrderingFilter, filters.DjangoFilterBackend)
 
@@ -5,11 +5,13 @@ from core.query import only_current
 
 from api.v2.serializers.details import ProjectSerializer,\
     VolumeSerializer, InstanceSerializer
+from api.conditional import ConditionalGetMixin, project_validators
 from api.v2.views.base import AuthViewSet
 from api.v2.views.mixins import MultipleFieldLookup
 
 
-class ProjectViewSet(MultipleFieldLookup, AuthViewSet):
+class ProjectViewSet(ConditionalGetMixin, MultipleFieldLookup,
+                     AuthViewSet):
 
     """
     API endpoint that allows projects to be viewed or edited.
@@ -48,6 +50,11 @@ class ProjectViewSet(MultipleFieldLookup, AuthViewSet):
         return Project.objects.filter(only_current(),
                                       owner__name=user.username)
 
+    def get_validators(self, request, *args, **kwargs):
+        if self.action != 'list':
+            return None
+        return project_validators(request.user, self.get_queryset())
+
     @detail_route()
     def instances(self, *args, **kwargs):
         project = self.get_object()
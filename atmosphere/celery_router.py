@@ -44,6 +44,12 @@ PERIODIC_TASKS = [
     "monitor_sizes", "monitor_sizes_for",
     "monitor_machines", "monitor_machines_for",
     "monitor_instances", "monitor_instances_for",
+    "update_stale_allocation_snapshots",
+    "refresh_cached_list",
+    "update_provider_snapshots", "update_provider_snapshot_for",
+    "update_image_index",
+    "enforce_exhausted_allocations", "enforce_allocation_for",
+    "update_enforced_instances",
     "check_image_membership", "update_membership_for",
     "clear_empty_ips", "clear_empty_ips_for",
     "remove_empty_networks_for",
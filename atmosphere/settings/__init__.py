@@ -402,9 +402,26 @@ CELERYBEAT_SCHEDULE = {
     },
     "monitor_instances": {
         "task": "monitor_instances",
-        "schedule": timedelta(minutes=15),
+        # Allocations are enforced by enforce_exhausted_allocations
+        "schedule": timedelta(minutes=60),
         "options": {"expires": 10 * 60, "time_limit": 10 * 60}
     },
+    "update_provider_snapshots": {
+        "task": "update_provider_snapshots",
+        # Sooner than service.cache.CACHE_STALE_TIMEOUT
+        "schedule": timedelta(minutes=5),
+        "options": {"expires": 5 * 60, "time_limit": 5 * 60}
+    },
+    "update_stale_allocation_snapshots": {
+        "task": "update_stale_allocation_snapshots",
+        "schedule": timedelta(minutes=1),
+        "options": {"expires": 60, "time_limit": 5 * 60}
+    },
+    "enforce_exhausted_allocations": {
+        "task": "enforce_exhausted_allocations",
+        "schedule": timedelta(minutes=1),
+        "options": {"expires": 60, "time_limit": 60}
+    },
     "clear_empty_ips": {
         "task": "clear_empty_ips",
         "schedule": timedelta(minutes=120),
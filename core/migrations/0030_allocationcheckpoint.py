@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_machinerequest_new_version_scripts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationCheckpoint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('signature', models.CharField(max_length=32)),
+                ('start_date', models.DateTimeField()),
+                ('as_of', models.DateTimeField()),
+                ('runtime', models.DurationField()),
+                ('burn_rate', models.DurationField()),
+                ('last_history_id', models.IntegerField()),
+                ('identity', models.ForeignKey(related_name='checkpoints', to='core.Identity')),
+            ],
+            options={
+                'db_table': 'allocation_checkpoint',
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+# Store the newest InstanceStatusHistory (by start_date, then id) on every
+# instance. (See core.models.instance._newest_histories)
+BACKFILL_LAST_HISTORY = """
+UPDATE instance
+SET last_history_id = newest.id,
+    last_status_id = newest.status_id,
+    last_size_id = newest.size_id
+FROM (SELECT DISTINCT ON (instance_id) id, instance_id, status_id, size_id
+      FROM instance_status_history
+      ORDER BY instance_id, start_date DESC, id DESC) AS newest
+WHERE instance.id = newest.instance_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_allocationcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='last_history',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='core.InstanceStatusHistory', null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='last_size',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='core.Size', null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='last_status',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='core.InstanceStatus', null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='last_task',
+            field=models.CharField(max_length=128, null=True, blank=True),
+        ),
+        migrations.RunSQL(BACKFILL_LAST_HISTORY, migrations.RunSQL.noop),
+    ]
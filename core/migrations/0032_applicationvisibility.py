@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_instance_last_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationVisibility',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('scope', models.CharField(max_length=64)),
+                ('application', models.ForeignKey(related_name='+', to='core.Application')),
+            ],
+            options={
+                'db_table': 'application_visibility',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='applicationvisibility',
+            unique_together=set([('scope', 'application')]),
+        ),
+    ]
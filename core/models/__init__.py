@@ -4,8 +4,9 @@
 Collection of models
 """
 from core.models.allocation_strategy import Allocation, AllocationStrategy
+from core.models.allocation_ledger import AllocationCheckpoint
 from core.models.application import Application, ApplicationMembership,\
-    ApplicationScore, ApplicationBookmark
+    ApplicationScore, ApplicationBookmark, ApplicationVisibility
 from core.models.application_tag import ApplicationTag
 from core.models.application_version import ApplicationVersion, ApplicationVersionMembership
 from core.models.cloud_admin import CloudAdministrator
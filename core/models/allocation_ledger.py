@@ -0,0 +1,55 @@
+"""
+Allocation ledger (implemented as Django DB based models)
+"""
+from django.db import models
+from django.db.models import Q
+
+from allocation.models import Checkpoint
+
+
+class AllocationCheckpoint(models.Model):
+
+    """
+    Running time of an Identity over one (closed) allocation time period,
+    counted up to 'as_of'. Checkpoints are only valid for the allocation
+    'signature' (rules, credits and window) they were calculated with.
+    """
+    identity = models.ForeignKey("Identity", related_name="checkpoints")
+    signature = models.CharField(max_length=32)
+    start_date = models.DateTimeField()
+    as_of = models.DateTimeField()
+    runtime = models.DurationField()
+    burn_rate = models.DurationField()
+    # Histories created after this one must be counted (again)
+    last_history_id = models.IntegerField()
+
+    def to_checkpoint(self):
+        return Checkpoint(self.start_date, self.as_of,
+                          self.runtime, self.burn_rate)
+
+    @classmethod
+    def invalidate(cls, identity):
+        """
+        Use when InstanceStatusHistory is re-written after the fact.
+        """
+        return cls.objects.filter(identity=identity).delete()
+
+    @classmethod
+    def invalidate_since(cls, since, identity_ids=(), instance_ids=()):
+        """
+        Use when the time used (by the identities, or the instances of
+        identities) changed from 'since' onward.
+        Checkpoints counted after 'since' are deleted.
+        """
+        return cls.objects.filter(
+            Q(identity__in=list(identity_ids)) |
+            Q(identity__instance__in=list(instance_ids)),
+            as_of__gt=since).delete()
+
+    def __unicode__(self):
+        return "%s - Period:%s Runtime:%s As of:%s" %\
+            (self.identity, self.start_date, self.runtime, self.as_of)
+
+    class Meta:
+        db_table = 'allocation_checkpoint'
+        app_label = 'core'
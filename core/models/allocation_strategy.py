@@ -4,6 +4,7 @@ Strategy (implemented as Django DB based models)
 from dateutil.relativedelta import relativedelta
 
 from django.db import models
+from django.db.models.signals import post_save, m2m_changed
 from django.utils import timezone
 
 from allocation.models.strategy import \
@@ -202,7 +203,7 @@ class AllocationStrategy(models.Model):
                                           tzinfo=timezone.utc)
         return OneTimeRefresh(increase_date)
 
-    def apply(self, identity, core_allocation):
+    def apply(self, identity, core_allocation, instances=None):
         """
         Create an allocation.models.allocationstrategy
         """
@@ -212,7 +213,7 @@ class AllocationStrategy(models.Model):
         rules_behaviors = self._parse_rules_behaviors()
         new_strategy = PythonAllocationStrategy(
             counting_behavior, refresh_behaviors, rules_behaviors)
-        return new_strategy.apply(identity, core_allocation)
+        return new_strategy.apply(identity, core_allocation, instances)
 
     def execute(self, identity, core_allocation):
         from allocation.engine import calculate_allocation
@@ -227,3 +228,32 @@ class AllocationStrategy(models.Model):
     class Meta:
         db_table = "allocation_strategy"
         app_label = "core"
+
+
+def invalidate_allocation_snapshots(sender, instance, **kwargs):
+    """
+    Every identity on the provider is counted differently now.
+    """
+    action = kwargs.get('action')
+    if action and not action.startswith('post_'):
+        return
+    if isinstance(instance, AllocationStrategy):
+        provider_ids = [instance.provider_id]
+    else:
+        # Behaviors were changed from the reverse side
+        provider_ids = AllocationStrategy.objects.filter(
+            id__in=kwargs.get('pk_set') or []
+        ).values_list('provider_id', flat=True)
+    # Circular reference
+    from core.models.identity import Identity
+    from service.monitoring import invalidate_allocation_snapshots
+    invalidate_allocation_snapshots(
+        Identity.objects.filter(provider__in=provider_ids)
+        .values_list('id', flat=True))
+
+post_save.connect(invalidate_allocation_snapshots,
+                  sender=AllocationStrategy)
+m2m_changed.connect(invalidate_allocation_snapshots,
+                    sender=AllocationStrategy.refresh_behaviors.through)
+m2m_changed.connect(invalidate_allocation_snapshots,
+                    sender=AllocationStrategy.rules_behaviors.through)
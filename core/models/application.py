@@ -1,8 +1,11 @@
+from functools import partial
+from operator import or_
 from uuid import uuid4, uuid5
 from hashlib import md5
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, Min
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.contrib.auth.models import AnonymousUser
 from django.utils import timezone
 
@@ -12,9 +15,11 @@ from atmosphere import settings
 
 from core.query import only_current, only_current_apps, only_current_source
 from core.models.provider import Provider, AccountProvider
+from core.models.instance_source import InstanceSource
 from core.models.identity import Identity
 from core.models.tag import Tag, updateTags
-from core.models.application_version import ApplicationVersion
+from core.models.application_version import ApplicationVersion,\
+    ApplicationVersionMembership
 
 
 class Application(models.Model):
@@ -91,7 +96,10 @@ class Application(models.Model):
 
     @classmethod
     def shared_with(cls, user):
-        group_ids = user.group_ids()
+        return Application.shared_with_groups(user.group_ids())
+
+    @classmethod
+    def shared_with_groups(cls, group_ids):
         shared_images = Application.objects.filter(
             only_current_apps(),
             (Q(versions__machines__members__id__in=group_ids) |
@@ -104,7 +112,10 @@ class Application(models.Model):
         """
         Just give staff the ability to launch everything that isn't end-dated.
         """
-        provider_ids = user.provider_ids()
+        return Application.admin_apps_on(user.provider_ids())
+
+    @classmethod
+    def admin_apps_on(cls, provider_ids):
         admin_images = Application.objects.filter(
             only_current(),
             versions__machines__instance_source__provider__id__in=provider_ids)
@@ -112,22 +123,29 @@ class Application(models.Model):
 
     @classmethod
     def current_apps(cls, atmo_user=None):
+        """
+        Applications visible to 'atmo_user': public, created by, shared with
+        (a group of) or, for staff, on a provider of the user.
+        NOTE: Visibility is materialized per scope (See visible_apps)
+        """
         from core.models.user import AtmosphereUser
-        public_images = Application.public_apps()
+        scopes = {"public": Application.public_apps}
         if not atmo_user or isinstance(atmo_user, AnonymousUser):
-            return public_images.distinct()
+            return Application.objects.filter(id__in=visible_apps(scopes))
         if not isinstance(atmo_user, AtmosphereUser):
             raise Exception("Expected atmo_user to be of type AtmosphereUser"
                             " - Received %s" % type(atmo_user))
-        user_images = atmo_user.application_set.all()
-        shared_images = Application.shared_with(atmo_user)
+        for group_id in atmo_user.group_ids():
+            scopes["group.%s" % group_id] = partial(
+                Application.shared_with_groups, [group_id])
         if atmo_user.is_staff:
-            admin_images = Application.admin_apps(atmo_user)
-        else:
-            admin_images = Application.objects.none()
-        all_the_images = (public_images | user_images |
-                shared_images | admin_images).distinct()
-        return all_the_images
+            for provider_id in set(atmo_user.provider_ids()):
+                scopes["provider.%s" % provider_id] = partial(
+                    Application.admin_apps_on, [provider_id])
+        # Filters on tags and versions may join several rows per application
+        return Application.objects.filter(
+            Q(id__in=visible_apps(scopes)) |
+            Q(created_by=atmo_user)).distinct()
 
     def _current_machines(self, request_user=None):
         """
@@ -623,3 +641,126 @@ def _get_admin_owner(provider_uuid):
                 " AccountProviders are necessary to claim ownership "
                 " for identities that do not yet exist in the DB."
                 % Provider.objects.get(uuid=provider_uuid))
+
+
+class ApplicationVisibility(models.Model):
+
+    """
+    The applications visible in a scope ("public", "group.<id>",
+    "provider.<id>"), materialized by visible_apps.
+    """
+    scope = models.CharField(max_length=64)
+    application = models.ForeignKey(Application, related_name="+")
+
+    def __unicode__(self):
+        return "%s: %s" % (self.scope, self.application_id)
+
+    class Meta:
+        db_table = 'application_visibility'
+        app_label = 'core'
+        unique_together = ('scope', 'application')
+
+
+def visible_apps(scopes):
+    """
+    Returns a subquery of the application ids visible in any of 'scopes', a
+    dict of scope name -> method returning the applications of that scope.
+    Scopes are materialized in ApplicationVisibility and rebuilt once an
+    image changes (See bump_image_changes) or a start or end date passes.
+    Without redis the scopes are queried directly.
+    """
+    from service.cache import get_stale_visibility_scopes,\
+        set_visibility_scopes, lock_visibility_scope,\
+        unlock_visibility_scope
+    version, stale, unbuilt = get_stale_visibility_scopes(scopes.keys())
+    if version is None:
+        return _query_scopes(scopes.values())
+    queried = []
+    next_change = _next_visibility_change(timezone.now()) if stale else None
+    for scope in stale:
+        token = lock_visibility_scope(scope)
+        if not token:
+            # Another request is rebuilding the scope, its old rows are
+            # served meanwhile (if there are any)
+            if scope in unbuilt:
+                queried.append(scopes[scope])
+            continue
+        try:
+            _materialize_scope(scope, scopes[scope])
+            set_visibility_scopes(version, [scope], next_change)
+        finally:
+            unlock_visibility_scope(scope, token)
+    materialized = ApplicationVisibility.objects.filter(
+        scope__in=scopes.keys()).values('application_id')
+    if not queried:
+        return materialized
+    return Application.objects.filter(
+        Q(id__in=materialized) |
+        Q(id__in=_query_scopes(queried))).values('id')
+
+
+def _query_scopes(apps_methods):
+    return reduce(or_, [apps_method() for apps_method in apps_methods])\
+        .values('id')
+
+
+def _next_visibility_change(now):
+    """
+    The first start or end date after 'now' of an application, version,
+    machine or provider. (Visibility changes then, without a signal)
+    """
+    dates = [
+        model.objects.filter(**{"%s__gt" % field: now})
+        .aggregate(next_date=Min(field))["next_date"]
+        for model in (Application, ApplicationVersion, InstanceSource,
+                      Provider)
+        for field in ("start_date", "end_date")]
+    dates = [date for date in dates if date]
+    return min(dates) if dates else None
+
+
+def _materialize_scope(scope, apps_method):
+    """
+    Update the rows of 'scope' in place, so concurrent requests see either
+    the old or the new applications.
+    """
+    app_ids = set(apps_method().values_list('id', flat=True))
+    try:
+        with transaction.atomic():
+            rows = ApplicationVisibility.objects.filter(scope=scope)
+            current_ids = set(rows.values_list('application_id', flat=True))
+            if current_ids - app_ids:
+                rows.filter(application_id__in=current_ids - app_ids)\
+                    .delete()
+            ApplicationVisibility.objects.bulk_create(
+                [ApplicationVisibility(scope=scope, application_id=app_id)
+                 for app_id in app_ids - current_ids])
+    except IntegrityError:
+        # The lock of the scope expired and another request rebuilt it
+        logger.warn("Visibility of %s was materialized concurrently" % scope)
+
+
+def bump_image_changes(sender, **kwargs):
+    """
+    An image (or its versions, machines, members or providers) has changed.
+    (See api.conditional and visible_apps)
+    """
+    if not kwargs.get('action', 'post_').startswith('post_'):
+        return
+    from service.cache import bump_change_counters
+    bump_change_counters("images")
+
+post_save.connect(bump_image_changes, sender=Application)
+post_delete.connect(bump_image_changes, sender=Application)
+post_save.connect(bump_image_changes, sender=ApplicationMembership)
+post_delete.connect(bump_image_changes, sender=ApplicationMembership)
+post_save.connect(bump_image_changes, sender=ApplicationVersion)
+post_delete.connect(bump_image_changes, sender=ApplicationVersion)
+post_save.connect(bump_image_changes, sender=ApplicationVersionMembership)
+post_delete.connect(bump_image_changes, sender=ApplicationVersionMembership)
+m2m_changed.connect(bump_image_changes, sender=Application.tags.through)
+post_save.connect(bump_image_changes, sender=Tag)
+post_delete.connect(bump_image_changes, sender=Tag)
+# Provider activity and end dates decide which images are current
+post_save.connect(bump_image_changes, sender=Provider)
+post_delete.connect(bump_image_changes, sender=Provider)
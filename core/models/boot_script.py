@@ -8,12 +8,13 @@ import pytz
 
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import m2m_changed
 from django.utils import timezone
 from django.utils.text import slugify
 
 from threepio import logger
 from uuid import uuid4
-from core.models.instance import Instance
+from core.models.instance import Instance, bump_instance_relation_changes
 from core.models.application import Application
 
 
@@ -145,3 +146,7 @@ def _save_scripts_to_instance(instance, boot_script_list):
     for script_id in boot_script_list:
         script = BootScript.objects.get(id=script_id)
         script.instances.add(instance)
+
+
+m2m_changed.connect(bump_instance_relation_changes,
+                    sender=BootScript.instances.through)
@@ -6,6 +6,7 @@ Note:
 """
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from core.models.identity import Identity
 from core.models.provider import Provider
 
@@ -61,6 +62,21 @@ class Credential(models.Model):
         app_label = 'core'
 
 
+def invalidate_provider_drivers(sender, instance, **kwargs):
+    from service.cache import invalidate_cached_driver
+    invalidate_cached_driver(provider_id=instance.provider_id)
+
+
+def invalidate_identity_driver(sender, instance, **kwargs):
+    from service.cache import invalidate_cached_driver
+    invalidate_cached_driver(identity_id=instance.identity_id)
+
+post_save.connect(invalidate_provider_drivers, sender=ProviderCredential)
+post_delete.connect(invalidate_provider_drivers, sender=ProviderCredential)
+post_save.connect(invalidate_identity_driver, sender=Credential)
+post_delete.connect(invalidate_identity_driver, sender=Credential)
+
+
 def get_groups_using_credential(cred_key, cred_value, provider):
     from threepio import logger
     credentials_found = Credential.objects.filter(
@@ -132,18 +132,15 @@ class IdentityMembership(models.Model):
             return {}
         # Don't move it up. Circular reference.
         from django.conf import settings
-        from service.monitoring import get_delta, _get_allocation_result
+        from service.monitoring import get_delta, get_allocation_snapshot
         delta = get_delta(self, time_period=settings.FIXED_WINDOW)
-        allocation_result = _get_allocation_result(self.identity)
-        over_allocation, diff_amount = allocation_result.total_difference()
-        burn_time = allocation_result.get_burn_rate()
+        snapshot = get_allocation_snapshot(self.identity)
+        diff_amount = snapshot["difference"]
         # Moving from seconds to hours
-        hourly_credit = int(allocation_result
-                            .total_credit().total_seconds() / 3600.0)
-        hourly_runtime = int(allocation_result
-                             .total_runtime().total_seconds() / 3600.0)
+        hourly_credit = int(snapshot["credit"].total_seconds() / 3600.0)
+        hourly_runtime = int(snapshot["runtime"].total_seconds() / 3600.0)
         hourly_difference = int(diff_amount.total_seconds() / 3600.0)
-        zero_time = allocation_result.time_to_zero()
+        zero_time = snapshot["time_to_zero"]
 
         allocation_dict = {
             "threshold": hourly_credit,
@@ -171,6 +168,9 @@ class IdentityMembership(models.Model):
         specific quota too.
         """
         super(IdentityMembership, self).save(*args, **kwargs)
+        # The allocation may have changed too.
+        from service.monitoring import invalidate_allocation_snapshots
+        invalidate_allocation_snapshots([self.identity_id])
         try:
             from service.tasks.admin import set_provider_quota
             set_provider_quota.apply_async(args=[str(self.identity.uuid)])
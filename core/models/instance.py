@@ -1,11 +1,14 @@
 """
   Instance model for atmosphere.
 """
+import time
 from hashlib import md5
 from datetime import datetime, timedelta
 
-from django.db import models, transaction, DatabaseError
+from django.db import models, transaction, DatabaseError, IntegrityError
 from django.db.models import Q
+from django.db.models.signals import post_init, post_save, post_delete,\
+    m2m_changed
 from django.utils import timezone
 
 import pytz
@@ -16,7 +19,9 @@ from rtwo.size import MockSize
 from threepio import logger
 
 from core.models.instance_source import InstanceSource
+from core.models.provider import Provider
 from core.models.identity import Identity
+from core.models.allocation_ledger import AllocationCheckpoint
 from core.models.machine import (
     convert_esh_machine, get_or_create_provider_machine)
 from core.models.volume import convert_esh_volume
@@ -24,6 +29,10 @@ from core.models.size import convert_esh_size, Size
 from core.models.tag import Tag
 from core.query import only_current
 
+# Seconds before the status registry is reloaded
+STATUS_REGISTRY_TIMEOUT = 10 * 60
+# (expires, {id: InstanceStatus}, {name: InstanceStatus})
+status_registry = [(0, {}, {})]
 
 OPENSTACK_TASK_STATUS_MAP = {
     # Terminate tasks
@@ -185,6 +194,18 @@ class Instance(models.Model):
     # FIXME  Problems when setting a default.
     start_date = models.DateTimeField()
     end_date = models.DateTimeField(null=True, blank=True)
+    # The newest InstanceStatusHistory (and the task it was created with)
+    # Kept in sync by InstanceStatusHistory.transaction
+    last_history = models.ForeignKey(
+        'InstanceStatusHistory', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+    last_status = models.ForeignKey(
+        'InstanceStatus', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+    last_size = models.ForeignKey(
+        'Size', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+    last_task = models.CharField(max_length=128, null=True, blank=True)
     objects = models.Manager()  # The default manager.
     active_instances = ActiveInstancesManager()
 
@@ -203,12 +224,12 @@ class Instance(models.Model):
         """
         Returns the newest InstanceStatusHistory
         """
-        # TODO: Profile Option
-        # except InstanceStatusHistory.DoesNotExist:
-        # TODO: Profile current choice
+        if self.last_history_id:
+            return self.last_history
         last_history = self.instancestatushistory_set.all().order_by(
-            '-start_date')
+            '-start_date', '-id')
         if last_history:
+            self.set_last_history(last_history[0])
             return last_history[0]
         else:
             unknown_size = Size.objects.get(
@@ -219,6 +240,23 @@ class Instance(models.Model):
                         "An 'Unknown' history was created" % self)
             return last_history
 
+    def set_last_history(self, history, task=None, notify=True):
+        """
+        Store 'history' (The newest InstanceStatusHistory) on the instance.
+        Unless notify=False (The caller does it once for many instances),
+        the instances of the user are marked as changed.
+        """
+        self.last_history = history
+        self.last_status_id = history.status_id
+        self.last_size = history.size
+        self.last_task = task
+        Instance.objects.filter(id=self.id).update(
+            last_history=history, last_status=history.status_id,
+            last_size=history.size_id, last_task=task)
+        if notify:
+            # Signals are not sent by update()
+            bump_user_instance_changes([self.created_by_id])
+
     def _build_first_history(self, status_name, size, start_date,
                              end_date=None, first_update=False):
         if not first_update and status_name not in [
@@ -232,6 +270,7 @@ class Instance(models.Model):
         first_history = InstanceStatusHistory.create_history(
             status_name, self, size, start_date, end_date)
         first_history.save()
+        self.set_last_history(first_history)
         return first_history
 
     def update_history(
@@ -260,13 +299,17 @@ class Instance(models.Model):
             last_history = InstanceStatusHistory.create_history(
                 status_name, self, size, self.start_date)
             last_history.save()
+            self.set_last_history(last_history, task)
             logger.debug("STATUSUPDATE - FIRST - Instance:%s Old Status: %s New Status: %s Tmp Status: %s" % (self.provider_alias, self.esh_status(), status_name, tmp_status))
             logger.debug("STATUSUPDATE - Traceback: %s" % traceback.format_stack())
         # 2. Size and name must match to continue using last history
-        if last_history.status.name == status_name \
-                and last_history.size.id == size.id:
+        if last_history.status_name == status_name \
+                and last_history.size_id == size.id:
             # logger.info("status_name matches last history:%s " %
             #        last_history.status.name)
+            if self.last_task != task:
+                self.last_task = task
+                Instance.objects.filter(id=self.id).update(last_task=task)
             return (False, last_history)
         logger.debug("STATUSUPDATE - Instance:%s Old Status: %s New Status: %s Tmp Status: %s" % (self.provider_alias, self.esh_status(), status_name, tmp_status))
         logger.debug("STATUSUPDATE - Traceback: %s" % traceback.format_stack())
@@ -277,7 +320,8 @@ class Instance(models.Model):
             new_history = InstanceStatusHistory.transaction(
                 status_name, self, size,
                 start_time=now_time,
-                last_history=last_history)
+                last_history=last_history,
+                task=task)
             return (True, new_history)
         except ValueError:
             logger.exception("Bad transaction")
@@ -316,7 +360,7 @@ class Instance(models.Model):
             # multiply by CPU count of size.
             cpu_time = active_time * state.size.cpu
             logger.debug("%s,%s,%s,%s CPU,%s,%s,%s,%s"
-                         % (inst_prefix, state.status.name,
+                         % (inst_prefix, state.status_name,
                             state.size.name, state.size.cpu,
                             strfdate(start_count), strfdate(final_count),
                             strfdelta(active_time), strfdelta(cpu_time)))
@@ -425,17 +469,23 @@ class Instance(models.Model):
     def esh_status(self):
         if self.esh:
             return self.esh.get_status()
+        if self.last_status_id:
+            return get_status(self.last_status_id).name
         last_history = self.get_last_history()
         if last_history:
-            return last_history.status.name
+            return last_history.status_name
         else:
             return "Unknown"
 
     def get_size(self):
+        if self.last_size_id:
+            return self.last_size
         return self.get_last_history().size
 
     def esh_size(self):
         if not self.esh or not hasattr(self.esh, 'extra'):
+            if self.last_size_id:
+                return self.last_size.alias
             last_history = self.get_last_history()
             if last_history:
                 return last_history.size.alias
@@ -524,6 +574,47 @@ class InstanceStatus(models.Model):
         app_label = "core"
 
 
+def _load_status_registry(force=False):
+    expires, by_id, by_name = status_registry[0]
+    if force or expires < time.time():
+        # The oldest status wins when names are duplicated
+        statuses = list(InstanceStatus.objects.order_by('-id'))
+        by_id = dict((status.id, status) for status in statuses)
+        by_name = dict((status.name, status) for status in statuses)
+        status_registry[0] = (time.time() + STATUS_REGISTRY_TIMEOUT,
+                              by_id, by_name)
+    return by_id, by_name
+
+
+def get_status(status_id):
+    """
+    Returns the InstanceStatus with id 'status_id' from the status registry.
+    """
+    status = _load_status_registry()[0].get(status_id)
+    if not status:
+        status = _load_status_registry(force=True)[0].get(status_id)
+    if not status:
+        status = InstanceStatus.objects.get(id=status_id)
+    return status
+
+
+def get_status_by_name(status_name):
+    """
+    Returns the InstanceStatus named 'status_name' from the status registry,
+    it is created if it does not exist.
+    """
+    status = _load_status_registry()[1].get(status_name)
+    if not status:
+        status = _load_status_registry(force=True)[1].get(status_name)
+    if not status:
+        status, _ = InstanceStatus.objects.get_or_create(name=status_name)
+    return status
+
+
+def invalidate_status_registry(sender=None, **kwargs):
+    status_registry[0] = (0, {}, {})
+
+
 class InstanceStatusHistory(models.Model):
 
     """
@@ -538,13 +629,23 @@ class InstanceStatusHistory(models.Model):
 
     @classmethod
     def transaction(cls, status_name, instance, size,
-                    start_time=None, last_history=None):
+                    start_time=None, last_history=None, task=None):
+        """
+        End 'last_history' and start a new history at 'start_time'.
+        The new history is stored on the instance in the same transaction.
+        """
         try:
             with transaction.atomic():
+                # Required to prevent race conditions.
+                locked = Instance.objects.select_for_update(nowait=True)\
+                    .only('id', 'last_history').get(id=instance.id)
+                if last_history and locked.last_history_id\
+                        and locked.last_history_id != last_history.id:
+                    raise ValueError(
+                        "History of instance %s has changed since %s"
+                        % (instance, last_history))
                 if not last_history:
-                    # Required to prevent race conditions.
-                    last_history = instance.get_last_history()\
-                                           .select_for_update(nowait=True)
+                    last_history = locked.get_last_history()
                     if not last_history:
                         raise ValueError(
                             "A previous history is required "
@@ -562,10 +663,11 @@ class InstanceStatusHistory(models.Model):
                     "Old:%s New:%s Time:%s" %
                     (instance.created_by,
                      instance.provider_alias,
-                     last_history.status.name,
-                     new_history.status.name,
+                     last_history.status_name,
+                     new_history.status_name,
                      new_history.start_date))
                 new_history.save()
+                instance.set_last_history(new_history, task)
             return new_history
         except DatabaseError:
             logger.exception(
@@ -578,9 +680,9 @@ class InstanceStatusHistory(models.Model):
         """
         Creates a new (Unsaved!) InstanceStatusHistory
         """
-        status, _ = InstanceStatus.objects.get_or_create(name=status_name)
         new_history = InstanceStatusHistory(
-            instance=instance, size=size, status=status)
+            instance=instance, size=size,
+            status=get_status_by_name(status_name))
         if start_date:
             new_history.start_date = start_date
             logger.debug("Created new history object: %s " % (new_history))
@@ -641,8 +743,15 @@ class InstanceStatusHistory(models.Model):
             all_history = all_history.filter(end_date__lt=end_date)
         return all_history
 
+    @property
+    def status_name(self):
+        """
+        The name of the status, without a query (See get_status)
+        """
+        return get_status(self.status_id).name
+
     def __unicode__(self):
-        return "%s (FROM:%s TO:%s)" % (self.status,
+        return "%s (FROM:%s TO:%s)" % (self.status_name,
                                        self.start_date,
                                        self.end_date if self.end_date else '')
 
@@ -651,7 +760,7 @@ class InstanceStatusHistory(models.Model):
         Use this function to determine whether or not a specific instance
         status history should be considered 'active'
         """
-        if self.status.name == 'active':
+        if self.status_name == 'active':
             return True
         else:
             return False
@@ -661,13 +770,120 @@ class InstanceStatusHistory(models.Model):
         app_label = "core"
 
 
+def invalidate_allocation_snapshot(sender, instance, **kwargs):
+    """
+    The time used by the identity has changed.
+    (The identity is looked up when the snapshot is re-calculated)
+    """
+    # Circular reference
+    from service.monitoring import invalidate_allocation_snapshots
+    invalidate_allocation_snapshots(instance_ids=[instance.instance_id])
+
+def remember_history_dates(sender, instance, **kwargs):
+    # Compared when the history is saved
+    instance._saved_dates = (instance.__dict__.get('start_date'),
+                             instance.__dict__.get('end_date'))
+
+
+def invalidate_allocation_checkpoints(sender, instance, created=False,
+                                      **kwargs):
+    """
+    Checkpoints counted the time of the history as it was saved,
+    drop those counted after the earliest date that changed.
+    (See core.models.allocation_ledger)
+    """
+    saved_dates = getattr(instance, '_saved_dates', None)
+    dates = (instance.start_date, instance.end_date)
+    if created or not saved_dates or kwargs['signal'] is post_delete:
+        changed = [instance.start_date]
+    else:
+        changed = [date for saved, current in zip(saved_dates, dates)
+                   if saved != current
+                   for date in (saved, current) if date]
+    instance._saved_dates = dates
+    if changed:
+        AllocationCheckpoint.invalidate_since(
+            min(changed), instance_ids=[instance.instance_id])
+
+
+def replace_deleted_last_history(sender, instance, **kwargs):
+    """
+    Deleting the last_history of an instance only clears it (SET_NULL),
+    store the newest remaining history (and its status and size) instead.
+    """
+    core_instances = Instance.objects.filter(
+        id=instance.instance_id, last_history=None)
+    user_ids = list(core_instances.values_list('created_by', flat=True))
+    if not user_ids:
+        return
+    newest = _newest_histories([instance.instance_id])\
+        .get(instance.instance_id)
+    core_instances.update(
+        last_history=newest,
+        last_status=newest.status_id if newest else None,
+        last_size=newest.size_id if newest else None)
+    bump_user_instance_changes(user_ids)
+
+post_init.connect(remember_history_dates, sender=InstanceStatusHistory)
+post_delete.connect(replace_deleted_last_history,
+                    sender=InstanceStatusHistory)
+post_save.connect(invalidate_allocation_checkpoints,
+                  sender=InstanceStatusHistory)
+post_delete.connect(invalidate_allocation_checkpoints,
+                    sender=InstanceStatusHistory)
+post_save.connect(invalidate_allocation_snapshot,
+                  sender=InstanceStatusHistory)
+post_delete.connect(invalidate_allocation_snapshot,
+                    sender=InstanceStatusHistory)
+post_save.connect(invalidate_status_registry, sender=InstanceStatus)
+post_delete.connect(invalidate_status_registry, sender=InstanceStatus)
+
+
+def bump_user_instance_changes(user_ids):
+    """
+    The instances of the users have changed. (See api.conditional)
+    Call after update() and bulk_create(), which do not send signals.
+    """
+    from service.cache import bump_change_counters
+    bump_change_counters(*["user.%s" % user_id for user_id in set(user_ids)])
+
+
+def bump_instance_changes(sender, instance, **kwargs):
+    bump_user_instance_changes([instance.created_by_id])
+
+
+def bump_instance_relation_changes(sender, instance, action, reverse,
+                                   pk_set, **kwargs):
+    """
+    m2m_changed of a relation to Instance (I.e. Project.instances)
+    """
+    if not action.startswith('post_'):
+        return
+    from service.cache import bump_change_counters
+    if isinstance(instance, Instance):
+        user_ids = [instance.created_by_id]
+    elif pk_set:
+        user_ids = set(Instance.objects.filter(id__in=pk_set)
+                       .values_list('created_by_id', flat=True))
+    else:
+        return
+    bump_change_counters(*["user.%s" % user_id for user_id in user_ids])
+
+post_save.connect(bump_instance_changes, sender=Instance)
+post_delete.connect(bump_instance_changes, sender=Instance)
+m2m_changed.connect(bump_instance_relation_changes,
+                    sender=Instance.tags.through)
+
+
 """
 Useful utility methods for the Core Model..
 """
 
 
 def find_instance(instance_id):
-    core_instance = Instance.objects.filter(provider_alias=instance_id)
+    # The oldest instance wins (See convert_esh_instances)
+    core_instance = Instance.objects.filter(
+        provider_alias=instance_id).order_by('id')
     if len(core_instance) > 1:
         logger.warn(
             "Multiple instances returned for instance_id - %s" %
@@ -697,14 +913,25 @@ def _find_esh_ip(esh_instance):
 
 
 def _update_core_instance(core_instance, ip_address, password):
-    core_instance.ip_address = ip_address
-    if password:
+    """
+    Saves (and returns True) only when a value has changed.
+    """
+    changed = []
+    if core_instance.ip_address != ip_address:
+        core_instance.ip_address = ip_address
+        changed.append('ip_address')
+    if password and core_instance.password != password:
         core_instance.password = password
+        changed.append('password')
     if core_instance.end_date:
         logger.warn("ERROR - Instance %s prematurley 'end-dated'."
                     % core_instance.provider_alias)
         core_instance.end_date = None
-    core_instance.save()
+        changed.append('end_date')
+    if not changed:
+        return False
+    core_instance.save(update_fields=changed)
+    return True
 
 
 def _find_esh_start_date(esh_instance):
@@ -843,6 +1070,240 @@ def convert_esh_instance(
     return core_instance
 
 
+def convert_esh_instances(
+        esh_driver,
+        esh_instances,
+        provider_uuid,
+        identity_uuid,
+        user):
+    """
+    convert_esh_instance for a list of instances (Returned in the same order)
+    Core instances and their newest histories are looked up at once, and
+    new instances and histories are created with bulk_create.
+    """
+    if not esh_instances:
+        return []
+    provider = Provider.objects.get(uuid=provider_uuid)
+    core_instances = _find_instances([esh.id for esh in esh_instances])
+    new_instances = []
+    identity = None
+    for esh_instance in esh_instances:
+        core_instance = core_instances.get(esh_instance.id)
+        ip_address = _find_esh_ip(esh_instance)
+        if core_instance:
+            _update_core_instance(core_instance, ip_address, None)
+            continue
+        core_source = convert_instance_source(
+            esh_driver, esh_instance, esh_instance.source,
+            provider_uuid, identity_uuid, user)
+        if not identity:
+            identity = Identity.objects.get(uuid=identity_uuid)
+        new_instances.append(Instance(
+            name=esh_instance.name,
+            provider_alias=esh_instance.id,
+            source=core_source.instance_source,
+            ip_address=ip_address,
+            created_by=user,
+            created_by_identity=identity,
+            shell=False,
+            start_date=_find_esh_start_date(esh_instance)))
+    if new_instances:
+        try:
+            with transaction.atomic():
+                Instance.objects.bulk_create(new_instances)
+        except IntegrityError:
+            # Created meanwhile (By another request or task)
+            logger.warn("Instances created while converting %s"
+                        % [new.provider_alias for new in new_instances])
+            return [convert_esh_instance(esh_driver, esh_instance,
+                                         provider_uuid, identity_uuid, user)
+                    for esh_instance in esh_instances]
+        # bulk_create does not set the primary key
+        core_instances.update(_find_instances(
+            [new.provider_alias for new in new_instances]))
+    converted = []
+    for esh_instance in esh_instances:
+        core_instance = core_instances[esh_instance.id]
+        core_instance.esh = esh_instance
+        converted.append(core_instance)
+    _update_histories(esh_driver, converted, provider)
+    return converted
+
+
+def _find_instances(instance_ids):
+    """
+    find_instance for many instances at once.
+    Returns a dict of provider_alias -> instance
+    """
+    core_instances = {}
+    for core_instance in Instance.objects.filter(
+            provider_alias__in=instance_ids).order_by('id'):
+        # Keep the first, as find_instance does
+        core_instances.setdefault(core_instance.provider_alias, core_instance)
+    return core_instances
+
+
+def _last_histories(core_instances):
+    """
+    Returns a dict of instance.id -> the newest InstanceStatusHistory
+    """
+    last_histories = dict(
+        (history.instance_id, history) for history in
+        InstanceStatusHistory.objects.filter(
+            id__in=[core_instance.last_history_id
+                    for core_instance in core_instances
+                    if core_instance.last_history_id])
+        .select_related('size'))
+    last_histories.update(_newest_histories(
+        [core_instance.id for core_instance in core_instances
+         if core_instance.id not in last_histories]))
+    return last_histories
+
+
+def _newest_histories(instance_ids):
+    """
+    Look up the newest InstanceStatusHistory (by start_date, then id)
+    of each instance. (Without Instance.last_history)
+    Returns a dict of instance.id -> InstanceStatusHistory
+    """
+    if not instance_ids:
+        return {}
+    return dict(
+        (history.instance_id, history) for history in
+        InstanceStatusHistory.objects.filter(instance__in=instance_ids)
+        .order_by('instance', '-start_date', '-id').distinct('instance')
+        .select_related('size'))
+
+
+def check_last_histories(core_instances):
+    """
+    Compare Instance.last_history (status and size) to the newest
+    InstanceStatusHistory of each instance.
+    Returns a list of (instance, newest history) that do not match.
+    """
+    newest = _newest_histories(
+        [core_instance.id for core_instance in core_instances])
+    mismatched = []
+    for core_instance in core_instances:
+        history = newest.get(core_instance.id)
+        expected = (history.id, history.status_id, history.size_id)\
+            if history else (None, None, None)
+        if expected == (core_instance.last_history_id,
+                        core_instance.last_status_id,
+                        core_instance.last_size_id):
+            continue
+        mismatched.append((core_instance, history))
+    return mismatched
+
+
+def _update_histories(esh_driver, core_instances, provider):
+    """
+    Instance.update_history for a list of instances,
+    with the status of their 'esh' instance.
+    """
+    last_histories = _last_histories(core_instances)
+    sizes = {}
+    unknown_size = None
+    now_time = timezone.now()
+    ended_ids = []
+    new_histories = []
+    tasks = {}
+    # Users whose instances were updated without signals
+    changed_users = set()
+
+    def new_history(core_instance, status_name, size, start_date,
+                    end_date=None):
+        new_histories.append(InstanceStatusHistory(
+            instance=core_instance, size=size,
+            status=get_status_by_name(status_name),
+            start_date=start_date, end_date=end_date))
+    for core_instance in core_instances:
+        esh_instance = core_instance.esh
+        size_alias = esh_instance.size.id if esh_instance.size else None
+        if size_alias not in sizes:
+            sizes[size_alias] = _esh_instance_size_to_core(
+                esh_driver, esh_instance, provider.uuid)
+        core_size = sizes[size_alias]
+        status_name = _get_status_name_for_provider(
+            provider,
+            esh_instance.extra['status'],
+            esh_instance.extra.get('task'),
+            esh_instance.extra.get('metadata', {}).get(
+                'tmp_status', "MISSING"))
+        tasks[core_instance.id] = esh_instance.extra.get('task')
+        last_history = last_histories.get(core_instance.id)
+        if not last_history:
+            # See Instance.get_last_history
+            if not unknown_size:
+                unknown_size = Size.objects.get(alias='N/A',
+                                                provider=provider)
+            logger.warn("No history existed for %s until now. "
+                        "An 'Unknown' history was created" % core_instance)
+            if status_name == 'Unknown' and core_size.id == unknown_size.id:
+                new_history(core_instance, 'Unknown', unknown_size,
+                            core_instance.start_date)
+                continue
+            new_history(core_instance, 'Unknown', unknown_size,
+                        core_instance.start_date, now_time)
+        elif last_history.status_name == status_name\
+                and last_history.size_id == core_size.id:
+            if core_instance.last_history_id != last_history.id:
+                core_instance.set_last_history(
+                    last_history, tasks[core_instance.id], notify=False)
+                changed_users.add(core_instance.created_by_id)
+            elif core_instance.last_task != tasks[core_instance.id]:
+                core_instance.last_task = tasks[core_instance.id]
+                Instance.objects.filter(id=core_instance.id)\
+                    .update(last_task=core_instance.last_task)
+                changed_users.add(core_instance.created_by_id)
+            continue
+        else:
+            ended_ids.append((core_instance.id, last_history.id))
+        new_history(core_instance, status_name, core_size, now_time)
+    if not new_histories:
+        bump_user_instance_changes(changed_users)
+        return
+    changed = dict((history.instance.id, history.instance)
+                   for history in new_histories)
+    with transaction.atomic():
+        # Required to prevent race conditions (See
+        # InstanceStatusHistory.transaction), skip the instances whose
+        # history changed since it was read.
+        locked = dict(Instance.objects.select_for_update()
+                      .filter(id__in=changed.keys()).order_by('id')
+                      .values_list('id', 'last_history'))
+        for instance_id, core_instance in changed.items():
+            if locked.get(instance_id) != core_instance.last_history_id:
+                logger.info("History of instance %s has changed since it "
+                            "was read, skipping the update" % core_instance)
+                del changed[instance_id]
+        new_histories = [history for history in new_histories
+                         if history.instance_id in changed]
+        if new_histories:
+            InstanceStatusHistory.objects.filter(
+                id__in=[history_id for instance_id, history_id in ended_ids
+                        if instance_id in changed],
+                end_date=None).update(end_date=now_time)
+            InstanceStatusHistory.objects.bulk_create(new_histories)
+            # Signals are not sent by update() and bulk_create()
+            AllocationCheckpoint.invalidate_since(
+                min([now_time] + [history.start_date
+                                  for history in new_histories]),
+                instance_ids=changed.keys())
+            # bulk_create does not set the primary key
+            for instance_id, history in _newest_histories(
+                    changed.keys()).items():
+                changed[instance_id].set_last_history(
+                    history, tasks[instance_id], notify=False)
+    # Signals are not sent by update() and bulk_create()
+    bump_user_instance_changes(
+        changed_users | set(core_instance.created_by_id
+                            for core_instance in changed.values()))
+    from service.monitoring import invalidate_allocation_snapshots
+    invalidate_allocation_snapshots(
+        instance_ids=set(history.instance_id for history in new_histories))
+
+
 def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid):
     # NOTE: Querying for esh_size because esh_instance
     # Only holds the alias, not all the values.
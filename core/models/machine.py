@@ -4,13 +4,15 @@
 from hashlib import md5
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist as DoesNotExist
 from threepio import logger
 
 from core.models.abstract import BaseSource
 from core.models.instance_source import InstanceSource
-from core.models.application import create_application, get_application
+from core.models.application import create_application, get_application,\
+    bump_image_changes
 from core.models.application_version import (
         ApplicationVersion,
         create_app_version,
@@ -475,3 +477,19 @@ def filter_core_machine(provider_machine):
         if provider_machine.application.end_date:
             return not(provider_machine.application.end_date < now)
     return True
+
+
+def machine_source_changed(sender, instance, **kwargs):
+    """
+    The dates of a ProviderMachine are kept on its InstanceSource, which is
+    saved alone when the machine is end-dated. (See bump_image_changes)
+    Deleting the source deletes (and signals) its machine first.
+    """
+    if ProviderMachine.objects.filter(instance_source=instance).exists():
+        bump_image_changes(sender, **kwargs)
+
+post_save.connect(machine_source_changed, sender=InstanceSource)
+post_save.connect(bump_image_changes, sender=ProviderMachine)
+post_delete.connect(bump_image_changes, sender=ProviderMachine)
+post_save.connect(bump_image_changes, sender=ProviderMachineMembership)
+post_delete.connect(bump_image_changes, sender=ProviderMachineMembership)
@@ -1,8 +1,9 @@
 from uuid import uuid4
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.utils import timezone
 from core.models.application import Application
-from core.models.instance import Instance
+from core.models.instance import Instance, bump_instance_relation_changes
 from core.models.group import Group
 from core.models.volume import Volume
 from core.query import only_current_source
@@ -118,3 +119,31 @@ class Project(models.Model):
     class Meta:
         db_table = 'project'
         app_label = 'core'
+
+
+def bump_project_changes(sender, instance, action=None, pk_set=None,
+                         **kwargs):
+    """
+    The projects of a group have changed. (See api.conditional)
+    """
+    if action and not action.startswith('post_'):
+        return
+    from service.cache import bump_change_counters
+    if isinstance(instance, Project):
+        group_names = [instance.owner.name]
+    elif pk_set:
+        # Projects were added to (or removed from) 'instance'
+        group_names = Project.objects.filter(id__in=pk_set)\
+            .values_list('owner__name', flat=True)
+    else:
+        return
+    bump_change_counters(*["group.%s" % name for name in set(group_names)])
+
+post_save.connect(bump_project_changes, sender=Project)
+post_delete.connect(bump_project_changes, sender=Project)
+m2m_changed.connect(bump_project_changes,
+                    sender=Project.applications.through)
+m2m_changed.connect(bump_project_changes, sender=Project.instances.through)
+m2m_changed.connect(bump_project_changes, sender=Project.volumes.through)
+m2m_changed.connect(bump_instance_relation_changes,
+                    sender=Project.instances.through)
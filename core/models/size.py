@@ -1,7 +1,22 @@
-from django.db import models
+import time
+
+from django.db import models, DatabaseError
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from core.models.provider import Provider
 
+# Values of a size, as they are kept in the size catalog
+SIZE_FIELDS = ("id", "alias", "name", "provider_id", "cpu", "disk", "root",
+               "mem", "start_date", "end_date")
+# Seconds a process keeps the catalog of a provider before re-reading it
+# (From redis, where monitor_sizes_for refreshes it). Changes made by any
+# process are seen sooner, through the "sizes.<provider.uuid>" counter,
+# which is read at most every SIZE_VERSION_INTERVAL seconds.
+SIZE_CATALOG_TIMEOUT = 60
+SIZE_VERSION_INTERVAL = 1
+# provider.uuid -> (expires, version, checked, {alias: values})
+size_catalog = {}
+
 
 class Size(models.Model):
 
@@ -9,6 +24,8 @@ class Size(models.Model):
     """
     # Special field that is filled out when converting an esh_size
     esh = None
+    # Special field, the provider.uuid (when known) for size_changed
+    provider_uuid = None
     alias = models.CharField(max_length=256)
     name = models.CharField(max_length=256)
     provider = models.ForeignKey(Provider)
@@ -66,14 +83,71 @@ class Size(models.Model):
             self.end_date)
 
 
+def get_size_catalog(provider_uuid, force=False):
+    """
+    Returns a dict of alias -> size values (SIZE_FIELDS) of the provider.
+    The catalog is kept in memory, shared between processes in redis, and
+    read from the database when it is missing (or force=True).
+    """
+    from service.cache import get_cached_sizes, set_cached_sizes,\
+        get_change_counters
+    now = time.time()
+    expires, version, checked, catalog = size_catalog.get(
+        provider_uuid, (0, None, 0, None))
+    if not force and expires > now and now - checked < SIZE_VERSION_INTERVAL:
+        return catalog
+    counters = get_change_counters("sizes.%s" % provider_uuid)
+    current_version = counters[0] if counters else None
+    if not force and expires > now and version == current_version:
+        size_catalog[provider_uuid] = (expires, version, now, catalog)
+        return catalog
+    rows = None if force else get_cached_sizes(provider_uuid)
+    if rows is None:
+        # The most recent size of an alias wins
+        rows = list(Size.objects.filter(provider__uuid=provider_uuid)
+                    .order_by('id').values_list(*SIZE_FIELDS))
+        set_cached_sizes(provider_uuid, rows)
+    catalog = dict((values[1], values) for values in rows)
+    size_catalog[provider_uuid] = (now + SIZE_CATALOG_TIMEOUT,
+                                   current_version, now, catalog)
+    return catalog
+
+
+def invalidate_size_catalog(provider_uuid):
+    """
+    Every process re-reads the catalog of the provider on next use.
+    """
+    from service.cache import invalidate_cached_sizes, bump_change_counters
+    size_catalog.pop(provider_uuid, None)
+    invalidate_cached_sizes(provider_uuid)
+    bump_change_counters("sizes.%s" % provider_uuid)
+
+
+def _size_from_values(values):
+    size = Size(**dict(zip(SIZE_FIELDS, values)))
+    size._state.adding = False
+    return size
+
+
 def convert_esh_size(esh_size, provider_uuid):
     """
     """
     alias = esh_size.id
-    try:
-        core_size = Size.objects.get(alias=alias, provider__uuid=provider_uuid)
-        core_size = _update_from_cloud_size(core_size, esh_size)
-    except Size.DoesNotExist:
+    values = get_size_catalog(provider_uuid).get(alias)
+    core_size = _size_from_values(values) if values else None
+    if core_size:
+        core_size.provider_uuid = provider_uuid
+        if not _update_from_cloud_size(core_size, esh_size):
+            # Deleted since the catalog was read
+            core_size = None
+    if not core_size:
+        # Created (or deleted) since the catalog was read?
+        core_size = Size.objects.filter(
+            alias=alias, provider__uuid=provider_uuid).order_by('id').last()
+        if core_size:
+            core_size.provider_uuid = provider_uuid
+            _update_from_cloud_size(core_size, esh_size)
+    if not core_size:
         # Gather up the additional, necessary information to create a DB repr
         try:
             provider = Provider.objects.get(uuid=provider_uuid)
@@ -89,18 +163,33 @@ def convert_esh_size(esh_size, provider_uuid):
 def _update_from_cloud_size(core_size, esh_size):
     """
     Full scope replacement based on cloud(rtwo) size
+    The size is only saved when a value has changed.
+    Returns False when the size no longer exists.
     """
-    core_size.name = esh_size.name
-    core_size.disk = esh_size.disk
-    core_size.root = esh_size.ephemeral
-    core_size.cpu = esh_size.cpu
-    core_size.mem = esh_size.ram
-    core_size.save()
-    return core_size
+    cloud_values = {
+        "name": esh_size.name,
+        "disk": esh_size.disk,
+        "root": esh_size.ephemeral,
+        "cpu": esh_size.cpu,
+        "mem": esh_size.ram,
+    }
+    changed = [field for field, value in cloud_values.items()
+               if getattr(core_size, field) != value]
+    if not changed:
+        return True
+    for field in changed:
+        setattr(core_size, field, cloud_values[field])
+    try:
+        # Sends post_save, the catalog is invalidated (See size_changed)
+        core_size.save(update_fields=changed)
+    except DatabaseError:
+        # "Save with update_fields did not affect any rows."
+        return False
+    return True
 
 
 def _create_from_cloud_size(esh_size, provider):
-    core_size = Size.objects.create(
+    core_size = Size(
         alias=esh_size.id,
         provider=provider,
         name=esh_size.name,
@@ -109,6 +198,8 @@ def _create_from_cloud_size(esh_size, provider):
         cpu=esh_size.cpu,
         mem=esh_size.ram,
     )
+    core_size.provider_uuid = provider.uuid
+    core_size.save()
     return core_size
 
 
@@ -123,3 +214,18 @@ def create_size(name, alias, cpu, mem, disk, root, provider_uuid):
         root=root,
         provider=provider)
     return size
+
+
+def size_changed(sender, instance, **kwargs):
+    """
+    A size was saved (or deleted) by monitoring, an admin or another
+    process, every catalog of the provider is re-read.
+    """
+    provider_uuid = instance.provider_uuid or\
+        Provider.objects.filter(id=instance.provider_id)\
+        .values_list('uuid', flat=True).first()
+    if provider_uuid:
+        invalidate_size_catalog(provider_uuid)
+
+post_save.connect(size_changed, sender=Size)
+post_delete.connect(size_changed, sender=Size)
@@ -2,6 +2,7 @@ from datetime import datetime
 
 from django.db import models, transaction, DatabaseError
 from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 
 import pytz
@@ -277,3 +278,14 @@ class VolumeStatusHistory(models.Model):
     class Meta:
         db_table = "volume_status_history"
         app_label = "core"
+
+
+def bump_volume_changes(sender, instance, **kwargs):
+    """
+    The volumes of the user have changed. (See api.conditional)
+    """
+    from service.cache import bump_change_counters
+    bump_change_counters("user.%s" % instance.instance_source.created_by_id)
+
+post_save.connect(bump_volume_changes, sender=Volume)
+post_delete.connect(bump_volume_changes, sender=Volume)
@@ -0,0 +1,163 @@
+"""
+test the status history of instances
+"""
+from datetime import timedelta
+
+import mock
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests import FakeRedis
+from api.tests.factories import UserFactory, ProviderFactory,\
+    InstanceSourceFactory, InstanceFactory, SizeFactory, IdentityFactory
+from core.models import AllocationCheckpoint, Instance,\
+    InstanceStatusHistory
+from core.models.instance import _update_histories, check_last_histories
+
+
+class InstanceHistoryTestCase(TestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        self.provider = ProviderFactory.create()
+        self.size = SizeFactory.create(provider=self.provider)
+        user = UserFactory.create()
+        self.identity = IdentityFactory.create(
+            created_by=user, provider=self.provider)
+        self.instance = InstanceFactory.create(
+            created_by=user, created_by_identity=self.identity,
+            source=InstanceSourceFactory.create(provider=self.provider))
+        self.first_history = InstanceStatusHistory.create_history(
+            'active', self.instance, self.size, self.instance.start_date)
+        self.first_history.save()
+        self.instance.set_last_history(self.first_history)
+
+    def reload(self, instance):
+        return Instance.objects.get(id=instance.id)
+
+    def open_histories(self):
+        return list(InstanceStatusHistory.objects.filter(
+            instance=self.instance, end_date=None))
+
+    def update_histories(self, core_instances, status_name):
+        for core_instance in core_instances:
+            core_instance.esh = mock.Mock(extra={'status': status_name})
+        with mock.patch('core.models.instance._esh_instance_size_to_core',
+                        return_value=self.size),\
+                mock.patch('core.models.instance.'
+                           '_get_status_name_for_provider',
+                           return_value=status_name):
+            _update_histories(None, core_instances, self.provider)
+
+
+class LastHistoryTests(InstanceHistoryTestCase):
+
+    def assertLastHistory(self, history):
+        instance = self.reload(self.instance)
+        self.assertEquals(
+            (instance.last_history_id, instance.last_status_id,
+             instance.last_size_id),
+            (history.id, history.status_id, history.size_id)
+            if history else (None, None, None))
+
+    def test_set_last_history_stores_status_and_size(self):
+        self.assertLastHistory(self.first_history)
+        self.assertEquals(check_last_histories([self.reload(self.instance)]),
+                          [])
+
+    def test_transaction_from_a_stale_history_is_rejected(self):
+        new_history = InstanceStatusHistory.transaction(
+            'shutoff', self.reload(self.instance), self.size,
+            timezone.now(), self.first_history)
+        self.assertLastHistory(new_history)
+        self.assertRaises(
+            ValueError, InstanceStatusHistory.transaction, 'suspended',
+            self.reload(self.instance), self.size, timezone.now(),
+            self.first_history)
+        self.assertLastHistory(new_history)
+
+    def test_histories_starting_together_are_ordered_by_id(self):
+        history = InstanceStatusHistory.create_history(
+            'shutoff', self.instance, self.size,
+            self.first_history.start_date)
+        history.save()
+        self.assertEquals(
+            check_last_histories([self.reload(self.instance)]),
+            [(self.reload(self.instance), history)])
+
+    def test_deleted_last_history_is_replaced(self):
+        new_history = InstanceStatusHistory.transaction(
+            'shutoff', self.reload(self.instance), self.size,
+            timezone.now(), self.first_history)
+        new_history.delete()
+        self.assertLastHistory(self.first_history)
+
+    def test_deleted_only_history_clears_status_and_size(self):
+        self.first_history.delete()
+        self.assertLastHistory(None)
+
+
+class UpdateHistoriesTests(InstanceHistoryTestCase):
+
+    def test_changed_status_ends_the_last_history(self):
+        self.update_histories([self.reload(self.instance)], 'suspended')
+        histories = self.open_histories()
+        self.assertEquals([history.status_name for history in histories],
+                          ['suspended'])
+        self.assertEquals(self.reload(self.instance).last_history_id,
+                          histories[0].id)
+
+    def test_same_status_keeps_the_last_history(self):
+        self.update_histories([self.reload(self.instance)], 'active')
+        self.assertEquals(self.open_histories(), [self.first_history])
+
+    def test_history_moved_since_read_is_skipped(self):
+        stale_instance = self.reload(self.instance)
+        moved_history = InstanceStatusHistory.transaction(
+            'shutoff', self.reload(self.instance), self.size,
+            timezone.now(), self.first_history)
+        self.update_histories([stale_instance], 'suspended')
+        self.assertEquals(self.open_histories(), [moved_history])
+        self.assertEquals(self.reload(self.instance).last_history_id,
+                          moved_history.id)
+
+
+class CheckpointInvalidationTests(InstanceHistoryTestCase):
+
+    def create_checkpoint(self, as_of):
+        return AllocationCheckpoint.objects.create(
+            identity=self.identity, signature="signature",
+            start_date=self.instance.start_date, as_of=as_of,
+            runtime=timedelta(0), burn_rate=timedelta(0),
+            last_history_id=self.first_history.id)
+
+    def assertCheckpointCount(self, count):
+        self.assertEquals(AllocationCheckpoint.objects.filter(
+            identity=self.identity).count(), count)
+
+    def test_history_ended_after_checkpoint_keeps_it(self):
+        self.create_checkpoint(timezone.now())
+        self.first_history.end_date = timezone.now()
+        self.first_history.save()
+        self.assertCheckpointCount(1)
+
+    def test_history_ended_before_checkpoint_drops_it(self):
+        as_of = timezone.now()
+        self.create_checkpoint(as_of)
+        history = InstanceStatusHistory.objects.get(id=self.first_history.id)
+        history.end_date = as_of - timedelta(minutes=1)
+        history.save()
+        self.assertCheckpointCount(0)
+
+    def test_deleted_history_drops_it(self):
+        self.create_checkpoint(timezone.now())
+        InstanceStatusHistory.objects.filter(
+            id=self.first_history.id).delete()
+        self.assertCheckpointCount(0)
+
+    def test_bulk_update_drops_it(self):
+        self.create_checkpoint(timezone.now() + timedelta(hours=1))
+        self.update_histories([self.reload(self.instance)], 'suspended')
+        self.assertCheckpointCount(0)
@@ -0,0 +1,80 @@
+"""
+test the size catalog of providers
+"""
+import time
+
+import mock
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.tests import FakeRedis
+from api.tests.factories import ProviderFactory, SizeFactory
+from core.models import Size
+from core.models.size import convert_esh_size, get_size_catalog,\
+    SIZE_FIELDS, SIZE_VERSION_INTERVAL
+from service.cache import bump_change_counters, invalidate_cached_sizes
+
+
+class SizeCatalogTests(TestCase):
+
+    def setUp(self):
+        patchers = [
+            mock.patch('service.cache.connection', FakeRedis()),
+            mock.patch.dict('core.models.size.size_catalog', clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        provider = ProviderFactory.create()
+        self.provider_uuid = str(provider.uuid)
+        self.size = SizeFactory.create(provider=provider, alias="m1.small")
+        # Load the catalog
+        get_size_catalog(self.provider_uuid)
+
+    def esh_size(self, cpu=None):
+        esh_size = mock.Mock(id=self.size.alias, disk=self.size.disk,
+                             ephemeral=self.size.root, ram=self.size.mem,
+                             cpu=cpu or self.size.cpu)
+        esh_size.name = self.size.name
+        return esh_size
+
+    def catalog_cpu(self):
+        return get_size_catalog(self.provider_uuid)[self.size.alias][
+            SIZE_FIELDS.index("cpu")]
+
+    def later(self):
+        return mock.patch('core.models.size.time.time',
+                          return_value=time.time() + SIZE_VERSION_INTERVAL)
+
+    def test_unchanged_size_is_not_queried(self):
+        with CaptureQueriesContext(connection) as queries:
+            core_size = convert_esh_size(self.esh_size(), self.provider_uuid)
+        self.assertEquals(core_size.id, self.size.id)
+        self.assertEquals(len(queries), 0)
+
+    def test_version_is_read_once_per_interval(self):
+        with mock.patch('service.cache.get_change_counters',
+                        return_value=[None]) as get_change_counters:
+            convert_esh_size(self.esh_size(), self.provider_uuid)
+            convert_esh_size(self.esh_size(), self.provider_uuid)
+            self.assertFalse(get_change_counters.called)
+            with self.later():
+                convert_esh_size(self.esh_size(), self.provider_uuid)
+            self.assertEquals(get_change_counters.call_count, 1)
+
+    def test_changed_size_is_saved_without_provider_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            convert_esh_size(self.esh_size(cpu=4), self.provider_uuid)
+        self.assertEquals(len(queries), 1)
+        self.assertNotIn('"provider"', queries[0]['sql'])
+        self.assertEquals(Size.objects.get(id=self.size.id).cpu, 4)
+        self.assertEquals(self.catalog_cpu(), 4)
+
+    def test_changes_of_other_processes_are_seen(self):
+        Size.objects.filter(id=self.size.id).update(cpu=8)
+        invalidate_cached_sizes(self.provider_uuid)
+        bump_change_counters("sizes.%s" % self.provider_uuid)
+        self.assertEquals(self.catalog_cpu(), self.size.cpu)
+        with self.later():
+            self.assertEquals(self.catalog_cpu(), 8)
@@ -3,7 +3,8 @@ import argparse
 import time
 
 from service.driver import get_esh_driver
-from core.models import Provider, Identity, Instance, InstanceStatusHistory
+from core.models import Provider, Identity, Instance, InstanceStatusHistory,\
+    AllocationCheckpoint
 from service.driver import get_admin_driver
 from service.instance import suspend_instance
 
@@ -63,6 +64,8 @@ def _prune_history(bad_history_list):
     for history in bad_history_list:
         history.end_date = history.start_date
         history.save()
+        # Time counted in the past has changed
+        AllocationCheckpoint.invalidate(history.instance.created_by_identity)
 
 
 def get_user_instance_history(provider):
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Report the current allocation usage of every user on a provider.
+
+Identities are split into chunks and calculated by a pool of processes.
+Rows (credit, runtime, difference, burn rate, ...) are written to the
+output as each chunk finishes, so a partial run can be continued
+with --resume.
+
+Ex: ./allocation_report.py --provider-id 4 --output march.csv --processes 8
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+
+import django
+django.setup()
+
+from django.db import connection
+from threepio import logger
+
+from core.models import Provider, Identity
+from service.monitoring import allocation_snapshot, _get_allocation_result,\
+    _get_allocation_results
+
+FIELDS = ["identity_id", "username", "provider", "credit_hours",
+          "runtime_hours", "difference_hours", "over_allocation",
+          "burn_rate", "time_to_zero", "error"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--provider-list", action="store_true",
+                        help="List of provider names and IDs")
+    parser.add_argument("--provider-id", type=int,
+                        help="Atmosphere provider ID"
+                        " to report allocation usage for.")
+    parser.add_argument("--users",
+                        help="Only report these usernames. (comma separated)")
+    parser.add_argument("--output", required=False,
+                        help="Output file (.csv or .json). Default: stdout")
+    parser.add_argument("--format", choices=["csv", "json"],
+                        help="Default: Based on the --output extension")
+    parser.add_argument("--processes", type=int, default=cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=50,
+                        help="Identities calculated at once by each process")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip identities already in --output"
+                        " (Rows with an error are calculated again)")
+    args = parser.parse_args()
+    return run_command(args)
+
+
+def provider_list():
+    print "ID\tName"
+    for p in Provider.objects.all().order_by('id'):
+        print "%d\t%s" % (p.id, p.location)
+    return None
+
+
+def run_command(args):
+    if args.provider_list:
+        return provider_list()
+    if not args.provider_id:
+        print "ERROR: provider-id is required. To get a list of providers use"\
+            " --provider-list"
+        return -1
+    output_format = args.format
+    if not output_format:
+        output_format = "json" if args.output and\
+            args.output.endswith(".json") else "csv"
+    identities = Identity.objects.filter(provider__id=args.provider_id)
+    if args.users:
+        identities = identities.filter(
+            created_by__username__in=args.users.split(","))
+    identity_ids = list(identities.order_by('id')
+                        .values_list('id', flat=True))
+    if args.resume:
+        if not args.output:
+            print "ERROR: --resume requires --output"
+            return -1
+        finished = _finished_identities(args.output, output_format)
+        identity_ids = [identity_id for identity_id in identity_ids
+                        if identity_id not in finished]
+        print >> sys.stderr, "Resuming: %s identities already reported" %\
+            len(finished)
+    chunks = [identity_ids[idx:idx + args.chunk_size]
+              for idx in xrange(0, len(identity_ids), args.chunk_size)]
+    print >> sys.stderr, "Reporting %s identities in %s chunks" %\
+        (len(identity_ids), len(chunks))
+    writer = _open_writer(args.output, output_format, append=args.resume)
+    # Every process opens its own database connection.
+    connection.close()
+    pool = Pool(args.processes)
+    try:
+        reported = 0
+        for rows in pool.imap_unordered(_report_chunk, chunks):
+            for row in rows:
+                writer(row)
+            reported += len(rows)
+            print >> sys.stderr, "Reported %s/%s" %\
+                (reported, len(identity_ids))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _report_chunk(identity_ids):
+    """
+    Calculate the allocation of every identity (In a worker process).
+    Returns a list of report rows.
+    """
+    identities = list(Identity.objects.filter(id__in=identity_ids)
+                      .select_related('created_by', 'provider'))
+    try:
+        # Reports do not checkpoint, cache or enforce anything
+        allocation_results = _get_allocation_results(
+            identities, persist=False)
+    except Exception:
+        logger.exception("Unable to calculate allocations for %s. "
+                         "Calculating one identity at a time."
+                         % identity_ids)
+        allocation_results = {}
+        for identity in identities:
+            try:
+                allocation_results[identity] =\
+                    _get_allocation_result(identity, persist=False)
+            except Exception as exc:
+                allocation_results[identity] = exc
+    return [_report_row(identity, allocation_results[identity])
+            for identity in identities]
+
+
+def _report_row(identity, allocation_result):
+    row = {
+        "identity_id": identity.id,
+        "username": identity.created_by.username,
+        "provider": identity.provider.location,
+    }
+    if isinstance(allocation_result, Exception):
+        row["error"] = str(allocation_result)
+        return row
+    snapshot = allocation_snapshot(allocation_result)
+    row.update({
+        "credit_hours": _hours(snapshot["credit"]),
+        "runtime_hours": _hours(snapshot["runtime"]),
+        "difference_hours": _hours(snapshot["difference"]),
+        "over_allocation": snapshot["over_allocation"],
+        # Seconds of allocation used per second
+        "burn_rate": snapshot["burn_rate"].total_seconds(),
+        "time_to_zero": snapshot["time_to_zero"].isoformat(),
+        "error": None,
+    })
+    return row
+
+
+def _hours(delta):
+    return round(delta.total_seconds() / 3600.0, 2)
+
+
+def _open_writer(output, output_format, append=False):
+    """
+    Returns a method that writes (and flushes) one row.
+    JSON is written as one object per line.
+    """
+    if not output:
+        output_file = sys.stdout
+        write_header = True
+    else:
+        write_header = not (append and os.path.exists(output))
+        output_file = open(output, "a" if append else "w")
+    if output_format == "json":
+        def write_row(row):
+            output_file.write(json.dumps(row, sort_keys=True) + "\n")
+            output_file.flush()
+        return write_row
+    csv_writer = csv.DictWriter(output_file, FIELDS)
+    if write_header:
+        csv_writer.writeheader()
+
+    def write_row(row):
+        csv_writer.writerow(row)
+        output_file.flush()
+    return write_row
+
+
+def _finished_identities(output, output_format):
+    """
+    Every identity that has been reported without an error
+    """
+    if not os.path.exists(output):
+        return set()
+    with open(output) as output_file:
+        if output_format == "json":
+            rows = [_json_row(line) for line in output_file]
+        else:
+            rows = list(csv.DictReader(output_file))
+    return set(int(row["identity_id"]) for row in rows
+               if row and row.get("identity_id") and not row.get("error"))
+
+
+def _json_row(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        # The last line of an interrupted run
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""
+Benchmark the allocation engine against a synthetic workload.
+
+In-memory (Default):
+  Generate users, instances and status histories (with realistic status
+  churn) and time PythonAllocationStrategy.apply, calculate_allocation and
+  the batch engine.
+
+Database (--provider-id):
+  Seed the same workload into the local database on a provider, then time
+  apply_strategy, user_over_allocation_enforcement and
+  _get_allocation_results end-to-end. Seeded users are named
+  '<prefix><number>' and can be removed with --clean.
+
+Results (throughput and peak memory) are written as JSON with --output,
+and can be compared between commits with --compare.
+
+Ex: 5k users, 50k instances and 2M histories:
+  ./benchmark_allocation.py --users 5000 --instances-per-user 10\
+      --histories-per-instance 40 --output before.json
+"""
+import argparse
+import gc
+import json
+import random
+import resource
+import subprocess
+import time
+from uuid import uuid4
+
+from dateutil.relativedelta import relativedelta
+
+import django
+django.setup()
+
+from django.utils import timezone
+
+from allocation import batch
+from allocation.engine import calculate_allocation
+from allocation.models import Instance, InstanceHistory, Machine,\
+    Provider as AllocProvider, Size, PythonAllocationStrategy,\
+    FixedWindow, OneTimeRefresh, IgnoreNonActiveStatus, MultiplySizeCPURule
+from core.models import Allocation, AllocationCheckpoint, AtmosphereUser,\
+    Credential, Group, Identity, IdentityMembership,\
+    Instance as CoreInstance, InstanceSource, InstanceStatus,\
+    InstanceStatusHistory, Provider, Quota, Size as CoreSize
+from service.monitoring import apply_strategy, get_allocation,\
+    user_over_allocation_enforcement, _get_allocation_results
+
+BOOT_STATUSES = ["build", "networking", "deploying"]
+# (status, weight) of every history after the instance has booted
+CHURN_STATUSES = [("active", 60), ("suspended", 15), ("shutoff", 10),
+                  ("resize", 5), ("reboot", 5), ("error", 5)]
+# name, cpu, ram (MB), disk (GB)
+SIZES = [("bench.tiny", 1, 2048, 20), ("bench.small", 2, 4096, 40),
+         ("bench.medium", 4, 8192, 80), ("bench.large", 8, 16384, 160)]
+BATCH_SIZE = 5000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100,
+                        help="Number of synthetic users")
+    parser.add_argument("--instances-per-user", type=int, default=10)
+    parser.add_argument("--histories-per-instance", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed (The workload is reproducible)")
+    parser.add_argument("--provider-id", type=int,
+                        help="Atmosphere provider ID. Seed the workload into"
+                        " the database and benchmark end-to-end")
+    parser.add_argument("--prefix", default="bench-",
+                        help="Username prefix of seeded users")
+    parser.add_argument("--clean", action="store_true",
+                        help="Remove the seeded users and exit")
+    parser.add_argument("--output",
+                        help="Write the results (JSON) to this file")
+    parser.add_argument("--compare",
+                        help="Compare the results to a previous --output")
+    args = parser.parse_args()
+    return run_command(args)
+
+
+def run_command(args):
+    if args.clean:
+        return clean(args.prefix)
+    window_end = timezone.now()
+    window_start = window_end - relativedelta(months=1)
+    rng = random.Random(args.seed)
+    workload = generate_workload(
+        rng, args.users, args.instances_per_user,
+        args.histories_per_instance, window_start, window_end)
+    results = {}
+    benchmark_engine(workload, window_start, window_end, results)
+    if args.provider_id:
+        provider = Provider.objects.get(id=args.provider_id)
+        identities = seed_database(provider, workload, args.prefix)
+        benchmark_database(provider, identities, results)
+    report = {
+        "commit": _current_commit(),
+        "date": timezone.now().isoformat(),
+        "workload": {
+            "users": args.users,
+            "instances": args.users * args.instances_per_user,
+            "histories": args.users * args.instances_per_user
+            * args.histories_per_instance,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print "Results written to %s" % args.output
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), report)
+
+
+# Workload
+def generate_workload(rng, users, instances_per_user, histories_per_instance,
+                      window_start, window_end):
+    """
+    Returns a list of users, each a list of instances:
+    (size_index, [(status, start_date, end_date), ...])
+    The last history of a running instance has no end_date.
+    """
+    workload = []
+    for _ in xrange(users):
+        workload.append([
+            _synthetic_instance(rng, histories_per_instance,
+                                window_start, window_end)
+            for _ in xrange(instances_per_user)])
+    return workload
+
+
+def _synthetic_instance(rng, history_count, window_start, window_end):
+    # Launched up to a month before the window, so some history
+    # has to be clipped at the start of the window.
+    window_seconds = (window_end - window_start).total_seconds()
+    launch = window_start + timezone.timedelta(
+        seconds=rng.uniform(-window_seconds, window_seconds * 0.9))
+    mean_duration = (window_end - launch).total_seconds() / history_count
+    size_index = rng.randrange(len(SIZES))
+    histories = []
+    start = launch
+    for idx in xrange(history_count):
+        if idx < len(BOOT_STATUSES):
+            status = BOOT_STATUSES[idx]
+            duration = rng.uniform(30, 600)
+        else:
+            status = _weighted_choice(rng, CHURN_STATUSES)
+            duration = rng.expovariate(1.0 / mean_duration)
+        end = start + timezone.timedelta(seconds=duration)
+        histories.append((status, start, end))
+        start = end
+    # Most instances are still running
+    if rng.random() < 0.8:
+        status, start, _ = histories[-1]
+        histories[-1] = (status, start, None)
+    return (size_index, histories)
+
+
+def _weighted_choice(rng, choices):
+    value = rng.uniform(0, sum(weight for _, weight in choices))
+    for choice, weight in choices:
+        value -= weight
+        if value <= 0:
+            return choice
+    return choices[-1][0]
+
+
+# Benchmarks
+def _measure(name, method, count, results):
+    gc.collect()
+    start = time.time()
+    method()
+    seconds = time.time() - start
+    results[name] = {
+        "count": count,
+        "seconds": seconds,
+        "per_second": count / seconds if seconds else None,
+        # Peak resident memory of the process so far (KB on Linux)
+        "peak_rss_kb":
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print "%-45s %8d in %8.2fs (%10.1f/s) Peak RSS: %dKB" % (
+        name, count, seconds, results[name]["per_second"] or 0,
+        results[name]["peak_rss_kb"])
+
+
+def benchmark_engine(workload, window_start, window_end, results):
+    provider = AllocProvider("Benchmark", "benchmark")
+    machine = Machine("Benchmark", "benchmark")
+    sizes = [Size(name, name, cpu=cpu, ram=ram, disk=disk)
+             for name, cpu, ram, disk in SIZES]
+    user_instances = [
+        [Instance(identifier=str(uuid4()), provider=provider, machine=machine,
+                  history=[InstanceHistory(status, sizes[size_index],
+                                           start_date, end_date)
+                           for status, start_date, end_date in histories])
+         for size_index, histories in instances]
+        for instances in workload]
+    strategy = PythonAllocationStrategy(
+        FixedWindow(window_start, window_end),
+        [OneTimeRefresh(window_start)],
+        [IgnoreNonActiveStatus(), MultiplySizeCPURule()])
+    # Not saved. Only the threshold is used.
+    core_allocation = Allocation(threshold=7 * 24 * 60)
+    allocations = []
+
+    def apply_all():
+        for instances in user_instances:
+            allocations.append(
+                strategy.apply(None, core_allocation, instances))
+
+    def calculate_all():
+        for allocation in allocations:
+            calculate_allocation(allocation)
+
+    _measure("PythonAllocationStrategy.apply", apply_all,
+             len(user_instances), results)
+    _measure("calculate_allocation", calculate_all,
+             len(allocations), results)
+    _measure("batch.calculate_allocations",
+             lambda: batch.calculate_allocations(allocations),
+             len(allocations), results)
+
+
+def benchmark_database(provider, identities, results):
+    usernames = [identity.created_by.username for identity in identities]
+
+    def apply_all():
+        for identity in identities:
+            apply_strategy(identity, get_allocation(
+                identity.created_by.username, identity.uuid))
+
+    def enforce_all():
+        for username in usernames:
+            user_over_allocation_enforcement(provider, username)
+
+    # Time the full calculation, not the allocation ledger.
+    _clear_checkpoints(identities)
+    _measure("db.apply_strategy", apply_all, len(identities), results)
+    _clear_checkpoints(identities)
+    _measure("db.user_over_allocation_enforcement", enforce_all,
+             len(usernames), results)
+    _clear_checkpoints(identities)
+    _measure("db._get_allocation_results",
+             lambda: _get_allocation_results(identities),
+             len(identities), results)
+    _measure("db._get_allocation_results (checkpoints)",
+             lambda: _get_allocation_results(identities),
+             len(identities), results)
+
+
+def _clear_checkpoints(identities):
+    AllocationCheckpoint.objects.filter(identity__in=identities).delete()
+
+
+# Database
+def seed_database(provider, workload, prefix):
+    """
+    Create a user, identity and membership for every user in the workload,
+    then bulk-create the instances and histories.
+    Returns the list of identities.
+    """
+    source = InstanceSource.objects.filter(provider=provider).first()
+    if not source:
+        raise Exception("Provider %s needs at least one InstanceSource "
+                        "(Machine) to launch synthetic instances from."
+                        % provider)
+    sizes = [CoreSize.objects.get_or_create(
+        provider=provider, alias=name,
+        defaults={'name': name, 'cpu': cpu, 'mem': ram, 'disk': disk,
+                  'root': 0})[0]
+        for name, cpu, ram, disk in SIZES]
+    statuses = dict(
+        (name, InstanceStatus.objects.get_or_create(name=name)[0])
+        for name in BOOT_STATUSES + [name for name, _ in CHURN_STATUSES])
+    allocation = Allocation.default_allocation()
+    quota = Quota.default_quota()
+    identities, credentials, memberships = [], [], []
+    start = time.time()
+    for number in xrange(len(workload)):
+        username = "%s%05d" % (prefix, number)
+        user = AtmosphereUser.objects.get_or_create(username=username)[0]
+        group = Group.objects.get_or_create(name=username)[0]
+        identity = Identity.objects.create(created_by=user,
+                                           provider=provider)
+        identities.append(identity)
+        credentials.append(Credential(key='ex_project_name', value=username,
+                                      identity=identity))
+        memberships.append(IdentityMembership(
+            identity=identity, member=group, allocation=allocation,
+            quota=quota))
+    Credential.objects.bulk_create(credentials, batch_size=BATCH_SIZE)
+    IdentityMembership.objects.bulk_create(memberships,
+                                           batch_size=BATCH_SIZE)
+    core_instances, histories = [], []
+    for identity, instances in zip(identities, workload):
+        for size_index, history_list in instances:
+            alias = str(uuid4())
+            core_instances.append(CoreInstance(
+                name="Benchmark %s" % alias, provider_alias=alias,
+                source=source, created_by=identity.created_by,
+                created_by_identity=identity,
+                start_date=history_list[0][1],
+                end_date=history_list[-1][2]))
+            histories.append((alias, sizes[size_index], history_list))
+    CoreInstance.objects.bulk_create(core_instances, batch_size=BATCH_SIZE)
+    instance_ids = dict(CoreInstance.objects.filter(
+        created_by_identity__in=identities
+    ).values_list('provider_alias', 'id'))
+    history_rows = [
+        InstanceStatusHistory(
+            instance_id=instance_ids[instance_alias], size=size,
+            status=statuses[status], start_date=start_date,
+            end_date=end_date)
+        for instance_alias, size, history_list in histories
+        for status, start_date, end_date in history_list]
+    InstanceStatusHistory.objects.bulk_create(history_rows,
+                                              batch_size=BATCH_SIZE)
+    print "Seeded %s users, %s instances and %s histories in %.2fs" % (
+        len(identities), len(core_instances), len(history_rows),
+        time.time() - start)
+    return identities
+
+
+def clean(prefix):
+    users = AtmosphereUser.objects.filter(username__startswith=prefix)
+    print "Removing %s seeded users" % users.count()
+    InstanceStatusHistory.objects.filter(
+        instance__created_by__in=users).delete()
+    CoreInstance.objects.filter(created_by__in=users).delete()
+    Identity.objects.filter(created_by__in=users).delete()
+    Group.objects.filter(name__startswith=prefix).delete()
+    users.delete()
+
+
+# Reports
+def _current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    print "Compared to %s (%s)" % (previous.get("commit"),
+                                   previous.get("date"))
+    if previous.get("workload") != current["workload"]:
+        print "WARNING: The workloads are not the same!"
+    for name, result in sorted(current["results"].items()):
+        before = previous["results"].get(name)
+        if not before or not before["per_second"]:
+            print "%-45s (New)" % name
+            continue
+        change = (result["per_second"] / before["per_second"] - 1) * 100
+        print "%-45s %10.1f/s -> %10.1f/s (%+.1f%%)" % (
+            name, before["per_second"], result["per_second"], change)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Compare the compact cache format (service.cache_format) to the
+scrubbed pickles previously stored in redis.
+
+Instances, volumes and machines are listed once with the admin driver of
+the provider, then the payload size and the time to dump and load each
+format are reported.
+
+Ex: ./benchmark_cache_format.py --provider-id 4 --repeat 20
+"""
+import argparse
+import cPickle as pickle
+import time
+
+import django
+django.setup()
+
+from core.models import Provider
+from service import cache_format
+from service.driver import get_admin_driver
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--provider-list", action="store_true",
+                        help="List of provider names and IDs")
+    parser.add_argument("--provider-id", type=int,
+                        help="Atmosphere provider ID to list objects from.")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of times each format is dumped/loaded")
+    args = parser.parse_args()
+    if args.provider_list:
+        print "ID\tName"
+        for p in Provider.objects.all().order_by('id'):
+            print "%d\t%s" % (p.id, p.location)
+        return
+    if not args.provider_id:
+        print "ERROR: provider-id is required. To get a list of providers use"\
+            " --provider-list"
+        return -1
+    driver = get_admin_driver(Provider.objects.get(id=args.provider_id))
+    print "%-10s %-8s %7s %12s %12s %12s" %\
+        ("Objects", "Format", "Count", "Bytes", "Dump (ms)", "Load (ms)")
+    for name, list_method, snapshot_method, restore_method in [
+            ("instances", driver.list_all_instances,
+             cache_format.snapshot_instance, cache_format.restore_instance),
+            ("volumes", driver.list_all_volumes,
+             cache_format.snapshot_volume, cache_format.restore_volume),
+            ("machines", driver.list_machines,
+             cache_format.snapshot_machine, cache_format.restore_machine)]:
+        objects = list_method()
+        # The compact format is measured first, _scrub modifies 'objects'
+        compact = _measure(
+            lambda: cache_format.dumps(snapshot_method, objects),
+            lambda data: cache_format.loads(restore_method, data),
+            args.repeat)
+        legacy = _measure(
+            lambda: _legacy_dumps(objects), pickle.loads, args.repeat)
+        for format_name, (size, dump_time, load_time) in [
+                ("pickle", legacy), ("compact", compact)]:
+            print "%-10s %-8s %7d %12d %12.2f %12.2f" %\
+                (name, format_name, len(objects), size,
+                 dump_time * 1000, load_time * 1000)
+
+
+def _measure(dump_method, load_method, repeat):
+    """
+    Returns (payload size, average dump time, average load time)
+    """
+    start = time.time()
+    for _ in xrange(repeat):
+        data = dump_method()
+    dump_time = (time.time() - start) / repeat
+    start = time.time()
+    for _ in xrange(repeat):
+        load_method(data)
+    load_time = (time.time() - start) / repeat
+    return len(data), dump_time, load_time
+
+
+def _legacy_dumps(objects):
+    """
+    The format stored by service.cache._get_cached before cache_format.
+    """
+    _scrub(objects)
+    return pickle.dumps(objects)
+
+
+def _scrub(objects):
+    for o in objects:
+        o._connection = None
+        for a in ["_node", "_volume", "_image"]:
+            if hasattr(o, a):
+                o.__dict__[a] = None
+        if hasattr(o, "size") and hasattr(o.size, "_size"):
+            if o.size._size:
+                o.size._size = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Check that the status, size and history stored on each instance
+(Instance.last_history) match its newest InstanceStatusHistory.
+
+Ex: ./check_instance_last_history.py --provider-id 4 --fix
+"""
+import argparse
+
+import django
+django.setup()
+
+from core.models import Provider, Instance
+from core.models.instance import check_last_histories
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--provider-list", action="store_true",
+                        help="List of provider names and IDs")
+    parser.add_argument("--provider-id", type=int,
+                        help="Only check instances of this provider."
+                        " Default: All providers")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Instances checked at once")
+    parser.add_argument("--fix", action="store_true",
+                        help="Update the instances that do not match")
+    args = parser.parse_args()
+    if args.provider_list:
+        print "ID\tName"
+        for p in Provider.objects.all().order_by('id'):
+            print "%d\t%s" % (p.id, p.location)
+        return
+    instances = Instance.objects.all()
+    if args.provider_id:
+        instances = instances.filter(source__provider__id=args.provider_id)
+    instance_ids = list(instances.order_by('id').values_list('id', flat=True))
+    mismatched_count = 0
+    for idx in xrange(0, len(instance_ids), args.chunk_size):
+        chunk = list(Instance.objects.filter(
+            id__in=instance_ids[idx:idx + args.chunk_size]))
+        for instance, history in check_last_histories(chunk):
+            mismatched_count += 1
+            print "%s: Stored history %s (status:%s size:%s) Newest: %s" %\
+                (instance.provider_alias, instance.last_history_id,
+                 instance.last_status_id, instance.last_size_id,
+                 "%s (%s)" % (history.id, history) if history else None)
+            if args.fix and history:
+                instance.set_last_history(history, instance.last_task)
+    print "%s of %s instances did not match%s" %\
+        (mismatched_count, len(instance_ids),
+         " and were fixed" if args.fix and mismatched_count else "")
+
+
+if __name__ == "__main__":
+    main()
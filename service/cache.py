@@ -1,17 +1,45 @@
+import calendar
 import cPickle as pickle
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from uuid import uuid4
+
 from django.conf import settings
+from django.core.signals import request_finished
 from django.utils import timezone
 
 import redis
+from celery.signals import task_postrun
 
 from threepio import logger
 
+from core.models.instance import Instance as CoreInstance
+
+from service import cache_format
 from service.driver import get_esh_driver, get_admin_driver
 
 
-admin_drivers = {}
-drivers = {}
+# (kind, id) -> idle [(driver, provider.id, created, credentials)]
+# in least recently used order
+driver_pool = OrderedDict()
+# The drivers checked out by the current thread (or greenlet, gevent patches
+# threading.local) in driver_leases.leases (See _Leases)
+driver_leases = threading.local()
+driver_pool_lock = threading.RLock()
+driver_pool_pid = os.getpid()
 connection = None
+store_script = None
+unlock_script = None
+
+# Defaults for settings.DRIVER_POOL_SIZE and settings.DRIVER_POOL_TIMEOUT
+DRIVER_POOL_SIZE = 256
+DRIVER_POOL_TIMEOUT = 30 * 60
+# Incremented when the credentials of a scope ("provider.<id>",
+# "identity.<id>") change, pooled drivers of older credentials are replaced
+CREDENTIALS_KEY = "credentials.{0}"
 
 INSTANCES_KEY_PROVIDER = "instances.{0}"
 INSTANCES_KEY_IDENTITY = "instances.{0}.{1}"
@@ -19,20 +47,266 @@ VOLUMES_KEY_PROVIDER = "volumes.{0}"
 VOLUMES_KEY_IDENTITY = "volumes.{0}.{1}"
 MACHINES_KEY_PROVIDER = "machines.{0}"
 MACHINES_KEY_IDENTITY = "machines.{0}.{1}"
+LOCK_KEY = "{0}.lock"
+SNAPSHOT_LOCK_KEY = "{0}.snapshot"
+# When the data of a key was read from the cloud (epoch seconds)
+VERSION_KEY = "{0}.version"
+# Cached lists are fresh for CACHE_TIMEOUT seconds, then served (stale)
+# while they are refreshed in the background, for up to CACHE_STALE_TIMEOUT.
+CACHE_TIMEOUT = 30
+CACHE_STALE_TIMEOUT = 10 * 60
+# Longest time one caller may fetch a key while the others wait
+CACHE_LOCK_TIMEOUT = 60
+CACHE_LOCK_POLL = 0.1
+# KEYS: key, version key  ARGV: data, version, timeout
+STORE_IF_NEWER = """
+local current = redis.call('GET', KEYS[2])
+if current and tonumber(current) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SETEX', KEYS[1], ARGV[3], ARGV[1])
+redis.call('SETEX', KEYS[2], ARGV[3], ARGV[2])
+return 1
+"""
+# KEYS: lock key  ARGV: token
+# The lock is only released by its owner (It may have expired and been
+# taken by another caller since)
+UNLOCK_IF_OWNER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+SIZES_KEY_PROVIDER = "sizes.{0}"
+# Size catalogs are refreshed by monitor_sizes long before this
+SIZES_TIMEOUT = 2 * 60 * 60
+ALLOCATION_KEY_IDENTITY = "allocation.{0}"
+# Allocation snapshots are re-calculated by monitor_instances long before this.
+# Stale snapshots are kept (and used) until they are re-calculated.
+ALLOCATION_TIMEOUT = 7 * 24 * 60 * 60
+# Sets of the identity.id (and instance.id) whose allocation snapshot is stale
+ALLOCATION_STALE_IDENTITIES_KEY = "allocation.stale.identities"
+ALLOCATION_STALE_INSTANCES_KEY = "allocation.stale.instances"
+# Sorted set of identity.id by projected exhaustion date (epoch seconds)
+ALLOCATION_EXHAUSTION_KEY = "allocation.exhaustion"
+# The date (epoch seconds) the allocation of an identity that is still over
+# allocation is enforced again, set once it has been enforced.
+ALLOCATION_ENFORCED_KEY = "allocation.enforced.{0}"
+ALLOCATION_ENFORCE_RETRY = 15 * 60
+# Incremented whenever the objects of a scope ("user.<id>", "images") change
+CHANGES_KEY = "changes.{0}"
+# The "images" change counter a visibility scope ("public", "group.<id>",
+# "provider.<id>") was last materialized at, and until when (epoch seconds)
+# it holds (See core.models.application)
+IMAGES_KEY_VISIBLE = "images.visible.{0}"
+# Held while a visibility scope is materialized
+IMAGES_LOCK_VISIBLE = "images.visible.{0}.lock"
+# Visibility also changes as start and end dates pass, scopes are rebuilt
+# at the next date or after this.
+IMAGES_VISIBLE_TIMEOUT = 10 * 60
+# The image search index (See service.search) and the "images" change
+# counter it was built at
+IMAGES_KEY_INDEX = "images.index"
+IMAGES_KEY_INDEX_VERSION = "images.index.version"
+IMAGES_INDEX_TIMEOUT = 24 * 60 * 60
+
+
+def _token_expired(driver):
+    """
+    True when the keystone token of the driver's connection has expired.
+    (libcloud re-uses the token of a connection until then)
+    """
+    try:
+        expires = driver._connection.connection.auth_token_expires
+    except AttributeError:
+        return False
+    if not expires:
+        return False
+    if timezone.is_naive(expires):
+        return expires <= datetime.utcnow()
+    return expires <= timezone.now()
+
+
+class _Leases(dict):
+
+    """
+    {(kind, id): (driver, ...)} of the drivers checked out by a thread.
+    A thread that ends without release_cached_drivers (outside of a
+    request or task) returns them to the pool when its locals are cleared.
+    """
+
+    def __init__(self):
+        super(_Leases, self).__init__()
+        self.pid = os.getpid()
+
+    def __del__(self):
+        # (Module globals are None at interpreter exit)
+        if self and _return_to_pool and self.pid == driver_pool_pid:
+            _return_to_pool(self)
+
+
+def _leases():
+    leases = getattr(driver_leases, "leases", None)
+    if leases is None:
+        leases = driver_leases.leases = _Leases()
+    return leases
+
+
+def _reset_after_fork():
+    """
+    Drivers (and their sockets) are never shared with a forked worker.
+    """
+    global driver_pool_pid
+    if driver_pool_pid != os.getpid():
+        driver_pool.clear()
+        driver_leases.leases = _Leases()
+        driver_pool_pid = os.getpid()
+
+
+def _credential_scopes(provider_id=None, identity_id=None):
+    scopes = []
+    if provider_id:
+        scopes.append(CREDENTIALS_KEY.format("provider.%s" % provider_id))
+    if identity_id:
+        scopes.append(CREDENTIALS_KEY.format("identity.%s" % identity_id))
+    return scopes
+
+
+def _credential_versions(provider_id, identity_id=None):
+    """
+    The credential versions of a driver (None if redis is unavailable)
+    """
+    try:
+        return tuple(redis_connection().mget(
+            _credential_scopes(provider_id, identity_id)))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None
+
+
+def _is_current(entry, credentials, now):
+    driver, _, created, entry_credentials = entry
+    timeout = getattr(settings, "DRIVER_POOL_TIMEOUT", DRIVER_POOL_TIMEOUT)
+    return now - created < timeout and entry_credentials == credentials\
+        and not _token_expired(driver)
+
+
+def _pooled_driver(key, provider_id, identity_id, create_method,
+                   force=False):
+    """
+    Check out the driver pooled under 'key' for the calling thread (or
+    greenlet), creating it with 'create_method' when none is idle. Drivers
+    older than DRIVER_POOL_TIMEOUT, with an expired token or with changed
+    credentials are replaced.
+    A driver (and its connection) is only used by one thread at a time,
+    until release_cached_drivers returns it to the pool.
+    """
+    now = time.time()
+    with driver_pool_lock:
+        _reset_after_fork()
+        leases = _leases()
+        entry = leases.pop(key, None)
+        # The credentials were checked when the driver was checked out
+        if entry and not force and _is_current(entry, entry[3], now):
+            leases[key] = entry
+            return entry[0]
+    credentials = _credential_versions(provider_id, identity_id)
+    with driver_pool_lock:
+        _reset_after_fork()
+        idle = driver_pool.pop(key, [])
+        while idle and not force:
+            entry = idle.pop()
+            if _is_current(entry, credentials, now):
+                _leases()[key] = entry
+                if idle:
+                    driver_pool[key] = idle
+                return entry[0]
+        if idle:
+            driver_pool[key] = idle
+    # Authenticating can be slow, other drivers are handed out meanwhile.
+    driver = create_method()
+    if not driver:
+        return driver
+    with driver_pool_lock:
+        _reset_after_fork()
+        _leases()[key] = (driver, provider_id, now, credentials)
+    return driver
+
+
+def release_cached_drivers(**kwargs):
+    """
+    Return the drivers checked out by the calling thread (or greenlet)
+    to the pool. Called when a request (or task) is finished.
+    """
+    with driver_pool_lock:
+        _reset_after_fork()
+        leases = _leases()
+        _return_to_pool(leases)
+        leases.clear()
+
+
+def _return_to_pool(leases):
+    """
+    The least recently used drivers are evicted past DRIVER_POOL_SIZE.
+    """
+    size = getattr(settings, "DRIVER_POOL_SIZE", DRIVER_POOL_SIZE)
+    with driver_pool_lock:
+        for key, entry in leases.items():
+            idle = driver_pool.pop(key, [])
+            idle.append(entry)
+            driver_pool[key] = idle
+        count = sum(len(idle) for idle in driver_pool.values())
+        for key in driver_pool.keys():
+            if count <= size:
+                break
+            idle = driver_pool[key]
+            while idle and count > size:
+                idle.pop(0)
+                count -= 1
+            if not idle:
+                del driver_pool[key]
 
 
-def _get_cached_admin_driver(provider, force=True):
-    if not admin_drivers.get(provider) or force:
-        admin_drivers[provider] = get_admin_driver(provider)
-    return admin_drivers[provider]
+def _get_cached_admin_driver(provider, force=False):
+    return _pooled_driver(("provider", provider.id), provider.id, None,
+                          lambda: get_admin_driver(provider), force)
 
 
-def _get_cached_driver(provider=None, identity=None, force=True):
+def _get_cached_driver(provider=None, identity=None, force=False):
     if provider:
         return _get_cached_admin_driver(provider, force)
-    if not drivers.get(identity) or force:
-        drivers[identity] = get_esh_driver(identity)
-    return drivers[identity]
+    return _pooled_driver(("identity", identity.id), identity.provider_id,
+                          identity.id, lambda: get_esh_driver(identity),
+                          force)
+
+
+def invalidate_cached_driver(provider_id=None, identity_id=None):
+    """
+    Replace the pooled drivers whose credentials have changed,
+    in every process.
+    provider_id - Every driver of the provider (Including the admin driver)
+    identity_id - The driver of a single identity
+    """
+    try:
+        pipe = redis_connection().pipeline()
+        for scope in _credential_scopes(provider_id, identity_id):
+            pipe.incr(scope)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+    def _changed(key, entry):
+        return key == ("identity", identity_id) or\
+            (provider_id and entry[1] == provider_id)
+    with driver_pool_lock:
+        _reset_after_fork()
+        for key, idle in driver_pool.items():
+            if idle and _changed(key, idle[0]):
+                del driver_pool[key]
+        for leases in driver_leases.values():
+            for key, entry in leases.items():
+                if _changed(key, entry):
+                    del leases[key]
 
 
 def redis_connection():
@@ -48,37 +322,339 @@ def _invalidate(key):
         r.delete(key)
 
 
-def _get_cached(key, data_method, scrub_method, force=False):
+def _redis_unavailable():
+    logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                 "Somebody should turn it on!")
+
+
+def _load_cached(r, key, restore_method):
+    """
+    Returns (objects, age in seconds) cached at 'key' or (None, None).
+    """
+    pipe = r.pipeline()
+    pipe.get(key)
+    pipe.ttl(key)
+    data, ttl = pipe.execute()
+    if not data:
+        return None, None
+    objects = cache_format.loads(restore_method, data)
+    if objects is None:
+        return None, None
+    # Keys without an expiration are always stale.
+    return objects, CACHE_STALE_TIMEOUT - (ttl if ttl > 0 else 0)
+
+
+def _store(r, key, snapshot_method, objects, version):
+    try:
+        _store_if_newer(r, key, cache_format.dumps(snapshot_method, objects),
+                        version)
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def _store_if_newer(client, key, data, version):
+    """
+    Store 'data' at 'key' (with 'client', a redis connection or pipeline)
+    unless the version of the key is newer than 'version'.
+    """
+    global store_script
+    if not store_script:
+        store_script = redis_connection().register_script(STORE_IF_NEWER)
+    store_script(keys=[key, VERSION_KEY.format(key)],
+                 args=[data, repr(version), CACHE_STALE_TIMEOUT],
+                 client=client)
+
+
+def _patch_cached(key, patch_method, version):
+    """
+    Replace the snapshots cached at 'key' with patch_method(snapshots),
+    keeping the age of the key. Keys that are missing (or newer than
+    'version') are left alone.
+    """
+    version_key = VERSION_KEY.format(key)
+    with redis_connection().pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key, version_key)
+                data = pipe.get(key)
+                current = pipe.get(version_key)
+                ttl = pipe.ttl(key)
+                snapshots = cache_format.loads_snapshots(data)\
+                    if data else None
+                if snapshots is None or ttl <= 0\
+                        or (current and float(current) > version):
+                    pipe.reset()
+                    return False
+                pipe.multi()
+                pipe.setex(key, ttl, cache_format.dumps_snapshots(
+                    patch_method(snapshots)))
+                pipe.setex(version_key, ttl, repr(version))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+
+def _lock(r, key):
+    return r.set(LOCK_KEY.format(key), 1, nx=True, ex=CACHE_LOCK_TIMEOUT)
+
+
+def _unlock(r, key):
+    try:
+        r.delete(LOCK_KEY.format(key))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def _wait_for_fetch(r, key, restore_method):
+    """
+    Wait (up to CACHE_LOCK_TIMEOUT) while another caller fetches 'key'.
+    Returns (objects, locked), when the lock of the key is free it is
+    taken (locked=True) and the caller is expected to fetch the key.
+    """
+    deadline = time.time() + CACHE_LOCK_TIMEOUT
+    while time.time() < deadline:
+        if _lock(r, key):
+            # The key may have been stored since it was last checked
+            objects, _ = _load_cached(r, key, restore_method)
+            if objects is not None:
+                _unlock(r, key)
+            return objects, objects is None
+        time.sleep(CACHE_LOCK_POLL)
+        objects, _ = _load_cached(r, key, restore_method)
+        if objects is not None:
+            return objects, False
+    return None, False
+
+
+def _refresh_later(r, key, refresh_method):
+    """
+    Call 'refresh_method' while holding the lock of 'key'.
+    The refresh releases the lock once the key has been stored.
+    """
+    try:
+        refresh_method()
+    except Exception:
+        logger.exception("Unable to refresh redis(%s)" % key)
+        _unlock(r, key)
+
+
+def _get_cached(key, data_method, snapshot_method, restore_method,
+                refresh_method, force=False):
+    """
+    Return the objects cached at 'key' (in the format of cache_format).
+    Fresh:   Younger than CACHE_TIMEOUT, returned.
+    Stale:   Returned, and the first caller to take the lock of the key
+             calls 'refresh_method' to refresh the key in the background.
+    Missing: The first caller calls 'data_method' and stores the result,
+             concurrent callers wait for it instead of calling it too.
+    force=True always calls 'data_method'.
+    """
+    locked = False
     try:
         r = redis_connection()
-        if force:
-            _invalidate(key)
-        data = r.get(key)
+        if not force:
+            objects, age = _load_cached(r, key, restore_method)
+            if objects is not None:
+                if age >= CACHE_TIMEOUT and _lock(r, key):
+                    _refresh_later(r, key, refresh_method)
+                return objects
+            objects, locked = _wait_for_fetch(r, key, restore_method)
+            if objects is not None:
+                return objects
     except redis.exceptions.ConnectionError:
-        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
-                     "Somebody should turn it on!")
-        data = None
-    if not data:
-        data = data_method()
-        scrub_method(data)
+        _redis_unavailable()
+        return data_method()
+    try:
+        version = time.time()
+        objects = data_method()
         logger.debug("Updated redis({0}) using {1} and {2}".format(
-            key, data_method, scrub_method))
-        r.set(key, pickle.dumps(data))
-        r.expire(key, 30)
-        return data
-    logger.debug("Actual type {0}".format(type(data)))
-    return pickle.loads(data)
+            key, data_method, snapshot_method))
+        _store(r, key, snapshot_method, objects, version)
+    finally:
+        if locked:
+            _unlock(r, key)
+    return objects
+
+
+# Lists the admin driver of a provider can make for every tenant at once
+PROVIDER_SNAPSHOT_LISTS = ("instances", "volumes")
+# kind -> (provider key, identity key, driver method, cache_format methods)
+CACHED_LISTS = {
+    "instances": (INSTANCES_KEY_PROVIDER, INSTANCES_KEY_IDENTITY,
+                  "list_all_instances", cache_format.snapshot_instance,
+                  cache_format.restore_instance),
+    "volumes": (VOLUMES_KEY_PROVIDER, VOLUMES_KEY_IDENTITY,
+                "list_all_volumes", cache_format.snapshot_volume,
+                cache_format.restore_volume),
+    "machines": (MACHINES_KEY_PROVIDER, MACHINES_KEY_IDENTITY,
+                 "list_machines", cache_format.snapshot_machine,
+                 cache_format.restore_machine),
+}
+
+
+def _list_key(kind, provider=None, identity=None):
+    provider_key, identity_key = CACHED_LISTS[kind][:2]
+    if provider:
+        return provider_key.format(provider.id)
+    return identity_key.format(identity.created_by.username, identity.id)
+
+
+def _get_cached_list(kind, provider=None, identity=None, force=False):
+    _validate_parameters(provider, identity)
+    _, _, list_method, snapshot_method, restore_method = CACHED_LISTS[kind]
+
+    def data_method():
+        cached_driver = _get_cached_driver(provider=provider,
+                                           identity=identity)
+        return getattr(cached_driver, list_method)()
+
+    def refresh_method():
+        from service.tasks.monitoring import refresh_cached_list
+        refresh_cached_list.apply_async(
+            args=[kind],
+            kwargs={"provider_id": provider.id if provider else None,
+                    "identity_id": identity.id if identity else None})
+    return _get_cached(_list_key(kind, provider, identity),
+                       data_method,
+                       snapshot_method,
+                       restore_method,
+                       refresh_method,
+                       force=force)
+
+
+def update_cached_list(kind, provider=None, identity=None):
+    """
+    Fetch and store a cached list ('instances', 'volumes' or 'machines'),
+    then release the lock held while it was refreshed.
+    """
+    try:
+        return _get_cached_list(kind, provider=provider, identity=identity,
+                                force=True)
+    finally:
+        _unlock(redis_connection(), _list_key(kind, provider, identity))
+
+
+def is_cached_list_fresh(kind, provider=None, identity=None):
+    try:
+        ttl = redis_connection().ttl(_list_key(kind, provider, identity))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return False
+    return ttl > CACHE_STALE_TIMEOUT - CACHE_TIMEOUT
+
+
+def get_cached_list_version(kind, provider=None, identity=None):
+    """
+    Returns the version of a cached list while it is fresh, otherwise None.
+    (A stale or missing list is about to change)
+    """
+    key = _list_key(kind, provider, identity)
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.ttl(key)
+        pipe.get(VERSION_KEY.format(key))
+        ttl, version = pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None
+    if ttl <= CACHE_STALE_TIMEOUT - CACHE_TIMEOUT:
+        return None
+    return version
+
 
+def update_cached_provider_list(kind, provider, identity_tenants_method,
+                                force=False):
+    """
+    List every tenant's instances (or volumes) with the admin driver of
+    'provider', then store them under the provider and, split by tenant,
+    under each identity returned by 'identity_tenants_method'
+    (a dict of identity -> tenant id). Identities without any are cached
+    as an empty list.
 
-def _scrub(objects):
-    for o in objects:
-        o._connection = None
-        for a in ["_node", "_volume", "_image"]:
-            if hasattr(o, a):
-                o.__dict__[a] = None
-        if hasattr(o, "size") and hasattr(o.size, "_size"):
-            if o.size._size:
-                o.size._size = None
+    One listing runs per provider at a time. Callers waiting on it return
+    None once it has finished, unless force=True, or once they gave up
+    waiting (after CACHE_LOCK_TIMEOUT).
+    """
+    provider_key = _list_key(kind, provider=provider)
+    lock_key = SNAPSHOT_LOCK_KEY.format(provider_key)
+    token = uuid4().hex
+    try:
+        if not _wait_for_lock(lock_key, token):
+            logger.warn("Gave up waiting to list %s of provider %s"
+                        % (kind, provider))
+            return None
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        # Nothing to share (or wait for) without redis
+        token = None
+    try:
+        if not force and is_cached_list_fresh(kind, provider=provider):
+            return None
+        _, _, list_method, snapshot_method, _ = CACHED_LISTS[kind]
+        version = time.time()
+        objects = getattr(_get_cached_driver(provider=provider),
+                          list_method)()
+        _set_cached_provider_list(kind, provider, objects,
+                                  identity_tenants_method(),
+                                  snapshot_method, version)
+        return objects
+    finally:
+        if token:
+            _release_lock(lock_key, token)
+
+
+def _wait_for_lock(lock_key, token):
+    """
+    Wait (up to CACHE_LOCK_TIMEOUT) to take 'lock_key' with 'token'.
+    Returns False if the lock was not taken.
+    """
+    r = redis_connection()
+    deadline = time.time() + CACHE_LOCK_TIMEOUT
+    while not r.set(lock_key, token, nx=True, ex=CACHE_LOCK_TIMEOUT):
+        if time.time() >= deadline:
+            return False
+        time.sleep(CACHE_LOCK_POLL)
+    return True
+
+
+def _release_lock(lock_key, token):
+    global unlock_script
+    try:
+        r = redis_connection()
+        if not unlock_script:
+            unlock_script = r.register_script(UNLOCK_IF_OWNER)
+        unlock_script(keys=[lock_key], args=[token], client=r)
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def _set_cached_provider_list(kind, provider, objects, identity_tenants,
+                              snapshot_method, version):
+    snapshots = [snapshot_method(obj) for obj in objects]
+    tenant_snapshots = {}
+    for obj, snapshot in zip(objects, snapshots):
+        tenant_snapshots.setdefault(
+            cache_format.owner_of(obj), []).append(snapshot)
+    if None in tenant_snapshots:
+        logger.warn("%s of provider %s without a tenant. "
+                    "Not cached by identity." % (kind, provider))
+        identity_tenants = {}
+    cached = {_list_key(kind, provider=provider): snapshots}
+    for identity, tenant_id in identity_tenants.items():
+        cached[_list_key(kind, identity=identity)] =\
+            tenant_snapshots.get(tenant_id, [])
+    try:
+        pipe = redis_connection().pipeline()
+        for key, key_snapshots in cached.items():
+            _store_if_newer(pipe, key,
+                            cache_format.dumps_snapshots(key_snapshots),
+                            version)
+            # Refreshes of the key are done
+            pipe.delete(LOCK_KEY.format(key))
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
 
 
 def _validate_parameters(provider, identity):
@@ -86,7 +662,13 @@ def _validate_parameters(provider, identity):
         raise Exception("Use either provider or identity but not both.")
 
 
-def get_cached_driver(provider=None, identity=None, force=True):
+def get_cached_driver(provider=None, identity=None, force=False):
+    """
+    Return the pooled driver of a provider (admin) or an identity.
+    The driver is checked out by the calling thread (or greenlet) until
+    release_cached_drivers (or the thread ends), use force=True for a new
+    (and re-authenticated) driver.
+    """
     _validate_parameters(provider, identity)
     return _get_cached_driver(provider=provider,
                               identity=identity,
@@ -94,75 +676,425 @@ def get_cached_driver(provider=None, identity=None, force=True):
 
 
 def get_cached_instances(provider=None, identity=None, force=False):
-    _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
-    instances_method = cached_driver.list_all_instances
-    if provider:
-        key = INSTANCES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = INSTANCES_KEY_IDENTITY.format(identity.created_by.username,
-                                            identity.id)
-    return _get_cached(key,
-                       instances_method,
-                       _scrub,
-                       force=force)
+    return _get_cached_list("instances", provider=provider, identity=identity,
+                            force=force)
 
 
 def invalidate_cached_instances(provider=None, identity=None):
-    if provider:
-        key = INSTANCES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = INSTANCES_KEY_IDENTITY.format(identity.created_by.username,
-                                            identity.id)
-    _invalidate(key)
+    _invalidate(_list_key("instances", provider, identity))
+
+
+def write_cached_instance(esh_instance, identity=None, version=None):
+    """
+    Insert (or replace) an instance in the cached instance lists of its
+    identity and provider, after an action on the instance.
+    """
+    snapshot = cache_format.snapshot_instance(esh_instance)
+    _patch_cached_instance(
+        esh_instance.id, identity, version,
+        lambda snapshots: [s for s in snapshots
+                           if cache_format.snapshot_id(s) != esh_instance.id]
+        + [snapshot])
+
+
+def remove_cached_instance(instance_id, identity=None, version=None):
+    """
+    Remove a (destroyed) instance from the cached instance lists of its
+    identity and provider.
+    """
+    _patch_cached_instance(
+        instance_id, identity, version,
+        lambda snapshots: [s for s in snapshots
+                           if cache_format.snapshot_id(s) != instance_id])
+
+
+def update_cached_instance(instance_id, identity=None, version=None,
+                           **extra):
+    """
+    Update the 'extra' (status, task, metadata) of an instance in the
+    cached instance lists of its identity and provider.
+    """
+    _patch_cached_instance(
+        instance_id, identity, version,
+        lambda snapshots: [
+            cache_format.update_instance_extra(s, extra)
+            if cache_format.snapshot_id(s) == instance_id else s
+            for s in snapshots])
+
+
+def _patch_cached_instance(instance_id, identity, version, patch_method):
+    """
+    identity - The instance's identity, when it is not known it is looked up
+    version - When the change was made (Default: now)
+    """
+    if not version:
+        version = time.time()
+    if not identity:
+        core_instance = CoreInstance.objects.filter(
+            provider_alias=instance_id).select_related(
+            'created_by_identity__created_by',
+            'created_by_identity__provider').first()
+        if not core_instance:
+            return
+        identity = core_instance.created_by_identity
+    try:
+        for key in (_list_key("instances", identity=identity),
+                    _list_key("instances", provider=identity.provider)):
+            _patch_cached(key, patch_method, version)
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
 
 
 def get_cached_volumes(provider=None, identity=None, force=False):
-    _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
-    volumes_method = cached_driver.list_all_volumes
-    if provider:
-        key = VOLUMES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = VOLUMES_KEY_IDENTITY.format(identity.created_by.username,
-                                          identity.id)
-    return _get_cached(key,
-                       volumes_method,
-                       _scrub,
-                       force=force)
+    return _get_cached_list("volumes", provider=provider, identity=identity,
+                            force=force)
 
 
 def invalidate_cached_volumes(provider=None, identity=None):
-    if provider:
-        key = VOLUMES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = VOLUMES_KEY_IDENTITY.format(identity.created_by.username,
-                                          identity.id)
-    _invalidate(key)
+    _invalidate(_list_key("volumes", provider, identity))
 
 
 def get_cached_machines(provider=None, identity=None, force=False):
-    _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
-    machines_method = cached_driver.list_machines
-    if provider:
-        key = MACHINES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = MACHINES_KEY_IDENTITY.format(identity.created_by.username,
-                                           identity.id)
-    return _get_cached(key,
-                       machines_method,
-                       _scrub,
-                       force=force)
+    return _get_cached_list("machines", provider=provider, identity=identity,
+                            force=force)
 
 
 def invalidate_cached_machines(provider=None, identity=None):
-    if provider:
-        key = MACHINES_KEY_PROVIDER.format(provider.id)
-    else:
-        key = MACHINES_KEY_IDENTITY.format(identity.created_by.username,
-                                           identity.id)
-    _invalidate(key)
+    _invalidate(_list_key("machines", provider, identity))
+
+
+def get_cached_sizes(provider_uuid):
+    """
+    Returns the cached size catalog (rows of values) of a provider (or None)
+    """
+    try:
+        data = redis_connection().get(SIZES_KEY_PROVIDER.format(provider_uuid))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None
+    if not data:
+        return None
+    return pickle.loads(data)
+
+
+def set_cached_sizes(provider_uuid, rows):
+    try:
+        redis_connection().setex(SIZES_KEY_PROVIDER.format(provider_uuid),
+                                 SIZES_TIMEOUT,
+                                 pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def invalidate_cached_sizes(provider_uuid):
+    try:
+        _invalidate(SIZES_KEY_PROVIDER.format(provider_uuid))
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def get_cached_allocation(identity_id):
+    """
+    Returns the cached allocation snapshot of an identity (or None)
+    """
+    try:
+        data = redis_connection().get(
+            ALLOCATION_KEY_IDENTITY.format(identity_id))
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+        return None
+    if not data:
+        return None
+    return pickle.loads(data)
+
+
+def set_cached_allocations(snapshots):
+    """
+    snapshots - dict of identity.id -> allocation snapshot
+    """
+    try:
+        pipe = redis_connection().pipeline()
+        for identity_id, snapshot in snapshots.items():
+            pipe.setex(ALLOCATION_KEY_IDENTITY.format(identity_id),
+                       ALLOCATION_TIMEOUT, pickle.dumps(snapshot))
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+
+
+def mark_stale_allocations(identity_ids=(), instance_ids=()):
+    """
+    Queue the snapshots of 'identity_ids' (and of the identities of
+    'instance_ids') to be re-calculated. (See pop_stale_allocations)
+    """
+    identity_ids = list(identity_ids)
+    instance_ids = list(instance_ids)
+    if not identity_ids and not instance_ids:
+        return
+    try:
+        pipe = redis_connection().pipeline()
+        if identity_ids:
+            pipe.sadd(ALLOCATION_STALE_IDENTITIES_KEY, *identity_ids)
+        if instance_ids:
+            pipe.sadd(ALLOCATION_STALE_INSTANCES_KEY, *instance_ids)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+
+
+def pop_stale_allocations():
+    """
+    Remove (and return) the queued (identity ids, instance ids)
+    """
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.smembers(ALLOCATION_STALE_IDENTITIES_KEY)
+        pipe.smembers(ALLOCATION_STALE_INSTANCES_KEY)
+        pipe.delete(ALLOCATION_STALE_IDENTITIES_KEY,
+                    ALLOCATION_STALE_INSTANCES_KEY)
+        identity_ids, instance_ids, _ = pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+        return [], []
+    return ([int(identity_id) for identity_id in identity_ids],
+            [int(instance_id) for instance_id in instance_ids])
+
+
+def _epoch(date):
+    return calendar.timegm(date.utctimetuple())
+
+
+def set_allocation_exhaustion(exhaustion_dates):
+    """
+    exhaustion_dates - dict of identity.id -> projected exhaustion date
+                       (None removes the identity from the queue)
+    """
+    try:
+        pipe = redis_connection().pipeline()
+        for identity_id, exhaustion_date in exhaustion_dates.items():
+            if exhaustion_date:
+                pipe.zadd(ALLOCATION_EXHAUSTION_KEY,
+                          _epoch(exhaustion_date), identity_id)
+            else:
+                pipe.zrem(ALLOCATION_EXHAUSTION_KEY, identity_id)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+
+
+def set_allocations_enforced(identity_ids, as_of):
+    """
+    The allocation of 'identity_ids' was enforced 'as_of', enforce it again
+    (if it is still over allocation) after ALLOCATION_ENFORCE_RETRY.
+    """
+    retry = _epoch(as_of) + ALLOCATION_ENFORCE_RETRY
+    try:
+        pipe = redis_connection().pipeline()
+        for identity_id in identity_ids:
+            pipe.setex(ALLOCATION_ENFORCED_KEY.format(identity_id),
+                       ALLOCATION_ENFORCE_RETRY, retry)
+            pipe.zadd(ALLOCATION_EXHAUSTION_KEY, retry, identity_id)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def get_enforcement_retries(identity_ids):
+    """
+    Returns a dict of identity.id -> date its allocation is enforced again,
+    for those of 'identity_ids' enforced recently.
+    """
+    identity_ids = list(identity_ids)
+    if not identity_ids:
+        return {}
+    try:
+        values = redis_connection().mget(
+            [ALLOCATION_ENFORCED_KEY.format(identity_id)
+             for identity_id in identity_ids])
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return {}
+    return dict(
+        (identity_id, datetime.fromtimestamp(int(value), timezone.utc))
+        for identity_id, value in zip(identity_ids, values) if value)
+
+
+def pop_exhausted_allocations(as_of):
+    """
+    Remove (and return) every identity.id projected to be exhausted by 'as_of'
+    """
+    score = _epoch(as_of)
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.zrangebyscore(ALLOCATION_EXHAUSTION_KEY, '-inf', score)
+        pipe.zremrangebyscore(ALLOCATION_EXHAUSTION_KEY, '-inf', score)
+        identity_ids, _ = pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                     "Somebody should turn it on!")
+        return []
+    return [int(identity_id) for identity_id in identity_ids]
+
+
+def get_change_counters(*scopes):
+    """
+    Returns the change counters of 'scopes' (None if redis is unavailable)
+    """
+    try:
+        return redis_connection().mget(
+            [CHANGES_KEY.format(scope) for scope in scopes])
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None
+
+
+def bump_change_counters(*scopes):
+    """
+    Call when the objects of 'scopes' change.
+    """
+    if not scopes:
+        return
+    try:
+        pipe = redis_connection().pipeline()
+        for scope in scopes:
+            pipe.incr(CHANGES_KEY.format(scope))
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def get_stale_visibility_scopes(scopes):
+    """
+    Returns (version, stale scopes, unbuilt scopes): the current "images"
+    change counter, those of 'scopes' not materialized at it (or expired)
+    and those of them never materialized.
+    (version is None if redis is unavailable)
+    """
+    try:
+        r = redis_connection()
+        version = r.get(CHANGES_KEY.format("images")) or "0"
+        values = r.mget([IMAGES_KEY_VISIBLE.format(scope)
+                         for scope in scopes]) if scopes else []
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None, [], []
+    now = time.time()
+    stale = []
+    unbuilt = []
+    for scope, value in zip(scopes, values):
+        if not value:
+            unbuilt.append(scope)
+            stale.append(scope)
+            continue
+        scope_version, valid_until = value.split()
+        if scope_version != version or float(valid_until) <= now:
+            stale.append(scope)
+    return version, stale, unbuilt
+
+
+def set_visibility_scopes(version, scopes, next_change=None):
+    """
+    Record that 'scopes' were materialized at 'version', and hold until
+    'next_change' (a datetime) or IMAGES_VISIBLE_TIMEOUT.
+    """
+    if version is None or not scopes:
+        return
+    valid_until = time.time() + IMAGES_VISIBLE_TIMEOUT
+    if next_change:
+        valid_until = min(valid_until,
+                          calendar.timegm(next_change.utctimetuple()) +
+                          next_change.microsecond / 1e6)
+    try:
+        pipe = redis_connection().pipeline()
+        for scope in scopes:
+            pipe.set(IMAGES_KEY_VISIBLE.format(scope),
+                     "%s %r" % (version, valid_until))
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def lock_visibility_scope(scope):
+    """
+    Returns a token if the caller may materialize 'scope', otherwise None.
+    (Another caller is materializing it, or redis is unavailable)
+    """
+    token = uuid4().hex
+    try:
+        if redis_connection().set(IMAGES_LOCK_VISIBLE.format(scope), token,
+                                  nx=True, ex=CACHE_LOCK_TIMEOUT):
+            return token
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+    return None
+
+
+def unlock_visibility_scope(scope, token):
+    _release_lock(IMAGES_LOCK_VISIBLE.format(scope), token)
+
+
+def get_images_version():
+    """
+    Returns the "images" change counter (None if redis is unavailable)
+    """
+    try:
+        return redis_connection().get(CHANGES_KEY.format("images")) or "0"
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None
+
+
+def get_cached_image_index(known_version=None):
+    """
+    Returns (images version, index version, index) of the image index.
+    The index is only read (and returned) when it differs from
+    'known_version'. (versions are None if redis is unavailable)
+    """
+    try:
+        r = redis_connection()
+        version, index_version = r.mget(CHANGES_KEY.format("images"),
+                                        IMAGES_KEY_INDEX_VERSION)
+        data = None
+        if index_version and index_version != known_version:
+            data = r.get(IMAGES_KEY_INDEX)
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return None, None, None
+    return version or "0", index_version, pickle.loads(data) if data else None
+
+
+def set_cached_image_index(version, index):
+    if version is None:
+        return
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.setex(IMAGES_KEY_INDEX, IMAGES_INDEX_TIMEOUT,
+                   pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        pipe.setex(IMAGES_KEY_INDEX_VERSION, IMAGES_INDEX_TIMEOUT, version)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+
+
+def lock_image_index():
+    """
+    True if the caller should rebuild the image index (nobody else is).
+    """
+    try:
+        return _lock(redis_connection(), IMAGES_KEY_INDEX)
+    except redis.exceptions.ConnectionError:
+        _redis_unavailable()
+        return False
+
+
+def unlock_image_index():
+    _unlock(redis_connection(), IMAGES_KEY_INDEX)
+
+
+request_finished.connect(release_cached_drivers)
+task_postrun.connect(release_cached_drivers)
@@ -0,0 +1,205 @@
+"""
+Compact, versioned format for the rtwo objects cached in redis.
+
+Only the attributes read by the API and monitoring are stored, as plain
+tuples, dicts and strings. Loading rebuilds the original rtwo class
+without its libcloud node, image or volume (or a connection), so the
+isinstance checks in core.models keep working.
+"""
+import cPickle as pickle
+from importlib import import_module
+
+from threepio import logger
+
+from rtwo.machine import BaseMachine, MockMachine
+from rtwo.size import MockSize
+from rtwo.volume import BaseVolume
+
+# Increment when a snapshot tuple changes.
+# Older (or newer) payloads are treated as a cache miss.
+FORMAT_VERSION = 2
+
+INSTANCE_EXTRA = ("status", "task", "metadata", "fault", "addresses",
+                  "created", "launchdatetime", "launch_time", "flavorId",
+                  "instance_type", "instancetype", "imageId", "tenantId")
+VOLUME_EXTRA = ("status", "tmp_status", "attachments", "metadata",
+                "createTime", "description")
+MACHINE_EXTRA = ("state", "status", "architecture", "metadata")
+
+_classes = {}
+
+
+class CachedNode(object):
+
+    """
+    Stands in for the libcloud Node/NodeImage of a cached object.
+    """
+
+    def __init__(self, id, extra):
+        self.id = id
+        self.extra = extra
+
+
+def _class_path(obj):
+    return "%s.%s" % (obj.__class__.__module__, obj.__class__.__name__)
+
+
+def _new(class_path):
+    cls = _classes.get(class_path)
+    if not cls:
+        module_name, _, class_name = class_path.rpartition(".")
+        cls = getattr(import_module(module_name), class_name)
+        _classes[class_path] = cls
+    # Skip __init__, it expects a libcloud object
+    return cls.__new__(cls)
+
+
+def owner_of(obj):
+    """
+    The tenant (project) id of an instance or volume, if it is known.
+    """
+    tenant_id = getattr(obj, "owner", None)
+    extra = getattr(obj, "extra", None)
+    if not tenant_id and extra:
+        tenant_id = extra.get("tenantId") or\
+            extra.get("os-vol-tenant-attr:tenant_id")
+    return tenant_id
+
+
+def _pick(extra, keys):
+    if not extra:
+        return {}
+    return dict((key, extra[key]) for key in keys if key in extra)
+
+
+def snapshot_instance(instance):
+    size = getattr(instance, "size", None)
+    source = getattr(instance, "source", None)
+    if isinstance(source, BaseVolume):
+        source = ("volume", snapshot_volume(source))
+    elif isinstance(source, BaseMachine):
+        source = ("machine", (source.id, source.name))
+    else:
+        source = None
+    return (_class_path(instance), instance.id, instance.alias,
+            instance.name, instance.ip, owner_of(instance),
+            _pick(instance.extra, INSTANCE_EXTRA),
+            (size.id, size.name) if size else None,
+            source)
+
+
+def snapshot_id(snapshot):
+    # The id follows the class of every snapshot
+    return snapshot[1]
+
+
+def update_instance_extra(snapshot, extra):
+    """
+    Returns a copy of an instance snapshot with 'extra' updated.
+    """
+    updated = dict(snapshot[6])
+    updated.update(extra)
+    return snapshot[:6] + (updated,) + snapshot[7:]
+
+
+def restore_instance(snapshot):
+    (class_path, id, alias, name, ip, owner, extra, size, source) = snapshot
+    instance = _new(class_path)
+    instance.id = id
+    instance.alias = alias
+    instance.name = name
+    instance.ip = ip
+    instance.owner = owner
+    instance.extra = extra
+    instance.provider = None
+    instance._connection = None
+    instance._node = CachedNode(id, extra)
+    # Sizes and machines are looked up (and cached) by the driver
+    instance.size = _mock(MockSize, *size) if size else None
+    instance.machine = None
+    if source and source[0] == "volume":
+        instance.source = restore_volume(source[1])
+    elif source:
+        instance.source = instance.machine = _mock(MockMachine, *source[1])
+    else:
+        instance.source = None
+    return instance
+
+
+def _mock(cls, id, name):
+    mock = cls.__new__(cls)
+    mock.id = mock.alias = id
+    mock.name = name
+    mock.provider = None
+    mock._connection = None
+    return mock
+
+
+def snapshot_volume(volume):
+    return (_class_path(volume), volume.id, volume.alias, volume.name,
+            volume.size, owner_of(volume), _pick(volume.extra, VOLUME_EXTRA))
+
+
+def restore_volume(snapshot):
+    (class_path, id, alias, name, size, owner, extra) = snapshot
+    volume = _new(class_path)
+    volume.id = id
+    volume.alias = alias
+    volume.name = name
+    volume.size = size
+    volume.owner = owner
+    volume.extra = extra
+    volume.provider = None
+    volume._connection = None
+    volume._volume = None
+    return volume
+
+
+def snapshot_machine(machine):
+    image = getattr(machine, "_image", None)
+    return (_class_path(machine), machine.id, machine.alias, machine.name,
+            _pick(getattr(image, "extra", None), MACHINE_EXTRA))
+
+
+def restore_machine(snapshot):
+    (class_path, id, alias, name, extra) = snapshot
+    machine = _new(class_path)
+    machine.id = id
+    machine.alias = alias
+    machine.name = name
+    machine.provider = None
+    machine._connection = None
+    machine._image = CachedNode(id, extra)
+    return machine
+
+
+def dumps(snapshot_method, objects):
+    return dumps_snapshots([snapshot_method(obj) for obj in objects])
+
+
+def dumps_snapshots(snapshots):
+    return pickle.dumps((FORMAT_VERSION, snapshots), pickle.HIGHEST_PROTOCOL)
+
+
+def loads_snapshots(data):
+    """
+    Returns the list of snapshots, or None when 'data' is of another version.
+    """
+    version, snapshots = pickle.loads(data)
+    if version != FORMAT_VERSION:
+        return None
+    return snapshots
+
+
+def loads(restore_method, data):
+    """
+    Returns the list of objects, or None when 'data' can not be restored.
+    """
+    try:
+        snapshots = loads_snapshots(data)
+        if snapshots is None:
+            return None
+        return [restore_method(snapshot) for snapshot in snapshots]
+    except Exception:
+        logger.exception("Cached data could not be restored.")
+        return None
@@ -29,7 +29,8 @@ from core.models.provider import AccountProvider, Provider, ProviderInstanceActi
 from atmosphere import settings
 from atmosphere.settings import secrets
 
-from service.cache import get_cached_driver, invalidate_cached_instances
+from service.cache import get_cached_driver, write_cached_instance,\
+    remove_cached_instance, update_cached_instance
 from service.driver import _retrieve_source
 from service.licensing import _test_license
 from service.exceptions import OverAllocationError, OverQuotaError,\
@@ -89,6 +90,9 @@ def reboot_instance(
     size = _get_size(esh_driver, esh_instance)
     check_quota(user.username, identity_uuid, size, resuming=True)
     esh_driver.reboot_instance(esh_instance, reboot_type=reboot_type)
+    update_cached_instance(
+        esh_instance.id,
+        task="rebooting" if reboot_type == "SOFT" else "rebooting_hard")
     # reboots take very little time..
     redeploy_init(esh_driver, esh_instance)
 
@@ -147,8 +151,6 @@ def stop_instance(esh_driver, esh_instance, provider_uuid, identity_uuid, user,
         provider_uuid,
         identity_uuid,
         user)
-    invalidate_cached_instances(
-        identity=CoreIdentity.objects.get(uuid=identity_uuid))
 
 
 def start_instance(esh_driver, esh_instance,
@@ -184,9 +186,6 @@ def start_instance(esh_driver, esh_instance,
         provider_uuid,
         identity_uuid,
         user)
-    invalidate_cached_instances(
-        identity=CoreIdentity.objects.get(
-            uuid=identity_uuid))
 
 
 def suspend_instance(esh_driver, esh_instance,
@@ -208,9 +207,6 @@ def suspend_instance(esh_driver, esh_instance,
         provider_uuid,
         identity_uuid,
         user)
-    invalidate_cached_instances(
-        identity=CoreIdentity.objects.get(
-            uuid=identity_uuid))
     return suspended
 
 
@@ -533,6 +529,7 @@ def resume_instance(esh_driver, esh_instance,
             identity_uuid)
 
     esh_driver.resume_instance(esh_instance)
+    update_cached_instance(esh_instance.id, task="resuming")
     if restore_ip:
         deploy_task.apply_async()
 
@@ -558,9 +555,6 @@ def shelve_instance(esh_driver, esh_instance,
         provider_uuid,
         identity_uuid,
         user)
-    invalidate_cached_instances(
-        identity=CoreIdentity.objects.get(
-            uuid=identity_uuid))
     return shelved
 
 
@@ -585,6 +579,7 @@ def unshelve_instance(esh_driver, esh_instance,
                                        core_identity_uuid=identity_uuid)
 
     unshelved = esh_driver._connection.ex_unshelve_instance(esh_instance)
+    update_cached_instance(esh_instance.id, task="unshelving")
     if restore_ip:
         deploy_task.apply_async(countdown=10)
     return unshelved
@@ -611,9 +606,6 @@ def offload_instance(esh_driver, esh_instance,
         provider_uuid,
         identity_uuid,
         user)
-    invalidate_cached_instances(
-        identity=CoreIdentity.objects.get(
-            uuid=identity_uuid))
     return offloaded
 
 
@@ -637,6 +629,8 @@ def destroy_instance(identity_uuid, instance_alias):
                     or "500 Internal Server Error" in exc.message):
                 raise
     node_destroyed = esh_driver._connection.destroy_node(instance)
+    if node_destroyed:
+        remove_cached_instance(instance.id, identity=identity)
     return node_destroyed
 
 
@@ -659,13 +653,19 @@ def update_status(esh_driver, instance_id, provider_uuid, identity_uuid, user):
     But it makes more sense to call this function in the code..
     """
     # Grab a new copy of the instance
-
+    version = time.time()
     if AccountProvider.objects.filter(identity__uuid=identity_uuid):
         esh_instance = admin_get_instance(esh_driver, instance_id)
+        # The instance may belong to any identity on the provider
+        identity = None
     else:
         esh_instance = esh_driver.get_instance(instance_id)
+        identity = CoreIdentity.objects.get(uuid=identity_uuid)
     if not esh_instance:
+        remove_cached_instance(instance_id, identity=identity,
+                               version=version)
         return None
+    write_cached_instance(esh_instance, identity=identity, version=version)
     # Convert & Update based on new status change
     core_instance = convert_esh_instance(esh_driver,
                                          esh_instance,
@@ -1014,8 +1014,7 @@ def _complete_launch_instance(
                           password, token, deploy=deploy)
     # Update InstanceStatusHistory
     _first_update(driver, identity, core_instance, instance)
-    # Invalidate and return
-    invalidate_cached_instances(identity=identity)
+    write_cached_instance(instance, identity=identity)
     return core_instance
 
 
@@ -1283,6 +1282,7 @@ def update_instance_metadata(esh_driver, esh_instance, data={}, replace=True):
             esh_instance,
             data,
             replace_metadata=replace)
+        update_cached_instance(instance_id, metadata=current)
         logger.info("%s update_metadata: previous %s", esh_instance.id, previous)
         logger.info("%s update_metadata: data %s", esh_instance.id, data)
         logger.info("%s update_metadata: current %s", esh_instance.id, current)
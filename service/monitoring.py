@@ -1,26 +1,42 @@
-import random
 import time
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 from django.core.exceptions import ObjectDoesNotExist
 import pytz
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import Count, F, Prefetch, Q
 from django.utils import timezone
 from threepio import logger
 from core.models import AtmosphereUser as User
 from core.models.allocation_strategy import Allocation as CoreAllocation
 from core.models.allocation_strategy import AllocationStrategy as CoreAllocationStrategy
 from core.models.credential import Credential
-from core.models import IdentityMembership, Identity, InstanceStatusHistory
+from core.models import IdentityMembership, Identity, InstanceStatusHistory,\
+    AllocationCheckpoint
 from core.models.instance import Instance as CoreInstance
 from core.models.instance import convert_esh_instance,\
-    _esh_instance_size_to_core
+    _esh_instance_size_to_core, bump_user_instance_changes
 from core.models.size import convert_esh_size
 from allocation.models import Allocation, AllocationResult
-from service.cache import get_cached_instances, get_cached_driver
+from allocation.models import Instance as AllocInstance
+from service.cache import get_cached_driver, release_cached_drivers,\
+    get_cached_allocation, set_cached_allocations,\
+    mark_stale_allocations, pop_stale_allocations,\
+    set_allocation_exhaustion, set_allocations_enforced,\
+    get_enforcement_retries,\
+    update_cached_provider_list, PROVIDER_SNAPSHOT_LISTS
 from service.instance import suspend_instance, stop_instance, destroy_instance, shelve_instance, offload_instance
-from allocation.engine import calculate_allocation
+from allocation.engine import calculate_allocation, get_counting_start
+from allocation.batch import calculate_allocations
 from django.conf import settings
 
+# Enforcement actions (and the API calls around them) run at the same time
+ENFORCEMENT_WORKERS = 8
+# Seconds between polls, and before giving up, while waiting for instances
+# to leave the 'active' state
+ENFORCEMENT_POLL_INTERVAL = 3
+ENFORCEMENT_TIMEOUT = 120
+
 
 # Private
 def _include_all_idents(identities, owner_map):
@@ -61,6 +77,67 @@ def _core_instances_for(identity, start_date=None):
         created_by_identity=identity).distinct()
 
 
+def _load_core_instances(identities, start_date=None):
+    """
+    Bulk version of _core_instances_for, for many identities at once.
+    Instances are loaded with their source and provider. The
+    InstanceStatusHistory (w/ size) that ended after 'start_date'
+    is pre-loaded, in order, as 'instance.allocation_history'.
+
+    Returns a dict of identity.id -> [core Instance]
+    """
+    if not start_date:
+        # Can't use 'None' as a query value
+        start_date = timezone.datetime(1970, 1, 1).replace(tzinfo=pytz.utc)
+    identity_map = dict((identity.id, identity) for identity in identities)
+    recent_history = InstanceStatusHistory.objects.filter(
+        Q(end_date=None) | Q(end_date__gt=start_date)
+    ).select_related('size').order_by('start_date')
+    core_instances = CoreInstance.objects.filter(
+        Q(instancestatushistory__end_date=None) |
+        Q(instancestatushistory__end_date__gt=start_date) |
+        Q(end_date=None) | Q(end_date__gt=start_date),
+        created_by_identity__in=identity_map.keys()
+    ).distinct().select_related(
+        'source__provider',
+        'source__volume',
+        'source__providermachine__application_version__application'
+    ).prefetch_related(
+        Prefetch('instancestatushistory_set', queryset=recent_history,
+                 to_attr='allocation_history'))
+    instance_map = {}
+    for core_instance in core_instances:
+        identity = identity_map[core_instance.created_by_identity_id]
+        # NOTE: May need to remove this created_by line
+        # down-the-road as we share user/tenants.
+        if core_instance.created_by_id != identity.created_by_id:
+            continue
+        instance_map.setdefault(identity.id, []).append(core_instance)
+    return instance_map
+
+
+def _allocation_instances_for(core_instances, start_date=None, sizes=None):
+    """
+    Convert instances from _load_core_instances into allocation Instances,
+    counting only the time after 'start_date'.
+    """
+    if sizes is None:
+        sizes = {}
+    alloc_instances = []
+    for core_instance in core_instances:
+        history_list = core_instance.allocation_history
+        if start_date and core_instance.end_date\
+                and core_instance.end_date <= start_date\
+                and not any(not history.end_date
+                            or history.end_date > start_date
+                            for history in history_list):
+            # Loaded for an identity with an earlier start_date
+            continue
+        alloc_instances.append(AllocInstance.from_core(
+            core_instance, start_date, history_list, sizes))
+    return alloc_instances
+
+
 def _select_identities(provider, users=None):
     if users:
         return provider.identity_set.filter(created_by__username__in=users)
@@ -79,6 +156,57 @@ def _convert_tenant_id_to_names(instances, tenants):
     return instances
 
 
+def _identity_tenants(provider, tenants):
+    """
+    Returns a dict of identity -> tenant (project) id
+    for every identity on the provider.
+    """
+    tenant_ids = {}
+    for tenant in tenants:
+        if type(tenant) == dict:
+            tenant_ids[tenant['name']] = tenant['id']
+        else:
+            tenant_ids[tenant.name] = tenant.id
+    credentials = Credential.objects.filter(
+        identity__provider=provider,
+        key__in=['ex_tenant_name', 'ex_project_name'])\
+        .select_related('identity__created_by')
+    return dict((credential.identity, tenant_ids[credential.value])
+                for credential in credentials
+                if credential.value in tenant_ids)
+
+
+def update_provider_snapshot(provider, kinds=PROVIDER_SNAPSHOT_LISTS,
+                             force=False, tenants=None):
+    """
+    Cache every tenant's instances and volumes, listed once with the
+    admin driver, for the provider and for each of its identities.
+    Lists that are still fresh are skipped, unless force=True.
+    Returns a dict of kind -> list (of the lists that were made)
+    """
+    from service.driver import get_account_driver
+
+    identity_tenants = []
+
+    def identity_tenants_method():
+        # Made once, by the first list that is not skipped
+        if not identity_tenants:
+            provider_tenants = tenants
+            if provider_tenants is None:
+                provider_tenants = get_account_driver(provider)\
+                    .list_projects()
+            identity_tenants.append(
+                _identity_tenants(provider, provider_tenants))
+        return identity_tenants[0]
+    snapshot = {}
+    for kind in kinds:
+        objects = update_cached_provider_list(
+            kind, provider, identity_tenants_method, force=force)
+        if objects is not None:
+            snapshot[kind] = objects
+    return snapshot
+
+
 def _get_identity_from_tenant_name(provider, username):
     try:
         # NOTE: I could see this being a problem when 'user1' and 'user2' use
@@ -102,6 +230,27 @@ def _get_identity_from_tenant_name(provider, username):
     except Credential.DoesNotExist:
         return None
 
+
+def _get_identities_from_tenant_names(provider, usernames):
+    """
+    Batch version of _get_identity_from_tenant_name, in one query.
+    Returns a dict of username -> identity (Users without one are missing)
+    """
+    identities = {}
+    credentials = Credential.objects.filter(
+        key='ex_project_name', value__in=usernames,
+        identity__provider=provider,
+        identity__created_by__username=F('value'))\
+        .select_related('identity__created_by', 'identity__provider')\
+        .order_by('id')
+    for credential in credentials:
+        if credential.value in identities:
+            logger.warn("%s has >1 Credentials on Provider %s"
+                        % (credential.value, provider))
+            continue
+        identities[credential.value] = credential.identity
+    return identities
+
 # Core Monitoring methods
 
 
@@ -134,16 +283,70 @@ def get_allocation_result_for(
 
 
 def user_over_allocation_enforcement(
-        provider, username, print_logs=False, start_date=None, end_date=None):
+        provider, username, print_logs=False, start_date=None, end_date=None,
+        allocation_result=None):
     """
     Begin monitoring 'username' on 'provider'.
     * Calculate allocation from START of month to END of month
+      (Unless the 'allocation_result' has already been calculated)
     * If user is deemed OverAllocation, apply enforce_allocation_policy
     """
     identity = _get_identity_from_tenant_name(provider, username)
-    allocation_result = get_allocation_result_for(
-        provider, username,
-        print_logs, start_date, end_date)
+    allocation_result, user = _check_over_allocation(
+        provider, username, identity, print_logs, start_date, end_date,
+        allocation_result)
+    if user:
+        try:
+            enforce_allocation_policy(identity, user)
+        except Exception:
+            logger.info("Unable to enforce allocation for user: %s" % user)
+        set_allocations_enforced([identity.id], timezone.now())
+    return allocation_result
+
+
+def users_over_allocation_enforcement(
+        provider, usernames, print_logs=False, start_date=None,
+        end_date=None, allocation_results=None):
+    """
+    Batch version of user_over_allocation_enforcement.
+    Every user that is OverAllocation is enforced at the same time.
+    allocation_results - dict of username -> AllocationResult
+    Returns a dict of username -> AllocationResult
+    """
+    if allocation_results is None:
+        allocation_results = {}
+    identities = _get_identities_from_tenant_names(provider, usernames)
+    over_allocation = []
+    for username in usernames:
+        identity = identities.get(username)
+        allocation_result, user = _check_over_allocation(
+            provider, username, identity, print_logs, start_date, end_date,
+            allocation_results.get(username))
+        allocation_results[username] = allocation_result
+        if user:
+            over_allocation.append((identity, user))
+    try:
+        enforce_allocation_policies(over_allocation)
+    except Exception:
+        logger.exception("Unable to enforce allocation for users: %s"
+                         % [over_user for _, over_user in over_allocation])
+    set_allocations_enforced(
+        [identity.id for identity, _ in over_allocation], timezone.now())
+    return allocation_results
+
+
+def _check_over_allocation(provider, username, identity, print_logs=False,
+                           start_date=None, end_date=None,
+                           allocation_result=None):
+    """
+    Returns a 2-tuple: (allocation_result, user)
+    'user' is None unless the allocation of 'identity' (The identity of
+    'username' on 'provider') should be enforced.
+    """
+    if not allocation_result:
+        allocation_result = get_allocation_result_for(
+            provider, username,
+            print_logs, start_date, end_date)
     # ASSERT: allocation_result has been retrieved successfully
     # Make some enforcement decision based on the allocation_result's output.
 
@@ -152,33 +355,30 @@ def user_over_allocation_enforcement(
             "%s has NO identity. "
             "Total Runtime could NOT be calculated. Returning.." %
             (username, ))
-        return allocation_result
-    user = User.objects.get(username=username)
+        return allocation_result, None
+    user = identity.created_by
     allocation = get_allocation(username, identity.uuid)
     if not allocation:
         logger.info(
             "%s has NO allocation. Total Runtime: %s. Returning.." %
             (username, allocation_result.total_runtime()))
-        return allocation_result
+        return allocation_result, None
 
     if not settings.ENFORCING:
         logger.debug('Settings dictate allocations are NOT enforced')
-        return allocation_result
+        return allocation_result, None
 
     # Enforce allocation if overboard.
     over_allocation, diff_amount = allocation_result.total_difference()
-    if over_allocation:
-        logger.info(
-            "%s is OVER allocation. %s - %s = %s"
-            % (username,
-               allocation_result.total_credit(),
-               allocation_result.total_runtime(),
-               diff_amount))
-        try:
-            enforce_allocation_policy(identity, user)
-        except:
-            logger.info("Unable to enforce allocation for user: %s" % user)
-    return allocation_result
+    if not over_allocation:
+        return allocation_result, None
+    logger.info(
+        "%s is OVER allocation. %s - %s = %s"
+        % (username,
+           allocation_result.total_credit(),
+           allocation_result.total_runtime(),
+           diff_amount))
+    return allocation_result, user
 
 
 def enforce_allocation_policy(identity, user):
@@ -190,7 +390,20 @@ def enforce_allocation_policy(identity, user):
     2. Notify the 'ProviderAdministrator' that a user has exceeded
        their allocation, but that NO action has been taken.
     """
-    return provider_over_allocation_enforcement(identity, user)
+    return enforce_allocation_policies([(identity, user)])
+
+
+def enforce_allocation_policies(identity_users):
+    """
+    Batch version of enforce_allocation_policy.
+    identity_users - list of (identity, user)
+    """
+    by_provider = {}
+    for identity, user in identity_users:
+        by_provider.setdefault(identity.provider, []).append((identity, user))
+    for provider, provider_users in by_provider.items():
+        provider_over_allocation_enforcement(provider, provider_users)
+    return True
 
 
 def _execute_provider_action(identity, user, instance, action_name):
@@ -239,49 +452,138 @@ def _execute_provider_action(identity, user, instance, action_name):
         return
 
 
-def provider_over_allocation_enforcement(identity, user):
-    provider = identity.provider
+def provider_over_allocation_enforcement(provider, identity_users):
+    """
+    Apply the provider's 'over_allocation_action' to every active instance
+    of every (identity, user), at the same time.
+    The instances are updated once they leave the 'active' state
+    (See _wait_for_enforcement).
+    """
     action = provider.over_allocation_action
     if not action:
         logger.debug("No 'over_allocation_action' provided for %s" % provider)
         return False
-    driver = get_cached_driver(identity=identity)
-    esh_instances = driver.list_instances()
-    # TODO: Parallelize this operation so you don't wait for larger instances
-    # to finish 'wait_for' task below..
-    for instance in esh_instances:
+
+    def _active_instances(identity_user):
+        identity, user = identity_user
+        try:
+            driver = get_cached_driver(identity=identity)
+            return [(identity, user, instance)
+                    for instance in driver.list_instances()
+                    if driver._is_active_instance(instance)]
+        except Exception:
+            # Enforce every other identity on the provider
+            logger.exception("Unable to list instances of %s for user %s"
+                             % (identity, user))
+            return []
+
+    def _enforce(identity_instance):
+        identity, user, instance = identity_instance
         try:
-            if driver._is_active_instance(instance):
-                # Suspend active instances, update the task in the DB
-                # NOTE: identity.created_by COULD BE the Admin User, indicating that this action/InstanceHistory was
-                #       executed by the administrator.. Future Release Idea.
-                _execute_provider_action(
-                    identity,
-                    identity.created_by,
-                    instance,
-                    action.name)
-                # NOTE: Intentionally added to allow time for
-                #      the Cloud to begin 'suspend' operation
-                #      before querying for the instance again.
-                # TODO: Instead: Add "wait_for" change from active to any
-                # terminal, non-active state?
-                wait_time = random.uniform(2, 6)
-                time.sleep(wait_time)
-                updated_esh = driver.get_instance(instance.id)
-                convert_esh_instance(
-                    driver, updated_esh,
-                    identity.provider.uuid,
-                    identity.uuid,
-                    user)
+            # NOTE: identity.created_by COULD BE the Admin User, indicating
+            #       that this action/InstanceHistory was executed by the
+            #       administrator.. Future Release Idea.
+            _execute_provider_action(
+                identity, identity.created_by, instance, action.name)
         except Exception as e:
-            # Raise ANY exception that doesn't say
+            # Log ANY exception that doesn't say
             # 'This instance is already in the requested VM state'
             # NOTE: This is OpenStack specific
             if 'in vm_state' not in e.message:
-                raise
+                logger.exception("Unable to %s instance %s for user %s"
+                                 % (action.name, instance.id, user))
+                return None
+        return identity_instance
+
+    active_instances = [
+        identity_instance
+        for instance_list in _run_concurrently(_active_instances,
+                                               identity_users)
+        for identity_instance in instance_list]
+    enforced = [identity_instance
+                for identity_instance in _run_concurrently(_enforce,
+                                                           active_instances)
+                if identity_instance]
+    _wait_for_enforcement(provider, enforced)
     return True  # User was over_allocation
 
 
+def _run_concurrently(method, items, workers=ENFORCEMENT_WORKERS):
+    """
+    Call 'method' on every item with a bounded pool of threads.
+    Returns the results, in the same order as 'items'.
+    """
+    if len(items) <= 1:
+        return [method(item) for item in items]
+
+    def _call(item):
+        try:
+            return method(item)
+        finally:
+            # Each thread has its own database connection (and drivers).
+            connection.close()
+            release_cached_drivers()
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(_call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _wait_for_enforcement(provider, enforced):
+    """
+    Update the enforced instances once they have left the 'active' state.
+    The update_enforced_instances task polls every instance on the provider
+    (one call per round), so enforcement does not wait for the cloud.
+    enforced - list of (identity, user, esh_instance)
+    """
+    if not enforced:
+        return
+    from service.tasks.monitoring import update_enforced_instances
+    update_enforced_instances.apply_async(
+        args=[provider.id,
+              [(identity.id, instance.id)
+               for identity, user, instance in enforced],
+              time.time() + ENFORCEMENT_TIMEOUT],
+        # Give the Cloud time to begin the action before querying.
+        countdown=ENFORCEMENT_POLL_INTERVAL)
+
+
+def update_enforced_instances(provider, waiting):
+    """
+    Poll every instance on the provider once, then update the enforced
+    instances that have left the 'active' state in the database.
+    Instances that are no longer listed (Ex: 'Terminate') are dropped.
+    waiting - list of (identity.id, instance id)
+    Returns the (identity.id, instance id) that are still active.
+    """
+    admin_driver = get_cached_driver(provider=provider)
+    listed = dict((esh_instance.id, esh_instance)
+                  for esh_instance in admin_driver.list_all_instances())
+    identities = dict(
+        (identity.id, identity) for identity in Identity.objects.filter(
+            id__in=[identity_id for identity_id, _ in waiting])
+        .select_related('created_by', 'provider'))
+    still_active = []
+    for identity_id, instance_id in waiting:
+        esh_instance = listed.get(instance_id)
+        identity = identities.get(identity_id)
+        if not esh_instance or not identity:
+            continue
+        if admin_driver._is_active_instance(esh_instance):
+            still_active.append((identity_id, instance_id))
+            continue
+        try:
+            convert_esh_instance(
+                get_cached_driver(identity=identity), esh_instance,
+                identity.provider.uuid, identity.uuid, identity.created_by)
+        except Exception:
+            logger.exception("Unable to update instance %s for user %s"
+                             % (instance_id, identity.created_by))
+    return still_active
+
+
 def update_instances(driver, identity, esh_list, core_list):
     """
     End-date core instances that don't show up in esh_list
@@ -319,48 +621,84 @@ def _cleanup_missing_instances(
 
     core_running_instances - Reference list of KNOWN active instances
     """
-    instances = []
-
     if not identity:
-        return instances
-
-    core_instances = _core_instances_for(identity, start_date)
-    fixed_instances = []
-    for inst in core_instances:
-        if not core_running_instances or inst not in core_running_instances:
-            inst.end_date_all()
-            fixed_instances.append(inst)
-        else:
-            # Instance IS in the list of running instances.. Further cleaning
-            # can be done at this level.
-            non_end_dated_history = inst.instancestatushistory_set.filter(
-                end_date=None)
-            count = len(non_end_dated_history)
-            if count > 1:
-                history_names = [ish.status.name for ish
-                                 in non_end_dated_history]
-                # Note: We have the 'wrong' instance, we want the one that
-                # includes the ESH driver
-                core_running_inst = [i for i in core_running_instances
-                                     if i == inst][0]
-                new_history = _resolve_history_conflict(
-                    identity, core_running_inst, non_end_dated_history)
-                fixed_instances.append(inst)
-                logger.warn(
-                    "Instance %s contained %s "
-                    "NON END DATED history:%s. "
-                    " New History: %s" %
-                    (inst.provider_alias,
-                     count, history_names, new_history))
-        # Gather the updated values..
-        instances.append(inst)
-    # Return the updated list
-    if fixed_instances:
+        return []
+
+    instances = list(_core_instances_for(identity, start_date))
+    running_instances = dict((inst.id, inst)
+                             for inst in core_running_instances or [])
+    missing_ids = [inst.id for inst in instances
+                   if inst.id not in running_instances]
+    fixed_count = 0
+    if missing_ids:
+        fixed_count += _end_date_instances(identity, instances, missing_ids)
+    # Instance IS in the list of running instances.. Further cleaning
+    # can be done at this level.
+    conflict_ids = [row['instance'] for row in
+                    InstanceStatusHistory.objects.filter(
+                        instance__in=[inst.id for inst in instances
+                                      if inst.id in running_instances],
+                        end_date=None)
+                    .values('instance').annotate(open_count=Count('id'))
+                    .filter(open_count__gt=1)]
+    if conflict_ids:
+        non_end_dated = {}
+        for history in InstanceStatusHistory.objects.filter(
+                instance__in=conflict_ids, end_date=None):
+            non_end_dated.setdefault(history.instance_id, []).append(history)
+        for instance_id, non_end_dated_history in non_end_dated.items():
+            # Note: We want the instance that includes the ESH driver
+            core_running_inst = running_instances[instance_id]
+            history_names = [ish.status_name for ish
+                             in non_end_dated_history]
+            new_history = _resolve_history_conflict(
+                identity, core_running_inst, non_end_dated_history)
+            fixed_count += 1
+            logger.warn(
+                "Instance %s contained %s "
+                "NON END DATED history:%s. "
+                " New History: %s" %
+                (core_running_inst.provider_alias,
+                 len(non_end_dated_history), history_names, new_history))
+    if fixed_count:
         logger.warn("Cleaned up %s instances for %s"
-                    % (len(fixed_instances), identity.created_by.username))
+                    % (fixed_count, identity.created_by.username))
     return instances
 
 
+def _end_date_instances(identity, instances, instance_ids, end_date=None):
+    """
+    Instance.end_date_all for many instances of 'identity' at once.
+    Returns the number of instances that were end-dated.
+    """
+    if not end_date:
+        end_date = timezone.now()
+    with transaction.atomic():
+        history_count = InstanceStatusHistory.objects.filter(
+            instance__in=instance_ids, end_date=None)\
+            .update(end_date=end_date)
+        ended_ids = set(CoreInstance.objects.filter(
+            id__in=instance_ids, end_date=None)
+            .values_list('id', flat=True))
+        CoreInstance.objects.filter(id__in=ended_ids)\
+            .update(end_date=end_date)
+        if history_count:
+            AllocationCheckpoint.invalidate_since(
+                end_date, identity_ids=[identity.id])
+    for inst in instances:
+        if inst.id in ended_ids:
+            inst.end_date = end_date
+    if history_count or ended_ids:
+        logger.info("END DATING %s instances and %s histories: %s"
+                    % (len(ended_ids), history_count, end_date))
+        # Signals are not sent by update()
+        invalidate_allocation_snapshots([identity.id])
+        bump_user_instance_changes(
+            inst.created_by_id for inst in instances
+            if inst.id in instance_ids)
+    return len(ended_ids)
+
+
 def _resolve_history_conflict(
         identity, core_running_instance,
         bad_history, reset_time=None):
@@ -384,13 +722,17 @@ def _resolve_history_conflict(
         esh_driver, esh_instance, identity.provider.uuid)
     if not reset_time:
         reset_time = timezone.now()
-    for history in bad_history:
-        history.end_date = reset_time
-        history.save()
-    new_history = InstanceStatusHistory.create_history(
-        new_status,
-        core_running_instance, new_size,
-        reset_time)
+    with transaction.atomic():
+        for history in bad_history:
+            history.end_date = reset_time
+            history.save()
+        new_history = InstanceStatusHistory.create_history(
+            new_status,
+            core_running_instance, new_size,
+            reset_time)
+        new_history.save()
+        core_running_instance.set_last_history(
+            new_history, esh_instance.extra.get('task'))
     return new_history
 
 
@@ -403,12 +745,13 @@ def _get_instance_owner_map(provider, users=None):
     """
     from service.driver import get_account_driver
 
-    admin_driver = get_cached_driver(provider=provider)
     accounts = get_account_driver(provider=provider)
     all_identities = _select_identities(provider, users)
-    all_instances = get_cached_instances(provider=provider)
-    #all_tenants = admin_driver._connection._keystone_list_tenants()
     all_tenants = accounts.list_projects()
+    # The identities read their instances from the same listing
+    all_instances = update_provider_snapshot(
+        provider, kinds=["instances"], force=True,
+        tenants=all_tenants)["instances"]
     # Convert instance.owner from tenant-id to tenant-name all at once
     all_instances = _convert_tenant_id_to_names(all_instances, all_tenants)
     # Make a mapping of owner-to-instance
@@ -430,8 +773,98 @@ def check_over_allocation(username, identity_uuid,
     Amount - Time (amount) Over/Under Allocation.
     """
     identity = Identity.objects.get(uuid=identity_uuid)
-    allocation_result = _get_allocation_result(identity)
-    return allocation_result.total_difference()
+    snapshot = get_allocation_snapshot(identity)
+    return snapshot["over_allocation"], snapshot["difference"]
+
+
+def allocation_snapshot(allocation_result):
+    """
+    The parts of an AllocationResult needed to check (or show)
+    an identity's allocation. Snapshots are cached by identity.
+    """
+    over_allocation, difference = allocation_result.total_difference()
+    return {
+        "over_allocation": over_allocation,
+        "difference": difference,
+        "credit": allocation_result.total_credit(),
+        "runtime": allocation_result.total_runtime(),
+        "burn_rate": allocation_result.get_burn_rate(),
+        "time_to_zero": allocation_result.time_to_zero(),
+        "calculated": timezone.now(),
+        # Time is counted up to the end of the window
+        "counted_until": allocation_result.window_end,
+    }
+
+
+def project_allocation_snapshot(snapshot, now=None):
+    """
+    Instances keep using time at the burn rate after the time counted by
+    the snapshot. Returns the snapshot with that time used as of 'now'.
+    """
+    if not now:
+        now = timezone.now()
+    counted_until = max(snapshot["calculated"],
+                        snapshot.get("counted_until") or
+                        snapshot["calculated"])
+    if now <= counted_until or snapshot["burn_rate"] == timedelta(0):
+        return snapshot
+    used = timedelta(seconds=snapshot["burn_rate"].total_seconds() *
+                     (now - counted_until).total_seconds())
+    remaining = snapshot["difference"]
+    if snapshot["over_allocation"]:
+        remaining = -remaining
+    remaining -= used
+    projected = dict(snapshot)
+    projected.update({
+        "over_allocation": remaining <= timedelta(0),
+        "difference": abs(remaining),
+        "runtime": snapshot["runtime"] + used,
+    })
+    return projected
+
+
+def get_allocation_snapshot(identity):
+    """
+    Return the cached allocation snapshot of an identity, projected to now.
+    Stale snapshots are returned until update_stale_allocation_snapshots
+    re-calculates them, the snapshot is only calculated here when the
+    identity has never had one.
+    """
+    snapshot = get_cached_allocation(identity.id)
+    if not snapshot:
+        snapshot = allocation_snapshot(_get_allocation_result(identity))
+    return project_allocation_snapshot(snapshot)
+
+
+def invalidate_allocation_snapshots(identity_ids=(), instance_ids=()):
+    """
+    Call when the instance history or allocation of an identity changes.
+    New snapshots are calculated in the background, once for every change
+    queued in the meantime.
+    """
+    mark_stale_allocations(identity_ids, instance_ids)
+
+
+def update_stale_allocation_snapshots():
+    """
+    Re-calculate the snapshots queued by invalidate_allocation_snapshots.
+    """
+    identity_ids, instance_ids = pop_stale_allocations()
+    identity_ids = set(identity_ids)
+    if instance_ids:
+        identity_ids.update(CoreInstance.objects.filter(
+            id__in=instance_ids, created_by_identity__isnull=False)
+            .values_list('created_by_identity_id', flat=True))
+    if not identity_ids:
+        return
+    identities = Identity.objects.filter(id__in=identity_ids)\
+        .select_related('created_by', 'provider')
+    try:
+        _get_allocation_results(list(identities))
+    except Exception:
+        # Try again on the next run
+        mark_stale_allocations(identity_ids)
+        raise
 
 
 def get_allocation(username, identity_uuid):
@@ -482,27 +915,214 @@ def _empty_allocation_result():
 
 
 def _get_allocation_result(identity, start_date=None, end_date=None,
-                           print_logs=False):
+                           print_logs=False, persist=True):
     """
     Given an identity, retrieve the provider strategy and apply the strategy
     to this identity.
+    persist - Save checkpoints and cache (and queue for enforcement) the
+              snapshot. Use persist=False for reports.
     """
 
     if not identity:
         return _empty_allocation_result()
-    username = identity.created_by.username
-    core_allocation = get_allocation(username, identity.uuid)
-    if not core_allocation:
-        logger.warn("User:%s Identity:%s does not have an allocation assigned"
-                    % (username, identity))
-    allocation_input = apply_strategy(identity, core_allocation)
+    last_history_id = _last_history_id()
+    as_of = timezone.now()
+    allocation_input = _get_allocation_inputs([identity])[0]
     allocation_result = calculate_allocation(
         allocation_input,
         print_logs=print_logs)
+    if persist:
+        _save_checkpoints([identity], [allocation_input],
+                          [allocation_result], last_history_id, as_of)
+        _cache_allocation_results([identity], [allocation_result])
     return allocation_result
 
 
-def apply_strategy(identity, core_allocation):
+def _get_allocation_results(identities, print_logs=False, persist=True):
+    """
+    Batch version of _get_allocation_result.
+    Apply the provider strategy to every identity, then calculate
+    all the results at once.
+    Returns a dict of identity -> AllocationResult
+    """
+    last_history_id = _last_history_id()
+    # The histories loaded are counted up to now (See _save_checkpoints)
+    as_of = timezone.now()
+    allocation_inputs = _get_allocation_inputs(identities)
+    allocation_results = calculate_allocations(
+        allocation_inputs,
+        print_logs=print_logs)
+    if persist:
+        _save_checkpoints(identities, allocation_inputs, allocation_results,
+                          last_history_id, as_of)
+        _cache_allocation_results(identities, allocation_results)
+    return dict(zip(identities, allocation_results))
+
+
+def _cache_allocation_results(identities, allocation_results):
+    """
+    Cache the allocation snapshot of every identity, and (when enforcing)
+    queue the date each identity is projected to run out of allocation.
+    See: service.tasks.monitoring.enforce_exhausted_allocations
+    """
+    snapshots = dict(
+        (identity.id, allocation_snapshot(allocation_result))
+        for identity, allocation_result
+        in zip(identities, allocation_results))
+    set_cached_allocations(snapshots)
+    if settings.ENFORCING:
+        retries = get_enforcement_retries(snapshots.keys())
+        set_allocation_exhaustion(dict(
+            (identity_id, _exhaustion_date(snapshot, retries.get(identity_id)))
+            for identity_id, snapshot in snapshots.items()))
+
+
+def _exhaustion_date(snapshot, enforcement_retry=None):
+    """
+    The date an identity is projected to run out of allocation,
+    or None if it is not burning any time (or has no limit).
+    enforcement_retry - The date a recently enforced allocation is enforced
+                        again (See set_allocations_enforced)
+    """
+    if snapshot["burn_rate"] == timedelta(0):
+        return None
+    if snapshot["over_allocation"]:
+        # Still burning time, enforce as soon as possible
+        # (unless it was just enforced)
+        return enforcement_retry or snapshot["calculated"]
+    time_to_zero = snapshot["time_to_zero"]
+    if time_to_zero.year == timezone.datetime.max.year:
+        # 'Infinite' allocation
+        return None
+    return time_to_zero
+
+
+def _get_allocation_inputs(identities):
+    """
+    Apply the provider strategy to every identity.
+    Checkpoints and instances are loaded for every identity at once,
+    only the InstanceHistory after the checkpoints is loaded.
+    Returns a list of 'AllocationInput', in the same order as identities.
+    """
+    allocation_inputs = []
+    for identity in identities:
+        username = identity.created_by.username
+        core_allocation = get_allocation(username, identity.uuid)
+        if not core_allocation:
+            logger.warn("User:%s Identity:%s does not have an allocation "
+                        "assigned" % (username, identity))
+        # Instances are loaded below, for every identity at once.
+        allocation_inputs.append(
+            apply_strategy(identity, core_allocation, instances=[]))
+    # NOTE: Identities without a strategy have no start_date and no instances
+    counted = [(identity.id, allocation_input)
+               for identity, allocation_input
+               in zip(identities, allocation_inputs)
+               if allocation_input.start_date]
+    _load_checkpoints([identity_id for identity_id, _ in counted],
+                      [allocation_input for _, allocation_input in counted])
+    counting_starts = dict(
+        (identity_id, get_counting_start(allocation_input))
+        for identity_id, allocation_input in counted)
+    if counting_starts:
+        instance_map = _load_core_instances(identities,
+                                            min(counting_starts.values()))
+        sizes = {}
+        for identity, allocation_input in zip(identities, allocation_inputs):
+            if identity.id not in counting_starts:
+                continue
+            allocation_input.instances = _allocation_instances_for(
+                instance_map.get(identity.id, []),
+                counting_starts[identity.id], sizes)
+    return allocation_inputs
+
+
+def _last_history_id():
+    """
+    Any InstanceStatusHistory created after this ID is 'new' to
+    the checkpoints that will be created.
+    """
+    last_history = InstanceStatusHistory.objects.order_by('-id')\
+        .values_list('id', flat=True)[:1]
+    return last_history[0] if last_history else 0
+
+
+def _load_checkpoints(identity_ids, allocation_inputs):
+    """
+    Give every allocation input the checkpoints that were created with
+    the same allocation signature.
+    If InstanceStatusHistory that starts before a checkpoint was created
+    after it, the checkpoints of that identity are no longer valid.
+    """
+    signatures = dict((identity_id, allocation_input.signature())
+                      for identity_id, allocation_input
+                      in zip(identity_ids, allocation_inputs))
+    checkpoint_map = {}
+    for checkpoint in AllocationCheckpoint.objects.filter(
+            identity__in=signatures.keys()):
+        if checkpoint.signature != signatures[checkpoint.identity_id]:
+            continue
+        checkpoint_map.setdefault(checkpoint.identity_id, [])\
+            .append(checkpoint)
+    if checkpoint_map:
+        oldest_history_id = min(
+            checkpoint.last_history_id
+            for checkpoints in checkpoint_map.values()
+            for checkpoint in checkpoints)
+        late_history = InstanceStatusHistory.objects.filter(
+            id__gt=oldest_history_id,
+            instance__created_by_identity__in=checkpoint_map.keys()
+        ).values_list('instance__created_by_identity', 'id', 'start_date')
+        for identity_id, history_id, start_date in late_history:
+            if any(history_id > checkpoint.last_history_id
+                   and start_date < checkpoint.as_of
+                   for checkpoint in checkpoint_map.get(identity_id, [])):
+                logger.info("Identity:%s has late InstanceStatusHistory:%s. "
+                            "Checkpoints will be re-calculated."
+                            % (identity_id, history_id))
+                del checkpoint_map[identity_id]
+    for identity_id, allocation_input in zip(identity_ids, allocation_inputs):
+        allocation_input.checkpoints = [
+            checkpoint.to_checkpoint()
+            for checkpoint in checkpoint_map.get(identity_id, [])]
+
+
+def _save_checkpoints(identities, allocation_inputs, allocation_results,
+                      last_history_id, as_of):
+    """
+    Replace the checkpoints of every identity whose result
+    closed a new time period, or counted the open one further.
+    """
+    updated_identities, new_checkpoints = [], []
+    for identity, allocation_input, allocation_result in zip(
+            identities, allocation_inputs, allocation_results):
+        if not allocation_input.start_date:
+            continue
+        checkpoints = allocation_result.create_checkpoints(as_of)
+        if set((checkpoint.start_date, checkpoint.as_of)
+               for checkpoint in checkpoints) ==\
+                set((checkpoint.start_date, checkpoint.as_of)
+                    for checkpoint in allocation_input.checkpoints):
+            continue
+        updated_identities.append(identity)
+        signature = allocation_input.signature()
+        for checkpoint in checkpoints:
+            new_checkpoints.append(AllocationCheckpoint(
+                identity=identity,
+                signature=signature,
+                start_date=checkpoint.start_date,
+                as_of=checkpoint.as_of,
+                runtime=checkpoint.runtime,
+                burn_rate=checkpoint.burn_rate,
+                last_history_id=last_history_id))
+    if not updated_identities:
+        return
+    AllocationCheckpoint.objects.filter(
+        identity__in=updated_identities).delete()
+    AllocationCheckpoint.objects.bulk_create(new_checkpoints)
+
+
+def apply_strategy(identity, core_allocation, instances=None):
     """
     Given identity and core allocation, grab the ProviderStrategy
     and apply it. Returns an "AllocationInput"
@@ -511,7 +1131,7 @@ def apply_strategy(identity, core_allocation):
     if not strategy:
         return Allocation(credits=[], rules=[], instances=[],
                           start_date=None, end_date=None, interval_delta=None)
-    return strategy.apply(identity, core_allocation)
+    return strategy.apply(identity, core_allocation, instances)
 
 
 def _get_strategy(identity):
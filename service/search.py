@@ -3,17 +3,46 @@ Provide pluggable machine search for Atmosphere.
 
 """
 from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+from itertools import izip
 import operator
+import re
+import time
 
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, FloatField
+from django.utils.html import escape
+
+from threepio import logger
 
 from core.models.machine import compare_core_machines, filter_core_machine,\
     ProviderMachine
 from core.models.provider import Provider
 from core.models.application import Application
+from core.models.application_version import ApplicationVersion
 from core.query import only_current_source
 from functools import reduce
 
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Rank of a term in each indexed field of an image
+FIELD_WEIGHTS = {
+    "id": 8,
+    "name": 8,
+    "tag": 4,
+    "created_by": 2,
+    "tag_description": 1,
+    "change_log": 1,
+}
+# Rank of a term that only starts with (or contains) a word of the query
+PREFIX_WEIGHT = 0.5
+SUBSTRING_WEIGHT = 0.25
+# Only the best ranked (visible) images are returned
+SEARCH_RESULT_LIMIT = 1000
+HIGHLIGHT_LENGTH = 200
+# Without redis, the index of each process is rebuilt this often
+IMAGE_INDEX_TIMEOUT = 10 * 60
+# (expires, version, sorted terms, {app_id: rank} of each term)
+image_index = [(0, None, [], [])]
+
 
 def search(providers, identity, query):
     return reduce(operator.or_, [p.search(identity, query) for p in providers])
@@ -93,3 +122,168 @@ class CoreApplicationSearch(BaseSearchProvider):
             | Q(description__icontains=query),
             *only_current_source())
         return query_match.distinct()
+
+
+def tokenize(text):
+    """
+    Returns the (lower case) words of 'text'.
+    """
+    if not text:
+        return []
+    return WORD_RE.findall(text.lower())
+
+
+def build_image_index():
+    """
+    Returns (terms, postings) for every image in the catalog:
+    the sorted list of terms, and the {app_id: rank} of each term.
+    """
+    texts = defaultdict(lambda: defaultdict(list))
+    for app_id, name, username in Application.objects.values_list(
+            'id', 'name', 'created_by__username'):
+        texts[app_id]["id"].append(str(app_id))
+        texts[app_id]["name"].append(name)
+        texts[app_id]["created_by"].append(username)
+    for app_id, change_log in ApplicationVersion.objects.values_list(
+            'application_id', 'change_log'):
+        texts[app_id]["change_log"].append(change_log)
+    for app_id, tag, description in Application.tags.through.objects\
+            .values_list('application_id', 'tag__name', 'tag__description'):
+        texts[app_id]["tag"].append(tag)
+        texts[app_id]["tag_description"].append(description)
+    ranks = defaultdict(lambda: defaultdict(int))
+    for app_id, fields in texts.items():
+        for field, values in fields.items():
+            # A term counts once per field
+            for term in set(tokenize(" ".join(v for v in values if v))):
+                ranks[term][app_id] += FIELD_WEIGHTS[field]
+    terms = sorted(ranks)
+    return terms, [dict(ranks[term]) for term in terms]
+
+
+def get_image_index():
+    """
+    Returns (terms, postings) of the image index.
+    The index is built by the update_image_index task and shared in redis,
+    each process keeps the last one it loaded. When images changed since,
+    the (slightly stale) index is used while the task rebuilds it.
+    """
+    from service.cache import get_cached_image_index, set_cached_image_index
+    expires, loaded_version, terms, postings = image_index[0]
+    version, stored_version, data = get_cached_image_index(loaded_version)
+    if data is not None:
+        loaded_version, (terms, postings) = stored_version, data
+    elif not expires or (version is None and expires < time.time()):
+        # Never built (or redis is unavailable)
+        terms, postings = build_image_index()
+        loaded_version = version
+        set_cached_image_index(version, (terms, postings))
+    image_index[0] = (time.time() + IMAGE_INDEX_TIMEOUT, loaded_version,
+                      terms, postings)
+    if version is not None and version != loaded_version:
+        schedule_image_index_update()
+    return terms, postings
+
+
+def schedule_image_index_update():
+    from service.cache import lock_image_index
+    from service.tasks.monitoring import update_image_index
+    if lock_image_index():
+        update_image_index.apply_async()
+
+
+def rebuild_image_index():
+    """
+    Build the image index and share it in redis.
+    (See the update_image_index task)
+    """
+    from service.cache import get_images_version, set_cached_image_index
+    version = get_images_version()
+    start = time.time()
+    terms, postings = build_image_index()
+    set_cached_image_index(version, (terms, postings))
+    logger.info("Indexed %d terms of the image catalog in %.2fs"
+                % (len(terms), time.time() - start))
+
+
+def search_images(query):
+    """
+    Returns {app_id: rank} of the images matching every word in 'query',
+    as a word, the beginning of a word or a part of a word.
+    """
+    words = tokenize(query)
+    if not words:
+        return {}
+    terms, postings = get_image_index()
+    matches = None
+    for word in set(words):
+        word_ranks = {}
+        for term, term_ranks in izip(terms, postings):
+            if word not in term:
+                continue
+            if term == word:
+                weight = 1
+            elif term.startswith(word):
+                weight = PREFIX_WEIGHT
+            else:
+                weight = SUBSTRING_WEIGHT
+            for app_id, rank in term_ranks.iteritems():
+                if rank * weight > word_ranks.get(app_id, 0):
+                    word_ranks[app_id] = rank * weight
+        if matches is None:
+            matches = word_ranks
+        else:
+            matches = dict((app_id, rank + word_ranks[app_id])
+                           for app_id, rank in matches.iteritems()
+                           if app_id in word_ranks)
+        if not matches:
+            return {}
+    return matches
+
+
+def order_by_rank(queryset, ranks):
+    """
+    Filter 'queryset' (of Applications) to 'ranks', best ranked first.
+    Only the first SEARCH_RESULT_LIMIT images are kept.
+    """
+    if not ranks:
+        return queryset.none()
+    app_ids = defaultdict(list)
+    for app_id, rank in ranks.iteritems():
+        app_ids[rank].append(app_id)
+    search_rank = Case(*[When(id__in=ids, then=Value(rank))
+                         for rank, ids in app_ids.iteritems()],
+                       default=Value(0), output_field=FloatField())
+    return queryset.filter(id__in=ranks.keys())\
+        .annotate(search_rank=search_rank)\
+        .order_by('-search_rank', '-start_date', '-id')[:SEARCH_RESULT_LIMIT]
+
+
+def highlight(text, query, length=HIGHLIGHT_LENGTH):
+    """
+    Returns 'text' (escaped) with the words that contain a word in
+    'query' wrapped in <em>, cut to 'length' characters around the first
+    of them. (None if no word matches)
+    """
+    words = set(tokenize(query))
+    if not text or not words:
+        return None
+    matches = [match for match in WORD_RE.finditer(text)
+               if any(word in match.group().lower() for word in words)]
+    if not matches:
+        return None
+    start = max(0, min(matches[0].start() - length / 4,
+                       len(text) - length))
+    end = start + length
+    parts = ["..." if start else ""]
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(escape(text[position:match.start()]))
+        parts.append("<em>%s</em>" % escape(match.group()))
+        position = match.end()
+    parts.append(escape(text[position:end]))
+    if end < len(text):
+        parts.append("...")
+    return "".join(parts)
@@ -1,3 +1,4 @@
+import time
 from datetime import timedelta
 
 from django.utils import timezone
@@ -6,20 +7,26 @@ from django.db.models import Q
 from celery.decorators import task
 
 from core.query import only_current, only_current_machines, only_current_apps, only_current_source, source_in_range
-from core.models.size import Size, convert_esh_size
-from core.models.instance import convert_esh_instance
+from core.models.size import Size, convert_esh_size, get_size_catalog
+from core.models.instance import convert_esh_instances
 from core.models.provider import Provider
 from core.models.machine import get_or_create_provider_machine, ProviderMachine
 from core.models.application import Application, ApplicationMembership
-from core.models import Allocation, Credential
+from core.models import Allocation, Credential, Identity
 
 from service.monitoring import\
     _cleanup_missing_instances,\
+    _get_allocation_results,\
     _get_instance_owner_map, \
     _get_identity_from_tenant_name
-from service.monitoring import user_over_allocation_enforcement
+from service.monitoring import user_over_allocation_enforcement,\
+    users_over_allocation_enforcement, update_provider_snapshot
+from service import monitoring
 from service.driver import get_account_driver
-from service.cache import get_cached_driver
+from service.cache import get_cached_driver, pop_exhausted_allocations,\
+    update_cached_list, is_cached_list_fresh, PROVIDER_SNAPSHOT_LISTS,\
+    unlock_image_index
+from service.search import rebuild_image_index
 from glanceclient.exc import HTTPNotFound
 
 from threepio import logger
@@ -453,19 +460,20 @@ def monitor_instances_for(provider_id, users=None,
 
     # DEVNOTE: Potential slowdown running multiple functions
     # Break this out when instance-caching is enabled
+    identity_map = {}
     for username in sorted(instance_map.keys()):
         running_instances = instance_map[username]
         identity = _get_identity_from_tenant_name(provider, username)
+        identity_map[username] = identity
         if identity and running_instances:
             try:
                 driver = get_cached_driver(identity=identity)
-                core_running_instances = [
-                    convert_esh_instance(
-                        driver,
-                        inst,
-                        identity.provider.uuid,
-                        identity.uuid,
-                        identity.created_by) for inst in running_instances]
+                core_running_instances = convert_esh_instances(
+                    driver,
+                    running_instances,
+                    identity.provider.uuid,
+                    identity.uuid,
+                    identity.created_by)
             except Exception as exc:
                 logger.exception(
                     "Could not convert running instances for %s" %
@@ -478,13 +486,128 @@ def monitor_instances_for(provider_id, users=None,
         core_instances = _cleanup_missing_instances(
             identity,
             core_running_instances)
-        allocation_result = user_over_allocation_enforcement(
-            provider, username,
-            print_logs, start_date, end_date)
+    # Calculate every allocation on the provider at once,
+    # then enforce every user that is over allocation at once.
+    identities = [ident for ident in identity_map.values() if ident]
+    allocation_results = _get_allocation_results(
+        identities, print_logs=print_logs)
+    users_over_allocation_enforcement(
+        provider, sorted(identity_map.keys()),
+        print_logs, start_date, end_date,
+        allocation_results=dict(
+            (username, allocation_results.get(identity))
+            for username, identity in identity_map.items()))
     if print_logs:
         logger.removeHandler(consolehandler)
 
 
+@task(name="refresh_cached_list")
+def refresh_cached_list(kind, provider_id=None, identity_id=None):
+    """
+    Refresh a stale list of instances, volumes or machines in redis.
+    """
+    provider = Provider.objects.get(id=provider_id) if provider_id else None
+    identity = Identity.objects.get(id=identity_id) if identity_id else None
+    snapshot_provider = provider or identity.provider
+    if kind in PROVIDER_SNAPSHOT_LISTS\
+            and 'openstack' in snapshot_provider.type.name.lower():
+        # Refresh every identity on the provider with one admin listing
+        update_provider_snapshot(snapshot_provider, kinds=[kind],
+                                 force=bool(provider))
+        if is_cached_list_fresh(kind, provider=provider, identity=identity):
+            return
+    update_cached_list(kind, provider=provider, identity=identity)
+
+
+@task(name="update_provider_snapshots")
+def update_provider_snapshots():
+    """
+    Cache the instances and volumes of every identity on each active
+    (OpenStack) provider, listed once per provider.
+    """
+    for p in Provider.get_active(type_name="openstack"):
+        update_provider_snapshot_for.apply_async(args=[p.id])
+
+
+@task(name="update_provider_snapshot_for")
+def update_provider_snapshot_for(provider_id):
+    provider = Provider.objects.get(id=provider_id)
+    update_provider_snapshot(provider)
+
+
+@task(name="update_image_index")
+def update_image_index():
+    """
+    Rebuild the image search index, scheduled (once at a time) when the
+    images have changed since it was built. (See service.search)
+    """
+    try:
+        rebuild_image_index()
+    finally:
+        unlock_image_index()
+
+
+@task(name="update_enforced_instances")
+def update_enforced_instances(provider_id, waiting, deadline):
+    """
+    Follow up on over-allocation enforcement, once per poll interval,
+    until the instances have left the 'active' state or 'deadline'
+    (epoch seconds) has passed. (See service.monitoring)
+    waiting - list of (identity.id, instance id)
+    """
+    provider = Provider.objects.get(id=provider_id)
+    waiting = monitoring.update_enforced_instances(provider, waiting)
+    if not waiting:
+        return
+    if time.time() > deadline:
+        logger.warn("Instances %s are still active after %ss"
+                    % ([instance_id for _, instance_id in waiting],
+                       monitoring.ENFORCEMENT_TIMEOUT))
+        return
+    update_enforced_instances.apply_async(
+        args=[provider_id, waiting, deadline],
+        countdown=monitoring.ENFORCEMENT_POLL_INTERVAL)
+
+
+@task(name="update_stale_allocation_snapshots")
+def update_stale_allocation_snapshots():
+    """
+    Re-calculate (and cache) every allocation snapshot invalidated since
+    the last run, all at once.
+    """
+    monitoring.update_stale_allocation_snapshots()
+
+
+@task(name="enforce_exhausted_allocations")
+def enforce_exhausted_allocations():
+    """
+    Enforce the allocation of every identity that is projected to run out
+    of allocation by now. Projections are queued whenever an allocation
+    is calculated, and replaced when the instance history changes.
+    """
+    for identity_id in pop_exhausted_allocations(timezone.now()):
+        enforce_allocation_for.apply_async(args=[identity_id])
+
+
+@task(name="enforce_allocation_for")
+def enforce_allocation_for(identity_id):
+    """
+    Re-calculate the allocation of a single identity and enforce it.
+    If the identity is not out of allocation yet, a new projection is queued.
+    """
+    try:
+        identity = Identity.objects.select_related('created_by', 'provider')\
+            .get(id=identity_id)
+    except Identity.DoesNotExist:
+        logger.info("Identity %s was deleted. Allocation not enforced."
+                    % identity_id)
+        return
+    allocation_results = _get_allocation_results([identity])
+    user_over_allocation_enforcement(
+        identity.provider, identity.created_by.username,
+        allocation_result=allocation_results[identity])
+
+
 @task(name="monitor_sizes")
 def monitor_sizes():
     """
@@ -527,6 +650,8 @@ def monitor_sizes_for(provider_id, print_logs=False):
         logger.debug("End dating inactive size: %s" % size)
         size.end_date = now_time
         size.save()
+    # Every process reads the current catalog from redis
+    get_size_catalog(provider.uuid, force=True)
 
     if print_logs:
         logger.removeHandler(consolehandler)
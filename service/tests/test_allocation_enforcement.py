@@ -0,0 +1,245 @@
+"""
+test the enforcement of identities running out of allocation
+"""
+from datetime import timedelta
+
+import mock
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests import FakeRedis
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models.credential import Credential
+from service import monitoring
+from service.cache import get_enforcement_retries,\
+    pop_exhausted_allocations, set_allocations_enforced,\
+    ALLOCATION_ENFORCE_RETRY
+from service.tasks.monitoring import enforce_allocation_for
+from service.tests.test_allocation_snapshots import _snapshot
+
+
+class ExhaustionDateTests(TestCase):
+
+    def test_idle_identity_is_not_queued(self):
+        self.assertIsNone(monitoring._exhaustion_date(
+            _snapshot(timedelta(hours=1))))
+
+    def test_burning_identity_is_queued_when_it_runs_out(self):
+        snapshot = _snapshot(timedelta(hours=1), burn_rate=timedelta(
+            seconds=1))
+        self.assertEquals(monitoring._exhaustion_date(snapshot),
+                          snapshot["time_to_zero"])
+
+    def test_over_allocation_is_enforced_now(self):
+        snapshot = _snapshot(timedelta(hours=1), over_allocation=True,
+                             burn_rate=timedelta(seconds=1))
+        self.assertEquals(monitoring._exhaustion_date(snapshot),
+                          snapshot["calculated"])
+
+    def test_over_allocation_enforced_recently_is_backed_off(self):
+        snapshot = _snapshot(timedelta(hours=1), over_allocation=True,
+                             burn_rate=timedelta(seconds=1))
+        retry = snapshot["calculated"] + timedelta(minutes=15)
+        self.assertEquals(monitoring._exhaustion_date(snapshot, retry),
+                          retry)
+
+
+class EnforcementQueueTests(TestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        self.identity = IdentityFactory.create(
+            created_by=UserFactory.create(), provider=ProviderFactory.create())
+
+    def cache_over_allocation(self):
+        snapshot = _snapshot(timedelta(hours=1), over_allocation=True,
+                             burn_rate=timedelta(seconds=1))
+        with mock.patch('service.monitoring.allocation_snapshot',
+                        return_value=snapshot),\
+                self.settings(ENFORCING=True):
+            monitoring._cache_allocation_results([self.identity], [None])
+
+    def test_over_allocation_is_queued_now(self):
+        self.cache_over_allocation()
+        self.assertEquals(pop_exhausted_allocations(timezone.now()),
+                          [self.identity.id])
+
+    def test_enforced_allocation_is_queued_after_the_retry(self):
+        now = timezone.now()
+        set_allocations_enforced([self.identity.id], now)
+        self.cache_over_allocation()
+        self.assertEquals(pop_exhausted_allocations(
+            now + timedelta(seconds=ALLOCATION_ENFORCE_RETRY - 1)), [])
+        self.assertEquals(pop_exhausted_allocations(
+            now + timedelta(seconds=ALLOCATION_ENFORCE_RETRY)),
+            [self.identity.id])
+
+    def test_deleted_identity_is_skipped(self):
+        identity_id = self.identity.id
+        self.identity.delete()
+        with mock.patch('service.tasks.monitoring._get_allocation_results')\
+                as get_allocation_results:
+            enforce_allocation_for(identity_id)
+        self.assertFalse(get_allocation_results.called)
+
+
+def _over_allocation_result():
+    return mock.Mock(**{'total_difference.return_value': (True, 60)})
+
+
+class UsersOverAllocationTests(TestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        self.provider = ProviderFactory.create()
+        self.identities = {}
+        for username in ("first", "second"):
+            identity = IdentityFactory.create(
+                created_by=UserFactory.create(username=username),
+                provider=self.provider)
+            Credential.objects.create(
+                key='ex_project_name', value=username, identity=identity)
+            self.identities[username] = identity
+
+    def enforce(self, **kwargs):
+        with mock.patch('service.monitoring.get_allocation'),\
+                self.settings(ENFORCING=True):
+            return monitoring.users_over_allocation_enforcement(
+                self.provider, ["first", "second", "missing"],
+                allocation_results=dict(
+                    (username, _over_allocation_result())
+                    for username in ("first", "second", "missing")),
+                **kwargs)
+
+    def test_every_user_is_enforced_at_once(self):
+        with mock.patch('service.monitoring.enforce_allocation_policies')\
+                as enforce_allocation_policies,\
+                mock.patch.object(monitoring,
+                                  '_get_identity_from_tenant_name')\
+                as get_identity:
+            self.enforce()
+        self.assertFalse(get_identity.called)
+        enforce_allocation_policies.assert_called_once_with([
+            (self.identities[username], self.identities[username].created_by)
+            for username in ("first", "second")])
+
+    def test_identities_are_loaded_at_once(self):
+        identities = monitoring._get_identities_from_tenant_names(
+            self.provider, ["first", "second", "missing"])
+        self.assertEquals(identities, self.identities)
+
+    def test_failed_enforcement_is_retried_later(self):
+        with mock.patch('service.monitoring.enforce_allocation_policies',
+                        side_effect=Exception("Unavailable")):
+            self.enforce()
+        self.assertEquals(
+            sorted(get_enforcement_retries(
+                identity.id for identity in self.identities.values())),
+            sorted(identity.id for identity in self.identities.values()))
+
+
+class ProviderEnforcementTests(TestCase):
+
+    def setUp(self):
+        self.provider = mock.Mock(**{'over_allocation_action.name': 'Suspend'})
+        self.identity_users = [
+            (mock.Mock(id=identity_id), "user%s" % identity_id)
+            for identity_id in range(4)]
+        self.drivers = dict(
+            (identity, mock.Mock(**{
+                'list_instances.return_value': [
+                    mock.Mock(id="%s-active" % identity.id),
+                    mock.Mock(id="%s-stopped" % identity.id)],
+                '_is_active_instance.side_effect':
+                    lambda instance: instance.id.endswith("-active")}))
+            for identity, _ in self.identity_users)
+        patchers = [
+            mock.patch('service.monitoring.get_cached_driver',
+                       side_effect=lambda identity: self.drivers[identity]),
+            mock.patch('service.monitoring._execute_provider_action'),
+            mock.patch('service.monitoring._wait_for_enforcement'),
+            mock.patch('service.monitoring.release_cached_drivers'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def enforced(self):
+        (provider, enforced), _ = monitoring._wait_for_enforcement.call_args
+        self.assertIs(provider, self.provider)
+        return sorted(instance.id for _, _, instance in enforced)
+
+    def test_active_instances_are_enforced_concurrently(self):
+        monitoring.provider_over_allocation_enforcement(
+            self.provider, self.identity_users)
+        self.assertEquals(self.enforced(),
+                          ["%s-active" % identity_id
+                           for identity_id in range(4)])
+        self.assertEquals(monitoring._execute_provider_action.call_count, 4)
+        self.assertEquals(monitoring.release_cached_drivers.call_count, 8)
+
+    def test_failures_do_not_stop_the_others(self):
+        failing = self.identity_users[1][0]
+        self.drivers[failing].list_instances.side_effect = Exception(
+            "Unavailable")
+
+        def execute_provider_action(identity, user, instance, action_name):
+            if instance.id == "2-active":
+                raise Exception("Unable to suspend")
+        monitoring._execute_provider_action.side_effect = \
+            execute_provider_action
+        monitoring.provider_over_allocation_enforcement(
+            self.provider, self.identity_users)
+        self.assertEquals(self.enforced(), ["0-active", "3-active"])
+
+
+class UpdateEnforcedInstancesTests(TestCase):
+
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            created_by=UserFactory.create(), provider=self.provider)
+        self.admin_driver = mock.Mock(**{
+            'list_all_instances.return_value': [
+                mock.Mock(id="active"), mock.Mock(id="suspended")],
+            '_is_active_instance.side_effect':
+                lambda instance: instance.id == "active"})
+        patchers = [
+            mock.patch('service.monitoring.get_cached_driver',
+                       side_effect=lambda provider=None, identity=None:
+                       self.admin_driver if provider else mock.Mock()),
+            mock.patch('service.monitoring.convert_esh_instance'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_inactive_instances_are_updated(self):
+        still_active = monitoring.update_enforced_instances(
+            self.provider, [(self.identity.id, "active"),
+                            (self.identity.id, "suspended")])
+        self.assertEquals(still_active, [(self.identity.id, "active")])
+        self.assertEquals(monitoring.convert_esh_instance.call_count, 1)
+        esh_instance = monitoring.convert_esh_instance.call_args[0][1]
+        self.assertEquals(esh_instance.id, "suspended")
+
+    def test_unlisted_instances_are_dropped(self):
+        still_active = monitoring.update_enforced_instances(
+            self.provider, [(self.identity.id, "terminated"),
+                            (self.identity.id + 1, "suspended")])
+        self.assertEquals(still_active, [])
+        self.assertFalse(monitoring.convert_esh_instance.called)
+        # Every instance is listed at once
+        self.assertEquals(self.admin_driver.list_all_instances.call_count, 1)
+
+    def test_failed_update_does_not_stop_the_others(self):
+        monitoring.convert_esh_instance.side_effect = Exception("Unavailable")
+        still_active = monitoring.update_enforced_instances(
+            self.provider, [(self.identity.id, "suspended"),
+                            (self.identity.id, "active")])
+        self.assertEquals(still_active, [(self.identity.id, "active")])
@@ -0,0 +1,129 @@
+"""
+test the cached allocation snapshots of identities
+"""
+from datetime import timedelta
+
+import mock
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests import FakeRedis
+from api.tests.factories import UserFactory, ProviderFactory,\
+    InstanceSourceFactory, InstanceFactory, SizeFactory, IdentityFactory
+from core.models import InstanceStatusHistory
+from service import monitoring
+from service.cache import set_cached_allocations, pop_stale_allocations
+
+
+def _snapshot(difference, over_allocation=False, burn_rate=timedelta(0),
+              calculated=None):
+    calculated = calculated or timezone.now()
+    return {
+        "over_allocation": over_allocation,
+        "difference": difference,
+        "credit": timedelta(hours=10),
+        "runtime": timedelta(hours=10) - difference,
+        "burn_rate": burn_rate,
+        "time_to_zero": calculated + difference,
+        "calculated": calculated,
+        "counted_until": calculated,
+    }
+
+
+class ProjectSnapshotTests(TestCase):
+
+    def test_idle_snapshot_is_unchanged(self):
+        snapshot = _snapshot(timedelta(hours=1),
+                             calculated=timezone.now() - timedelta(hours=2))
+        self.assertEquals(monitoring.project_allocation_snapshot(snapshot),
+                          snapshot)
+
+    def test_time_is_used_at_the_burn_rate(self):
+        calculated = timezone.now() - timedelta(hours=2)
+        snapshot = _snapshot(timedelta(hours=5), burn_rate=timedelta(
+            seconds=2), calculated=calculated)
+        projected = monitoring.project_allocation_snapshot(
+            snapshot, now=calculated + timedelta(hours=2))
+        self.assertFalse(projected["over_allocation"])
+        self.assertEquals(projected["difference"], timedelta(hours=1))
+        self.assertEquals(projected["runtime"], timedelta(hours=9))
+
+    def test_projection_runs_over_allocation(self):
+        calculated = timezone.now() - timedelta(hours=2)
+        snapshot = _snapshot(timedelta(hours=1), burn_rate=timedelta(
+            seconds=1), calculated=calculated)
+        projected = monitoring.project_allocation_snapshot(
+            snapshot, now=calculated + timedelta(hours=2))
+        self.assertTrue(projected["over_allocation"])
+        self.assertEquals(projected["difference"], timedelta(hours=1))
+
+    def test_time_counted_ahead_is_not_projected(self):
+        calculated = timezone.now() - timedelta(hours=2)
+        snapshot = _snapshot(timedelta(hours=1), burn_rate=timedelta(
+            seconds=1), calculated=calculated)
+        snapshot["counted_until"] = calculated + timedelta(days=1)
+        self.assertEquals(monitoring.project_allocation_snapshot(
+            snapshot, now=calculated + timedelta(hours=2)), snapshot)
+
+
+class SnapshotCacheTests(TestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch('service.cache.connection', FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        provider = ProviderFactory.create()
+        user = UserFactory.create()
+        self.identity = IdentityFactory.create(
+            created_by=user, provider=provider)
+        self.instance = InstanceFactory.create(
+            created_by=user, created_by_identity=self.identity,
+            source=InstanceSourceFactory.create(provider=provider))
+        self.size = SizeFactory.create(provider=provider)
+
+    def test_cached_snapshot_is_not_recalculated(self):
+        snapshot = _snapshot(timedelta(hours=1))
+        set_cached_allocations({self.identity.id: snapshot})
+        with mock.patch('service.monitoring._get_allocation_result')\
+                as get_allocation_result:
+            self.assertEquals(
+                monitoring.get_allocation_snapshot(self.identity), snapshot)
+        self.assertFalse(get_allocation_result.called)
+
+    def test_history_changes_queue_the_instance(self):
+        InstanceStatusHistory.create_history(
+            'active', self.instance, self.size,
+            self.instance.start_date).save()
+        self.assertEquals(pop_stale_allocations(), ([], [self.instance.id]))
+        self.assertEquals(pop_stale_allocations(), ([], []))
+
+    def test_stale_snapshots_are_recalculated_once(self):
+        monitoring.invalidate_allocation_snapshots(
+            identity_ids=[self.identity.id], instance_ids=[self.instance.id])
+        with mock.patch('service.monitoring._get_allocation_results')\
+                as get_allocation_results:
+            monitoring.update_stale_allocation_snapshots()
+            monitoring.update_stale_allocation_snapshots()
+        get_allocation_results.assert_called_once_with([self.identity])
+
+    def test_failed_recalculation_is_queued_again(self):
+        monitoring.invalidate_allocation_snapshots(
+            identity_ids=[self.identity.id])
+        with mock.patch('service.monitoring._get_allocation_results',
+                        side_effect=ValueError):
+            self.assertRaises(
+                ValueError, monitoring.update_stale_allocation_snapshots)
+        self.assertEquals(pop_stale_allocations(), ([self.identity.id], []))
+
+    def test_reports_are_not_persisted(self):
+        with mock.patch('service.monitoring._get_allocation_inputs'),\
+                mock.patch('service.monitoring.calculate_allocations',
+                           return_value=[mock.Mock()]),\
+                mock.patch('service.monitoring._save_checkpoints')\
+                as save_checkpoints,\
+                mock.patch('service.monitoring._cache_allocation_results')\
+                as cache_allocation_results:
+            monitoring._get_allocation_results([self.identity],
+                                               persist=False)
+        self.assertFalse(save_checkpoints.called)
+        self.assertFalse(cache_allocation_results.called)
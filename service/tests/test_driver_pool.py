@@ -0,0 +1,110 @@
+"""
+test the pool of drivers checked out per thread
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import mock
+from django.test import TestCase
+
+from api.tests import FakeRedis
+from service import cache
+
+
+class DriverPoolTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patchers = [
+            mock.patch('service.cache.connection', self.redis),
+            mock.patch('service.cache.driver_pool', OrderedDict()),
+            mock.patch('service.cache.driver_leases', threading.local()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(cache.release_cached_drivers)
+
+    def check_out(self, identity_id=1, force=False):
+        # object() has no connection, so its token never expires
+        return cache._pooled_driver(("identity", identity_id), 1,
+                                    identity_id, object, force)
+
+    def check_out_in_thread(self, identity_id=1, release=True):
+        drivers = []
+
+        def run():
+            drivers.append(self.check_out(identity_id))
+            if release:
+                cache.release_cached_drivers()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return drivers[0]
+
+    def pooled(self):
+        return [entry[0] for idle in cache.driver_pool.values()
+                for entry in idle]
+
+    def test_driver_is_reused_after_release(self):
+        driver = self.check_out()
+        self.assertIs(self.check_out(), driver)
+        cache.release_cached_drivers()
+        self.assertEquals(self.pooled(), [driver])
+        self.assertIs(self.check_out(), driver)
+        self.assertEquals(self.pooled(), [])
+
+    def test_checked_out_driver_is_not_shared(self):
+        driver = self.check_out()
+        other_driver = self.check_out_in_thread()
+        self.assertIsNot(other_driver, driver)
+        self.assertEquals(self.pooled(), [other_driver])
+
+    def test_credentials_are_read_once_per_checkout(self):
+        with mock.patch.object(self.redis, 'mget',
+                               wraps=self.redis.mget) as mget:
+            self.check_out()
+            self.check_out()
+            self.check_out()
+        self.assertEquals(mget.call_count, 1)
+
+    def test_force_replaces_the_driver(self):
+        driver = self.check_out()
+        self.assertIsNot(self.check_out(force=True), driver)
+
+    def test_least_recently_used_are_evicted(self):
+        self.check_out(identity_id=1)
+        self.check_out(identity_id=2)
+        newest = self.check_out(identity_id=3)
+        with self.settings(DRIVER_POOL_SIZE=1):
+            cache.release_cached_drivers()
+        self.assertEquals(self.pooled(), [newest])
+
+    def test_expired_drivers_are_replaced(self):
+        driver = self.check_out()
+        cache.release_cached_drivers()
+        with self.settings(DRIVER_POOL_TIMEOUT=0):
+            self.assertIsNot(self.check_out(), driver)
+
+    def test_changed_credentials_replace_the_driver(self):
+        driver = self.check_out()
+        cache.release_cached_drivers()
+        # As another process does (Its pool is not cleared)
+        self.redis.incr(cache.CREDENTIALS_KEY.format("identity.1"))
+        self.assertIsNot(self.check_out(), driver)
+
+    def test_invalidated_drivers_are_dropped(self):
+        self.check_out(identity_id=1)
+        self.check_out(identity_id=2)
+        cache.release_cached_drivers()
+        cache.invalidate_cached_driver(identity_id=1)
+        self.assertEquals(cache.driver_pool.keys(), [("identity", 2)])
+
+    def test_drivers_of_ended_threads_are_returned(self):
+        driver = self.check_out_in_thread(release=False)
+        # The locals of a thread are cleared just after join() returns
+        deadline = time.time() + 1
+        while not self.pooled() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals(self.pooled(), [driver])
@@ -0,0 +1,96 @@
+"""
+test the cached instance lists of providers and identities
+"""
+import mock
+import redis
+from django.test import TestCase
+
+from api.tests import FakeRedis
+from service import cache, cache_format
+
+
+def _instance(alias, tenant_id):
+    return mock.Mock(alias=alias, owner=tenant_id)
+
+
+def _identity(identity_id, username):
+    return mock.Mock(id=identity_id, created_by=mock.Mock(username=username))
+
+
+class UpdateCachedProviderListTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patchers = [
+            mock.patch('service.cache.connection', self.redis),
+            mock.patch.dict('service.cache.CACHED_LISTS', {
+                "instances": cache.CACHED_LISTS["instances"][:3] + (
+                    lambda instance: instance.alias, None)}),
+            mock.patch('service.cache._get_cached_driver'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.driver = cache._get_cached_driver.return_value
+        self.provider = mock.Mock(id=1)
+        self.lock_key = cache.SNAPSHOT_LOCK_KEY.format(
+            cache._list_key("instances", provider=self.provider))
+        self.identities = {}
+
+    def update(self, instances):
+        self.driver.list_all_instances.return_value = instances
+        return cache.update_cached_provider_list(
+            "instances", self.provider, lambda: self.identities, force=True)
+
+    def cached(self, provider=None, identity=None):
+        data = self.redis.get(
+            cache._list_key("instances", provider, identity))
+        return data and cache_format.loads_snapshots(data)
+
+    def test_instances_are_split_by_tenant(self):
+        first, second = _identity(1, "first"), _identity(2, "second")
+        unused = _identity(3, "unused")
+        self.identities = {first: "tenant-1", second: "tenant-2",
+                           unused: "tenant-3"}
+        self.update([_instance("a", "tenant-1"), _instance("b", "tenant-2"),
+                     _instance("c", "tenant-1")])
+        self.assertEquals(self.cached(provider=self.provider),
+                          ["a", "b", "c"])
+        self.assertEquals(self.cached(identity=first), ["a", "c"])
+        self.assertEquals(self.cached(identity=second), ["b"])
+        self.assertEquals(self.cached(identity=unused), [])
+
+    def test_instances_without_tenant_are_not_split(self):
+        first = _identity(1, "first")
+        self.identities = {first: "tenant-1"}
+        self.update([_instance("a", "tenant-1"), _instance("b", None)])
+        self.assertEquals(self.cached(provider=self.provider), ["a", "b"])
+        self.assertIsNone(self.cached(identity=first))
+
+    def test_lock_is_released(self):
+        self.update([])
+        self.assertIsNone(self.redis.get(self.lock_key))
+
+    def test_lock_of_another_caller_is_not_released(self):
+        # The lock expired during the listing and was taken by another caller
+        self.driver.list_all_instances.side_effect = lambda: self.redis.set(
+            self.lock_key, "another") and []
+        self.update([])
+        self.assertEquals(self.redis.get(self.lock_key), "another")
+
+    def test_held_lock_is_not_listed_past_the_timeout(self):
+        self.redis.set(self.lock_key, "another")
+        with mock.patch('service.cache.CACHE_LOCK_TIMEOUT', 0):
+            self.assertIsNone(self.update([_instance("a", "tenant-1")]))
+        self.assertFalse(self.driver.list_all_instances.called)
+        self.assertEquals(self.redis.get(self.lock_key), "another")
+
+    def test_listed_without_redis(self):
+        unavailable = mock.Mock(**{
+            'set.side_effect': redis.exceptions.ConnectionError,
+            'ttl.side_effect': redis.exceptions.ConnectionError,
+            'pipeline.side_effect': redis.exceptions.ConnectionError})
+        instances = [_instance("a", "tenant-1")]
+        with mock.patch('service.cache.connection', unavailable):
+            self.assertEquals(self.update(instances), instances)
+        self.assertFalse(unavailable.register_script.called)